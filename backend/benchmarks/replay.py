@@ -0,0 +1,408 @@
+"""
+按访问日志重放请求
+
+把 backend/logs 中记录的请求整理成负载，按原来的先后顺序和间隔重放，
+统计每个路由的 p50 / p95 / p99 延迟和吞吐量，并与保存的基线比较。支持两种日志：
+    - 应用日志 logs/YYYY-MM-DD.log（main.log_requests 写入，带时间和耗时；
+      较早的日志没有查询参数）
+    - gunicorn / uvicorn 访问日志（带查询参数，没有时间，按顺序连续发送）
+日志中缺少的必需参数按同一城市上一次请求的值补齐，没有时使用默认值
+（time_point 为数据的最后一个月，categories 为全部等级）。
+
+两种目标：
+    in-process  默认。日志中的每个城市换成一个合成城市（见 synthetic.py），请求在进程内
+                交给 ASGI 应用，只重放不需要数据库的路由，其余路由计入 skipped
+    --url       本地运行的后端，例如 http://localhost:8000
+
+重放速度：相邻请求的间隔先截断到 --max-gap 秒，再除以 --speedup；--speedup 0 表示
+忽略间隔，在 --concurrency 的限制下尽快发送。按时间重放时延迟从请求应当发出的时刻算起，
+包括等待并发名额的时间。
+
+    cd backend
+    python -m benchmarks.replay --save-baseline benchmarks/results/replay-baseline.json
+    python -m benchmarks.replay --baseline benchmarks/results/replay-baseline.json
+
+发现退化时以状态码 1 退出。
+"""
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode
+
+import numpy as np
+from fastapi.routing import APIRoute
+
+import main
+from benchmarks.run import RESULTS_DIR, asgi_get, git_commit
+from benchmarks.synthetic import CITY_SIZES, generate_listings, to_snapshot
+from utils.classifier import TIER_NAMES
+from utils.logger import LOG_DIR, logger
+from utils.timeline import month_label
+
+try:
+    import requests
+except ImportError:
+    requests = None
+
+# [2025-01-22 09:39:37,377] INFO in main: Path: /city/Madrid | Method: GET | Status: 200 | Duration: 0.154s
+APP_LOG_PATTERN = re.compile(
+    r'^\[(?P<timestamp>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3})\] INFO in \w+: '
+    r'Path: (?P<path>\S+) \| Method: (?P<method>[A-Z]+) \| Status: (?P<status>\d+) \| '
+    r'Duration: (?P<duration>[\d.]+)s(?: \| Query: (?P<query>\S*))?$'
+)
+# 127.0.0.1:38028 - "GET /city/CapeTown/host_ranking?time_point=2017-06 HTTP/1.0" 200
+ACCESS_LOG_PATTERN = re.compile(r'"(?P<method>[A-Z]+) (?P<target>\S+) HTTP/[\d.]+" (?P<status>\d{3})')
+
+# 不需要数据库、可以在进程内重放的路由
+IN_PROCESS_ROUTES = {
+    '/city/{city_name}/host_ranking',
+    '/city/{city_name}/listings_by_categories',
+    '/city/{city_name}/hexgrid',
+    '/city/{city_name}/yearly_stats',
+    '/city/{city_name}/price_stats',
+    '/city/{city_name}/listings_by_count',
+    '/city/{city_name}/tiles/{z}/{x}/{y}.mvt',
+}
+
+# 各路由的必需参数及默认值，time_point 的默认值由目标提供
+REQUIRED_PARAMS = {
+    '/city/{city_name}/host_ranking': {'time_point': None},
+    '/city/{city_name}/listings_by_categories': {'time_point': None, 'categories': ','.join(TIER_NAMES)},
+    '/city/{city_name}/listings_by_count': {'time_point': None, 'listing_count': '2', 'view_type': 'scatter'},
+    '/city/{city_name}/price_stats': {'time_point': None},
+}
+
+
+class LoggedRequest:
+    """日志中的一条请求"""
+
+    def __init__(self, path: str, query: str, method: str, status: int,
+                 duration: Optional[float] = None, timestamp: Optional[float] = None):
+        self.path = path
+        self.query = query
+        self.method = method
+        self.status = status
+        self.duration = duration
+        self.timestamp = timestamp
+
+
+def parse_line(line: str) -> Optional[LoggedRequest]:
+    """解析一行应用日志或访问日志，不是请求记录时返回 None"""
+    match = APP_LOG_PATTERN.match(line.strip())
+    if match:
+        timestamp = datetime.strptime(match['timestamp'], '%Y-%m-%d %H:%M:%S,%f').timestamp()
+        return LoggedRequest(match['path'], match['query'] or '', match['method'], int(match['status']),
+                             float(match['duration']), timestamp)
+    match = ACCESS_LOG_PATTERN.search(line)
+    if match:
+        path, _, query = match['target'].partition('?')
+        return LoggedRequest(path, query, match['method'], int(match['status']))
+    return None
+
+
+def load_workload(paths: List[str]) -> List[LoggedRequest]:
+    """读取日志中的 GET 请求；带时间的请求按时间排序"""
+    workload = []
+    for path in paths:
+        with open(path, errors='replace') as f:
+            workload.extend(
+                request for request in map(parse_line, f)
+                if request is not None and request.method == 'GET'
+            )
+    if all(request.timestamp is not None for request in workload):
+        workload.sort(key=lambda request: request.timestamp)
+    return workload
+
+
+def match_route(path: str):
+    """返回 (路由模板, 路径参数)，不是应用的路由时返回 (None, None)"""
+    for route in main.app.routes:
+        if isinstance(route, APIRoute):
+            match = route.path_regex.match(path)
+            if match:
+                return route.path, match.groupdict()
+    return None, None
+
+
+class InProcessTarget:
+    """进程内的应用，日志中的城市换成合成城市"""
+
+    name = 'in-process'
+    routes = IN_PROCESS_ROUTES
+
+    def __init__(self, cities: List[str], n_listings: int):
+        self.time_points = {}
+        for seed, city in enumerate(sorted(cities)):
+            snapshot = to_snapshot(generate_listings(n_listings, city, seed=seed))
+            main.snapshot_store.put(snapshot)
+            self.time_points[city] = month_label(snapshot.timeline.end_month)
+
+    def default_time_point(self, city: str) -> str:
+        return self.time_points[city]
+
+    async def get(self, path: str, query: str) -> int:
+        status, _, _ = await asgi_get(path, query)
+        return status
+
+    def close(self):
+        pass
+
+
+class HttpTarget:
+    """本地运行的后端"""
+
+    name = 'http'
+    routes = None
+
+    def __init__(self, url: str, concurrency: int, time_point: str = None):
+        if requests is None:
+            raise RuntimeError("Replaying against a URL requires the requests package")
+        self.url = url.rstrip('/')
+        self.time_point = time_point
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._latest = {}
+
+    def default_time_point(self, city: str) -> Optional[str]:
+        if self.time_point:
+            return self.time_point
+        if city not in self._latest:
+            # 城市数据的最后一个月
+            try:
+                response = self.session.get(f'{self.url}/city/{city}', timeout=30)
+                self._latest[city] = response.json()['time_window']['latest'][:7]
+            except Exception as e:
+                logger.error(f"Failed to read time window of {city}: {e}")
+                self._latest[city] = None
+        return self._latest[city]
+
+    def _get(self, path: str, query: str) -> int:
+        response = self.session.get(f'{self.url}{path}' + (f'?{query}' if query else ''), timeout=300)
+        return response.status_code
+
+    async def get(self, path: str, query: str) -> int:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self._get, path, query)
+        except requests.RequestException:
+            return 0
+
+    def close(self):
+        self.executor.shutdown()
+        self.session.close()
+
+
+def prepare(workload: List[LoggedRequest], target) -> tuple:
+    """
+    把日志请求转成 (路由模板, 路径, 查询参数, 时间) 列表，补齐缺少的参数；
+    同时返回跳过的请求数（按原因）
+    """
+    prepared, skipped = [], {}
+    last_params: Dict[str, dict] = {}
+    for request in workload:
+        route, path_params = match_route(request.path)
+        if route is None or (target.routes is not None and route not in target.routes):
+            reason = route or 'unknown route'
+            skipped[reason] = skipped.get(reason, 0) + 1
+            continue
+
+        params = dict(parse_qsl(request.query, keep_blank_values=True))
+        city = path_params.get('city_name')
+        if city is not None:
+            seen = last_params.setdefault(city, {})
+            for key, default in REQUIRED_PARAMS.get(route, {}).items():
+                if key not in params:
+                    value = seen.get(key) or default
+                    if value is None and key == 'time_point':
+                        value = target.default_time_point(city)
+                    if value is not None:
+                        params[key] = value
+            seen.update(params)
+
+        prepared.append((route, request.path, urlencode(params), request.timestamp))
+    return prepared, skipped
+
+
+def schedule(prepared: list, speedup: float, max_gap: float) -> List[Optional[float]]:
+    """每个请求相对开始的发送时间，不按时间重放时为 None"""
+    if speedup <= 0 or any(timestamp is None for *_, timestamp in prepared):
+        return [None] * len(prepared)
+    offsets, offset, previous = [], 0.0, None
+    for *_, timestamp in prepared:
+        if previous is not None:
+            offset += min(max(timestamp - previous, 0.0), max_gap) / speedup
+        offsets.append(offset)
+        previous = timestamp
+    return offsets
+
+
+async def replay(prepared: list, target, concurrency: int, speedup: float, max_gap: float):
+    """重放请求，返回 ([(路由模板, 延迟毫秒, 状态码)], 总耗时秒)"""
+    offsets = schedule(prepared, speedup, max_gap)
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+
+    async def send(route: str, path: str, query: str, offset: Optional[float]):
+        if offset is not None:
+            await asyncio.sleep(max(0.0, start + offset - time.perf_counter()))
+            begin = start + offset
+        async with semaphore:
+            if offset is None:
+                begin = time.perf_counter()
+            status = await target.get(path, query)
+            return route, (time.perf_counter() - begin) * 1000, status
+
+    results = await asyncio.gather(*(
+        send(route, path, query, offset)
+        for (route, path, query, _), offset in zip(prepared, offsets)
+    ))
+    return results, time.perf_counter() - start
+
+
+def summarize(results: list, wall_seconds: float, workload: List[LoggedRequest]) -> dict:
+    """按路由统计延迟分位数、吞吐量和错误数，附带日志中记录的原始耗时"""
+    logged: Dict[str, list] = {}
+    for request in workload:
+        route, _ = match_route(request.path)
+        if route is not None and request.duration is not None:
+            logged.setdefault(route, []).append(request.duration * 1000)
+
+    by_route: Dict[str, list] = {}
+    for route, latency, status in results:
+        by_route.setdefault(route, []).append((latency, status))
+
+    routes = {}
+    for route, samples in sorted(by_route.items()):
+        latencies = np.array([latency for latency, _ in samples])
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        routes[route] = {
+            'requests': len(samples),
+            'errors': sum(1 for _, status in samples if not 200 <= status < 400),
+            'throughput_rps': round(len(samples) / wall_seconds, 3) if wall_seconds else None,
+            'p50_ms': round(float(p50), 3),
+            'p95_ms': round(float(p95), 3),
+            'p99_ms': round(float(p99), 3),
+            'logged_p50_ms': round(float(np.median(logged[route])), 3) if route in logged else None
+        }
+    return routes
+
+
+def find_regressions(baseline: dict, current: dict, threshold: float, min_ms: float) -> List[str]:
+    """p50 / p95 / p99 比基线慢 threshold 以上且超过 min_ms 毫秒，或出现新的错误"""
+    regressions = []
+    for route, result in current['routes'].items():
+        before = baseline.get('routes', {}).get(route)
+        if before is None:
+            continue
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            old, new = before[key], result[key]
+            if new > old * (1 + threshold) and new - old > min_ms:
+                regressions.append(f"{route} {key[:3]}: {old:.1f}ms -> {new:.1f}ms ({(new / old - 1) * 100:+.0f}%)")
+        if result['errors'] > before['errors']:
+            regressions.append(f"{route} errors: {before['errors']} -> {result['errors']}")
+    return regressions
+
+
+def print_report(results: dict):
+    print(f"\n{'route':<46}{'reqs':>6}{'err':>5}{'rps':>9}{'p50':>10}{'p95':>10}{'p99':>10}{'logged p50':>12}")
+    for route, stats in results['routes'].items():
+        logged = f"{stats['logged_p50_ms']:.1f}" if stats['logged_p50_ms'] is not None else '-'
+        print(f"{route:<46}{stats['requests']:>6}{stats['errors']:>5}{stats['throughput_rps']:>9.2f}"
+              f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{logged:>12}")
+    if results['skipped']:
+        print("\nSkipped: " + ', '.join(f"{route} ({count})" for route, count in results['skipped'].items()))
+
+
+async def run(args) -> dict:
+    paths = args.logs or sorted(glob.glob(os.path.join(LOG_DIR, '????-??-??.log')))
+    workload = load_workload(paths)
+    if args.limit:
+        workload = workload[:args.limit]
+
+    if args.url:
+        target = HttpTarget(args.url, args.concurrency, args.time_point)
+    else:
+        cities = {
+            params['city_name'] for params in (match_route(request.path)[1] for request in workload)
+            if params and 'city_name' in params
+        }
+        target = InProcessTarget(sorted(cities), CITY_SIZES[args.size])
+
+    try:
+        prepared, skipped = prepare(workload, target)
+        print(f"Replaying {len(prepared)} of {len(workload)} logged requests from {len(paths)} files "
+              f"against {target.name} target")
+        results, wall_seconds = await replay(prepared, target, args.concurrency, args.speedup, args.max_gap)
+    finally:
+        target.close()
+
+    return {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'target': args.url or f'in-process ({args.size})',
+        'logs': [os.path.basename(path) for path in paths],
+        'requests': len(prepared),
+        'concurrency': args.concurrency,
+        'speedup': args.speedup,
+        'max_gap': args.max_gap,
+        'wall_seconds': round(wall_seconds, 3),
+        'skipped': skipped,
+        'routes': summarize(results, wall_seconds, workload)
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Replay logged requests and report per-route latency')
+    parser.add_argument('logs', nargs='*', help='log files, defaults to the dated logs in backend/logs')
+    parser.add_argument('--url', help='replay against a running backend instead of the in-process app')
+    parser.add_argument('--size', choices=list(CITY_SIZES), default='medium',
+                        help='synthetic city size for the in-process target')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--speedup', type=float, default=10.0, help='0 replays as fast as possible')
+    parser.add_argument('--max-gap', type=float, default=5.0, help='longest idle gap kept, in logged seconds')
+    parser.add_argument('--limit', type=int, help='only replay the first N logged requests')
+    parser.add_argument('--time-point', help='time_point for requests logged without one')
+    parser.add_argument('--output', help='result file, defaults to benchmarks/results/replay-<commit>-<time>.json')
+    parser.add_argument('--baseline', help='baseline result file to check for regressions')
+    parser.add_argument('--save-baseline', help='also write the results to this baseline file')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative slowdown counted as a regression')
+    parser.add_argument('--min-ms', type=float, default=5.0, help='ignore slowdowns smaller than this')
+    args = parser.parse_args()
+
+    # 重放产生的访问日志会淹没结果
+    logger.setLevel(logging.ERROR)
+    results = asyncio.run(run(args))
+    print_report(results)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"replay-{results['commit']}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    for path in filter(None, (output, args.save_baseline)):
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(json.load(f), results, args.threshold, args.min_ms)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            raise SystemExit(1)
+        print("\nNo regressions against baseline")
+
+
+if __name__ == '__main__':
+    main_cli()
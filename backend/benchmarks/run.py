@@ -0,0 +1,276 @@
+"""
+离线基准测试
+
+用 benchmarks/synthetic.py 生成的城市测量各接口的计算路径，不需要数据库：
+合成数据直接转成快照放进 snapshot_store，请求在进程内交给 ASGI 应用处理，
+经过与线上相同的中间件、分级、网格和序列化，只是没有网络和数据库加载。
+
+每个场景测两种情况：
+    cold  每次请求前换上新的快照对象并清空分级、金字塔、价格草图、yearly_stats 缓存
+          （相当于数据版本变化后的第一个请求）
+    warm  各级缓存已经就绪，只清空 HTTP 响应缓存，测量缓存命中路径
+耗时包括各阶段的 Server-Timing（见 utils/timing.py）。
+
+结果保存为 JSON，包含提交号和数据集参数，用 --compare 与之前的结果对比：
+
+    cd backend
+    python -m benchmarks.run --size large
+    python -m benchmarks.run --size large --compare benchmarks/results/large-<commit>-<time>.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime
+from typing import Dict, List, Tuple
+from urllib.parse import urlencode
+
+import numpy as np
+
+import main
+from benchmarks.synthetic import CITY_SIZES, generate_listings, to_snapshot
+from utils.classifier import TIER_NAMES
+from utils.logger import logger
+from utils.timeline import month_label
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+ALL_CATEGORIES = ','.join(TIER_NAMES)
+
+# (名称, 路径, 参数)；路径相对 /city/{city}，time_point 在运行时填入数据的最后一个月
+SCENARIOS = [
+    ('host_ranking', '/host_ranking', {}),
+    ('listings_by_categories', '/listings_by_categories', {'categories': ALL_CATEGORIES}),
+    ('listings_by_categories_columns', '/listings_by_categories', {'categories': ALL_CATEGORIES, 'format': 'columns'}),
+    ('hexgrid', '/hexgrid', {'categories': ALL_CATEGORIES}),
+    ('hexgrid_composition', '/hexgrid', {'categories': ALL_CATEGORIES, 'view_type': 'composition'}),
+    ('yearly_stats', '/yearly_stats', None),
+    ('price_stats', '/price_stats', {'categories': ALL_CATEGORIES}),
+    ('listings_by_count_scatter', '/listings_by_count', {'listing_count': 2, 'view_type': 'scatter'}),
+    ('listings_by_count_grid', '/listings_by_count', {'listing_count': 2, 'view_type': 'grid'}),
+]
+
+
+async def asgi_get(path: str, query: str) -> Tuple[int, Dict[str, str], bytes]:
+    """在进程内把 GET 请求交给 ASGI 应用，返回 (状态码, 响应头, 响应体)"""
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode('utf-8'),
+        'root_path': '',
+        'query_string': query.encode('utf-8'),
+        'headers': [(b'host', b'benchmark'), (b'accept-encoding', b'gzip')],
+        'client': ('127.0.0.1', 0),
+        'server': ('benchmark', 80)
+    }
+    status, headers, body = 500, {}, []
+    requested = False
+    finished = asyncio.Event()
+
+    async def receive():
+        # 请求体只有一次，之后和真实服务器一样等到响应结束才报告断开
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status, headers
+        if message['type'] == 'http.response.start':
+            status = message['status']
+            headers = {k.decode('latin-1'): v.decode('latin-1') for k, v in message['headers']}
+        elif message['type'] == 'http.response.body':
+            body.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                finished.set()
+
+    await main.app(scope, receive, send)
+    return status, headers, b''.join(body)
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """Server-Timing 头中各阶段的毫秒数"""
+    stages = {}
+    for item in filter(None, (part.strip() for part in (header or '').split(','))):
+        name, _, duration = item.partition(';dur=')
+        if duration:
+            stages[name] = float(duration)
+    return stages
+
+
+def summarize(samples: List[float], stages: List[Dict[str, float]]) -> dict:
+    values = np.array(samples)
+    names = sorted({name for run in stages for name in run})
+    return {
+        'runs': len(samples),
+        'median_ms': round(float(np.median(values)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'min_ms': round(float(values.min()), 3),
+        'max_ms': round(float(values.max()), 3),
+        'stages_median_ms': {
+            name: round(float(np.median([run.get(name, 0.0) for run in stages])), 3)
+            for name in names
+        }
+    }
+
+
+class Benchmark:
+    def __init__(self, listings, runs: int, cold_runs: int):
+        self.listings = listings
+        self.city = listings['city'].iloc[0]
+        self.runs = runs
+        self.cold_runs = cold_runs
+        self.snapshot = to_snapshot(listings)
+        self.time_point = month_label(self.snapshot.timeline.end_month)
+
+    def reset(self):
+        """换上新的快照并清空派生缓存"""
+        main.snapshot_store.put(to_snapshot(self.listings))
+        main.host_classifier.invalidate(self.city)
+        main.hex_pyramid.invalidate(self.city)
+        main.price_stats.invalidate(self.city)
+        main.yearly_stats.invalidate(self.city)
+        main.http_body_cache.invalidate()
+
+    async def measure(self, path: str, query: str):
+        # 每次都绕过 HTTP 响应缓存，测量的是计算路径
+        main.http_body_cache.invalidate()
+        start = time.perf_counter()
+        status, headers, body = await asgi_get(path, query)
+        elapsed = (time.perf_counter() - start) * 1000
+        if status != 200:
+            raise RuntimeError(f"{path}?{query} returned {status}: {body[:200]!r}")
+        return elapsed, parse_server_timing(headers.get('server-timing')), len(body)
+
+    async def run_scenario(self, route: str, params) -> dict:
+        path = f'/city/{self.city}{route}'
+        if params is not None:
+            params = dict(params, time_point=self.time_point)
+        query = urlencode(params or {})
+
+        cold, cold_stages = [], []
+        for _ in range(self.cold_runs):
+            self.reset()
+            elapsed, stages, size = await self.measure(path, query)
+            cold.append(elapsed)
+            cold_stages.append(stages)
+
+        self.reset()
+        await self.measure(path, query)
+        warm, warm_stages = [], []
+        for _ in range(self.runs):
+            elapsed, stages, size = await self.measure(path, query)
+            warm.append(elapsed)
+            warm_stages.append(stages)
+
+        return {
+            'path': f'{path}?{query}' if query else path,
+            'response_bytes': size,
+            'cold': summarize(cold, cold_stages),
+            'warm': summarize(warm, warm_stages)
+        }
+
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], text=True).strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(baseline: dict, current: dict):
+    """打印各场景 median 的变化"""
+    print(f"\n{'scenario':<34}{'mode':<6}{'baseline':>12}{'current':>12}{'change':>9}")
+    for name, result in current['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        for mode in ('cold', 'warm'):
+            old, new = before[mode]['median_ms'], result[mode]['median_ms']
+            change = f"{(new / old - 1) * 100:+.1f}%" if old else '-'
+            print(f"{name:<34}{mode:<6}{old:>10.2f}ms{new:>10.2f}ms{change:>9}")
+    if baseline.get('dataset') != current['dataset']:
+        print("\nWarning: datasets differ, results are not directly comparable")
+
+
+async def run(args) -> dict:
+    n_listings = args.listings or CITY_SIZES[args.size]
+    city = f'Synthetic-{args.size}' if not args.listings else f'Synthetic-{n_listings}'
+    listings = generate_listings(n_listings, city, seed=args.seed)
+    if args.csv:
+        listings.to_csv(args.csv, index=False)
+        print(f"Wrote synthetic listings to {args.csv}")
+
+    bench = Benchmark(listings, args.runs, args.cold_runs)
+    selected = set(args.only.split(',')) if args.only else None
+    scenarios = {}
+    for name, route, params in SCENARIOS:
+        if selected is not None and name not in selected:
+            continue
+        scenarios[name] = result = await bench.run_scenario(route, params)
+        print(f"{name:<34}cold {result['cold']['median_ms']:>9.2f}ms   warm {result['warm']['median_ms']:>9.2f}ms")
+
+    return {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'dataset': {
+            'size': args.size if not args.listings else None,
+            'listings': n_listings,
+            'hosts': int(listings['host_id'].nunique()),
+            'seed': args.seed,
+            'time_point': bench.time_point
+        },
+        'runs': args.runs,
+        'cold_runs': args.cold_runs,
+        'scenarios': scenarios
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Benchmark the API compute paths on synthetic listings')
+    parser.add_argument('--size', choices=list(CITY_SIZES), default='medium', help='synthetic city size')
+    parser.add_argument('--listings', type=int, help='number of listings, overrides --size')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--runs', type=int, default=10, help='warm runs per scenario')
+    parser.add_argument('--cold-runs', type=int, default=3, help='cold runs per scenario')
+    parser.add_argument('--only', help='comma separated scenario names')
+    parser.add_argument('--output', help='result file, defaults to benchmarks/results/<size>-<commit>-<time>.json')
+    parser.add_argument('--compare', help='baseline result file to compare against')
+    parser.add_argument('--csv', help='also write the synthetic listings to this CSV file')
+    args = parser.parse_args()
+
+    # 每个请求的访问日志会淹没结果
+    logger.setLevel(logging.ERROR)
+    results = asyncio.run(run(args))
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        label = args.size if not args.listings else str(args.listings)
+        output = os.path.join(RESULTS_DIR, f"{label}-{results['commit']}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main_cli()
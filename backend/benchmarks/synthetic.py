@@ -0,0 +1,149 @@
+"""
+合成 listings 数据
+
+生成与 listings 表列一致的数据（id、name、host_id、latitude、longitude、first_review、
+price、processed_price、city、geom），用于在没有真实数据和数据库时测量各接口的计算路径：
+    - 房东规模服从截断的 Zipf 分布：大部分房东只有 1 个房源，少数房东有上百个
+    - first_review 随市场增长逐年增多，同一房东的房源在首个房源之后陆续出现，
+      部分房源没有评论（first_review 为空）
+    - 坐标集中在若干热点附近，同一房东的房源在同一热点，少量房源没有坐标
+    - price 为 "$1,234.00" 形式的文本，processed_price 为其整数值，少量为空
+
+城市规模见 CITY_SIZES，large 约为纽约的房源数。同样的参数和 seed 总是生成同样的数据。
+"""
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils.snapshot import NO_REVIEW, CitySnapshot
+
+# 预设的城市规模（房源数）
+CITY_SIZES = {
+    'small': 2_000,
+    'medium': 15_000,
+    'large': 45_000
+}
+
+# 默认城市中心（纽约）
+DEFAULT_CENTER = (40.73, -73.96)
+
+
+def host_sizes(rng: np.random.Generator, n_listings: int, exponent: float, max_share: float) -> np.ndarray:
+    """各房东的房源数，总和为 n_listings，单个房东最多 max_share 的房源"""
+    cap = max(1, int(n_listings * max_share))
+    sizes = np.minimum(rng.zipf(exponent, n_listings), cap)
+    count = int(np.searchsorted(np.cumsum(sizes), n_listings)) + 1
+    sizes = sizes[:count]
+    sizes[-1] -= sizes.sum() - n_listings
+    return sizes
+
+
+def generate_listings(
+    n_listings: int,
+    city: str = 'Synthetic',
+    center: Tuple[float, float] = DEFAULT_CENTER,
+    seed: int = 0,
+    host_exponent: float = 2.3,
+    max_host_share: float = 0.01,
+    first_year: int = 2009,
+    last_year: int = 2024,
+    unreviewed_share: float = 0.2,
+    missing_coords_share: float = 0.005,
+    missing_price_share: float = 0.03
+) -> pd.DataFrame:
+    """生成一个城市的合成房源"""
+    rng = np.random.default_rng(seed)
+    sizes = host_sizes(rng, n_listings, host_exponent, max_host_share)
+    n_hosts = len(sizes)
+    host_of = np.repeat(np.arange(n_hosts), sizes)
+
+    # host_id 为不连续的大整数，和真实数据一样
+    host_ids = np.arange(1, n_hosts + 1, dtype=np.int64) * 1000 + rng.integers(0, 1000, n_hosts)
+
+    # 房东首个房源的月份，越接近现在越多
+    first_month, last_month = first_year * 12, last_year * 12 + 11
+    months = np.arange(first_month, last_month + 1)
+    weights = np.exp((months - first_month) / 60)
+    host_start = rng.choice(months, size=n_hosts, p=weights / weights.sum())
+    # 房东的其他房源在首个房源之后陆续出现，房源越多的房东持续时间越长
+    spread = rng.exponential(6 * np.log1p(sizes[host_of]))
+    spread[np.r_[0, np.cumsum(sizes)[:-1]]] = 0
+    # 超出时间范围的部分回绕到首个房源之后，避免堆积在最后一个月
+    start = host_start[host_of]
+    month = start + spread.astype(np.int64) % (last_month - start + 1)
+    day = rng.integers(1, 29, n_listings)
+    first_review = pd.to_datetime({
+        'year': month // 12,
+        'month': month % 12 + 1,
+        'day': day
+    })
+    first_review[rng.random(n_listings) < unreviewed_share] = pd.NaT
+
+    # 热点的位置和热度，同一房东的房源在同一热点附近
+    n_hotspots = max(3, n_listings // 3000)
+    lat0, lng0 = center
+    lng_scale = 1 / np.cos(np.radians(lat0))
+    hotspot_lat = lat0 + rng.normal(0, 0.06, n_hotspots)
+    hotspot_lng = lng0 + rng.normal(0, 0.06 * lng_scale, n_hotspots)
+    hotspot_spread = rng.uniform(0.005, 0.03, n_hotspots)
+    hotspot = rng.choice(n_hotspots, size=n_hosts, p=rng.dirichlet(np.ones(n_hotspots)))[host_of]
+    latitude = hotspot_lat[hotspot] + rng.normal(0, 1, n_listings) * hotspot_spread[hotspot]
+    longitude = hotspot_lng[hotspot] + rng.normal(0, 1, n_listings) * hotspot_spread[hotspot] * lng_scale
+    no_coords = rng.random(n_listings) < missing_coords_share
+    latitude[no_coords] = np.nan
+    longitude[no_coords] = np.nan
+
+    price_value = np.maximum(10, np.round(rng.lognormal(np.log(120), 0.6, n_listings)))
+    no_price = rng.random(n_listings) < missing_price_share
+    price = np.array([f"${value:,.2f}" for value in price_value.tolist()], dtype=object)
+    price[no_price] = None
+    processed_price = pd.array(np.where(no_price, 0, price_value).astype(np.int64), dtype='Int64')
+    processed_price[no_price] = pd.NA
+
+    geom = np.array([
+        f"SRID=4326;POINT({lng} {lat})" for lat, lng in zip(latitude.tolist(), longitude.tolist())
+    ], dtype=object)
+    geom[no_coords] = None
+
+    # 打乱行顺序，同一房东的房源不连续
+    order = rng.permutation(n_listings)
+    listing_ids = np.arange(1, n_listings + 1, dtype=np.int64)
+    return pd.DataFrame({
+        'id': listing_ids,
+        'name': [f"Synthetic listing {i}" for i in listing_ids.tolist()],
+        'host_id': host_ids[host_of][order],
+        'latitude': latitude[order],
+        'longitude': longitude[order],
+        'first_review': first_review.to_numpy()[order],
+        'price': price[order],
+        'processed_price': processed_price[order],
+        'city': city,
+        'geom': geom[order]
+    })
+
+
+def to_snapshot(listings: pd.DataFrame, city: str = None) -> CitySnapshot:
+    """按 SNAPSHOT_QUERY 的规则把合成房源转成快照，作为进程内的数据库替身"""
+    first_review = pd.DatetimeIndex(listings['first_review'])
+    reviewed = ~first_review.isna()
+    # 与 REVIEW_MONTH_SQL 相同：满足 first_review <= YYYY-MM-01 的最小月份
+    after_month_start = (first_review.day > 1) | (first_review.normalize() != first_review)
+    month = np.where(
+        reviewed,
+        first_review.year * 12 + first_review.month - 1 + after_month_start,
+        NO_REVIEW
+    )
+    review_year = np.where(reviewed, first_review.year, 0)
+
+    return CitySnapshot(
+        city or listings['city'].iloc[0],
+        listings['host_id'].to_numpy(),
+        month,
+        listings['latitude'].to_numpy(),
+        listings['longitude'].to_numpy(),
+        listings['processed_price'].to_numpy(dtype=np.float64, na_value=np.nan),
+        listings['name'].to_numpy(dtype=object, na_value=None),
+        listings['price'].to_numpy(dtype=object, na_value=None),
+        review_year=review_year
+    )
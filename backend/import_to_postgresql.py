@@ -1,10 +1,19 @@
 import os
+import gzip
+import time
+import argparse
+import multiprocessing
 import pandas as pd
 import psycopg2
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-import subprocess
 from sqlalchemy import create_engine
 import numpy as np
+from collections import Counter
+from utils.timeline import (
+    CREATE_TIMELINE_TABLE_SQL, build_host_timeline_table, review_month_sql, update_host_timeline_table
+)
+from utils.versions import CREATE_VERSIONS_TABLE_SQL, bump_data_version
+from utils.metadata import CREATE_CITY_METADATA_TABLE_SQL, refresh_city_metadata
 
 # 数据库配置
 DB_CONFIG = {
@@ -61,6 +70,7 @@ def create_table_sql(column_types):
     columns.append('"price" TEXT')
     columns.append('"processed_price" INTEGER')
     columns.append('geom geometry(Point, 4326)')  # 添加PostGIS几何字段
+    columns.append('"updated_at" TIMESTAMP NOT NULL DEFAULT now()')
     
     columns_str = ',\n        '.join(columns)
     
@@ -75,6 +85,8 @@ def create_indices_sql():
     """生成创建索引的SQL语句，包括空间索引"""
     return """
     CREATE INDEX IF NOT EXISTS idx_listings_city ON listings(city);
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_listings_city_id ON listings(city, id);
+    CREATE INDEX IF NOT EXISTS idx_listings_updated_at ON listings(updated_at);
     CREATE INDEX IF NOT EXISTS idx_listings_host_id ON listings(host_id);
     CREATE INDEX IF NOT EXISTS idx_listings_first_review ON listings(first_review);
     CREATE INDEX IF NOT EXISTS idx_listings_geom ON listings USING GIST(geom);
@@ -97,8 +109,287 @@ def analyze_data_structure():
     
     raise Exception("No CSV files found for analysis")
 
-def import_data():
-    """导入数据并创建空间数据"""
+# 每次抓取都会变化的列，增量导入判断房源是否变化时忽略
+VOLATILE_COLUMNS = {'scrape_id', 'last_scraped', 'calendar_last_scraped', 'source'}
+
+PROGRESS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS import_progress (
+        city TEXT PRIMARY KEY,
+        source_file TEXT NOT NULL,
+        rows BIGINT NOT NULL,
+        seconds DOUBLE PRECISION NOT NULL,
+        completed_at TIMESTAMP NOT NULL DEFAULT now()
+    )
+"""
+
+def find_city_files():
+    """返回 (city, listings.csv.gz 路径) 列表"""
+    city_files = []
+    for city in sorted(os.listdir(DATA_DIR)):
+        listings_file = os.path.join(DATA_DIR, city, "listings.csv.gz")
+        if os.path.exists(listings_file):
+            city_files.append((city, listings_file))
+    return city_files
+
+def import_city(args):
+    """
+    导入单个城市（在工作进程中运行）
+
+    gzip 文件流式 COPY 到临时表（不写 WAL），再用一条 INSERT ... SELECT 写入 listings，
+    同时填好 city 和 geom，只涉及该城市的数据，不再扫描整张表。
+    写入 listings 和记录 import_progress 在同一个事务里，失败时不会留下半个城市。
+    """
+    city, listings_file, columns = args
+    columns_str = ', '.join(f'"{col}"' for col in columns)
+    start = time.perf_counter()
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(f"""
+                CREATE TEMP TABLE staging_listings ON COMMIT DROP AS
+                SELECT {columns_str} FROM listings WITH NO DATA
+            """)
+            with gzip.open(listings_file, 'rb') as f:
+                cur.copy_expert(
+                    f"COPY staging_listings({columns_str}) FROM STDIN WITH (FORMAT csv, HEADER true)",
+                    f
+                )
+
+            cur.execute(f"""
+                INSERT INTO listings ({columns_str}, city, geom)
+                SELECT
+                    {columns_str},
+                    %s,
+                    ST_SetSRID(ST_MakePoint(
+                        CAST(longitude AS FLOAT),
+                        CAST(latitude AS FLOAT)
+                    ), 4326)
+                FROM staging_listings
+            """, (city,))
+            rows = cur.rowcount
+
+            seconds = time.perf_counter() - start
+            cur.execute("""
+                INSERT INTO import_progress (city, source_file, rows, seconds)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (city) DO UPDATE SET
+                    source_file = EXCLUDED.source_file,
+                    rows = EXCLUDED.rows,
+                    seconds = EXCLUDED.seconds,
+                    completed_at = now()
+            """, (city, listings_file, rows, seconds))
+    finally:
+        conn.close()
+
+    return city, rows, seconds
+
+# 时间线只统计有房东和评论的房源
+TIMELINE_EVENT_FILTER = "{alias}.host_id IS NOT NULL AND {alias}.first_review IS NOT NULL"
+
+def timeline_deltas(removed, added):
+    """
+    把移除和新增的 (host_id, 月份) 合并为时间线的 (房东, 月份, 房源数变化)，相互抵消的省略
+    """
+    deltas = Counter()
+    for host_id, month in removed:
+        deltas[(host_id, month)] -= 1
+    for host_id, month in added:
+        deltas[(host_id, month)] += 1
+    events = [(host_id, month, delta) for (host_id, month), delta in deltas.items() if delta]
+    return zip(*events) if events else ((), (), ())
+
+def delta_import_city(args):
+    """
+    增量导入单个城市（在工作进程中运行）
+
+    新快照 COPY 到临时表后按 listing id 与已有数据比较：
+    新房源插入，内容有变化的房源更新并刷新 updated_at，新快照中已不存在的房源删除。
+    删除、新增和 host_id / first_review 有变化的房源换算成 (房东, 月份) 的增减，
+    在同一个事务中累加到房东时间线并更新数据版本，提交前接口继续使用旧数据。
+    """
+    city, listings_file, columns = args
+    columns_str = ', '.join(f'"{col}"' for col in columns)
+    compared = [col for col in columns if col not in VOLATILE_COLUMNS]
+    changed_str = ', '.join(f'listings."{col}"' for col in compared)
+    excluded_str = ', '.join(f'EXCLUDED."{col}"' for col in compared)
+    set_str = ', '.join(f'"{col}" = EXCLUDED."{col}"' for col in columns if col != 'id')
+    start = time.perf_counter()
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(f"""
+                CREATE TEMP TABLE staging_listings ON COMMIT DROP AS
+                SELECT {columns_str} FROM listings WITH NO DATA
+            """)
+            with gzip.open(listings_file, 'rb') as f:
+                cur.copy_expert(
+                    f"COPY staging_listings({columns_str}) FROM STDIN WITH (FORMAT csv, HEADER true)",
+                    f
+                )
+            cur.execute("CREATE INDEX ON staging_listings (id)")
+
+            cur.execute(f"""
+                DELETE FROM listings
+                WHERE city = %s
+                AND NOT EXISTS (
+                    SELECT 1 FROM staging_listings s WHERE s.id = listings.id
+                )
+                RETURNING host_id, {review_month_sql('first_review')}, {TIMELINE_EVENT_FILTER.format(alias='listings')}
+            """, (city,))
+            deleted_rows = cur.fetchall()
+            deleted = len(deleted_rows)
+            removed = [(host_id, month) for host_id, month, has_event in deleted_rows if has_event]
+
+            # 新增房源和 (host_id, 评论月份) 有变化的已有房源，要在 upsert 之前读出旧值
+            old_month, new_month = review_month_sql('l.first_review'), review_month_sql('s.first_review')
+            cur.execute(f"""
+                SELECT
+                    l.host_id, {old_month}, l.id IS NOT NULL AND {TIMELINE_EVENT_FILTER.format(alias='l')},
+                    s.host_id, {new_month}, {TIMELINE_EVENT_FILTER.format(alias='s')}
+                FROM staging_listings s
+                LEFT JOIN listings l ON l.city = %s AND l.id = s.id
+                WHERE (l.host_id, {old_month}) IS DISTINCT FROM (s.host_id, {new_month})
+            """, (city,))
+            added = []
+            for old_host, old_review_month, had_event, new_host, new_review_month, has_event in cur.fetchall():
+                if had_event:
+                    removed.append((old_host, old_review_month))
+                if has_event:
+                    added.append((new_host, new_review_month))
+
+            # xmax = 0 的是新插入的行，其余为更新；内容没有变化的行不会被返回
+            cur.execute(f"""
+                WITH upserted AS (
+                    INSERT INTO listings ({columns_str}, city, geom, updated_at)
+                    SELECT
+                        {columns_str},
+                        %s,
+                        ST_SetSRID(ST_MakePoint(
+                            CAST(longitude AS FLOAT),
+                            CAST(latitude AS FLOAT)
+                        ), 4326),
+                        now()
+                    FROM staging_listings
+                    ON CONFLICT (city, id) DO UPDATE SET
+                        {set_str},
+                        geom = EXCLUDED.geom,
+                        updated_at = now()
+                    WHERE ({changed_str}) IS DISTINCT FROM ({excluded_str})
+                    RETURNING (xmax = 0) AS inserted
+                )
+                SELECT
+                    COUNT(*) FILTER (WHERE inserted),
+                    COUNT(*) FILTER (WHERE NOT inserted)
+                FROM upserted
+            """, (city,))
+            inserted, updated = cur.fetchone()
+
+            version = None
+            if inserted or updated or deleted:
+                # 还没有时间线的城市（如旧版本导入的数据）整体生成一次
+                cur.execute(CREATE_TIMELINE_TABLE_SQL)
+                cur.execute("SELECT EXISTS (SELECT 1 FROM host_monthly_listings WHERE city = %s)", (city,))
+                if cur.fetchone()[0]:
+                    update_host_timeline_table(cur, city, *timeline_deltas(removed, added))
+                else:
+                    build_host_timeline_table(cur, city)
+                version = bump_data_version(cur, city, inserted, updated, deleted)
+                refresh_city_metadata(cur, city, version)
+    finally:
+        conn.close()
+
+    return city, inserted, updated, deleted, version, time.perf_counter() - start
+
+def import_delta(workers: int = None):
+    """
+    用新快照增量更新所有城市，不重建 listings 表
+
+    只写入有变化的房源，每个城市更新后数据版本加 1，后端据此刷新缓存。
+    """
+    try:
+        conn = psycopg2.connect(**DB_CONFIG)
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        cur = conn.cursor()
+        
+        cur.execute("SELECT to_regclass('listings') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            raise Exception("listings table does not exist; run a full import first")
+        
+        column_types = analyze_data_structure()
+        columns = list(column_types.keys())
+        
+        # 旧表可能缺少 updated_at 和 (city, id) 唯一索引
+        cur.execute("ALTER TABLE listings ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT now()")
+        cur.execute(create_indices_sql())
+        cur.execute(CREATE_TIMELINE_TABLE_SQL)
+        cur.execute(CREATE_VERSIONS_TABLE_SQL)
+        cur.execute(CREATE_CITY_METADATA_TABLE_SQL)
+        
+        city_files = find_city_files()
+        changed_cities = []
+        failed_cities = []
+        workers = min(workers or os.cpu_count() or 1, max(len(city_files), 1))
+        with multiprocessing.Pool(workers) as pool:
+            tasks = {
+                city: pool.apply_async(delta_import_city, ((city, path, columns),))
+                for city, path in city_files
+            }
+            for city, task in tasks.items():
+                try:
+                    _, inserted, updated, deleted, version, seconds = task.get()
+                except Exception as e:
+                    failed_cities.append(city)
+                    print(f"Failed {city}: {str(e)}")
+                    continue
+                if version is not None:
+                    changed_cities.append(city)
+                print(f"{city}: {inserted} inserted, {updated} updated, {deleted} deleted "
+                      f"in {seconds:.1f}s" + (f" (version {version})" if version is not None else ""))
+        
+        if changed_cities:
+            cur.execute("ANALYZE listings")
+        print(f"Delta import completed: {len(changed_cities)} cities changed")
+        if failed_cities:
+            raise Exception(f"Delta import failed for {', '.join(failed_cities)}")
+        
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        raise
+    
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            conn.close()
+
+def cities_to_build(cur):
+    """
+    已导入但缺少数据版本、城市元数据，或元数据早于导入完成时间的城市，返回 (city, rows) 列表
+    """
+    cur.execute(CREATE_VERSIONS_TABLE_SQL)
+    cur.execute(CREATE_CITY_METADATA_TABLE_SQL)
+    cur.execute("""
+        SELECT p.city, p.rows
+        FROM import_progress p
+        LEFT JOIN city_data_versions v ON v.city = p.city
+        LEFT JOIN city_metadata m ON m.city = p.city
+        WHERE v.city IS NULL
+        OR m.city IS NULL
+        OR m.updated_at < p.completed_at
+        ORDER BY p.city
+    """)
+    return cur.fetchall()
+
+def import_data(workers: int = None, fresh: bool = False):
+    """
+    并行导入所有城市并创建空间数据
+
+    每个城市一个任务，已在 import_progress 中记录完成的城市会被跳过，
+    因此失败后重新运行即可从断点继续；fresh=True 时重建 listings 表从头导入。
+    索引、ANALYZE 和房东时间线在所有城市导入后统一生成。
+    """
     try:
         # 设置数据库和PostGIS
         setup_database()
@@ -107,69 +398,71 @@ def import_data():
         conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
         cur = conn.cursor()
         
-        # 分析数据结构并创建表
+        # 分析数据结构
         print("Analyzing data structure...")
         column_types = analyze_data_structure()
+        columns = list(column_types.keys())
+        
+        cur.execute("SELECT to_regclass('listings') IS NOT NULL")
+        table_exists = cur.fetchone()[0]
+        cur.execute(PROGRESS_TABLE_SQL)
+        cur.execute("SELECT city FROM import_progress")
+        completed = {row[0] for row in cur.fetchall()}
+        
+        # 创建表（有导入记录时保留已导入的数据继续导入）
+        if fresh or not table_exists or not completed:
+            print("Creating table...")
+            cur.execute(create_table_sql(column_types))
+            cur.execute("TRUNCATE import_progress")
+            # 重建后旧的城市元数据不再有效
+            cur.execute(CREATE_CITY_METADATA_TABLE_SQL)
+            cur.execute("TRUNCATE city_metadata")
+            completed = set()
         
-        # 创建表
-        print("Creating table...")
-        cur.execute(create_table_sql(column_types))
-        
-        # 遍历所有城市文件夹并导入数据
-        for city in os.listdir(DATA_DIR):
-            city_path = os.path.join(DATA_DIR, city)
-            if os.path.isdir(city_path):
-                listings_file = os.path.join(city_path, "listings.csv.gz")
-                if os.path.exists(listings_file):
-                    print(f"Importing {city}...")
-                    
-                    # 构建COPY命令
-                    columns = list(column_types.keys())
-                    columns_str = ', '.join(f'"{col}"' for col in columns)
-                    
-                    # 使用COPY导入基础数据
-                    copy_command = f"""\\COPY listings({columns_str}) FROM STDIN WITH (FORMAT csv, HEADER true)"""
-                    
-                    process = subprocess.Popen(
-                        ['gunzip', '-c', listings_file],
-                        stdout=subprocess.PIPE
-                    )
-                    
-                    psql_env = os.environ.copy()
-                    psql_env['PGPASSWORD'] = DB_CONFIG['password']
-                    
-                    psql_process = subprocess.Popen(
-                        [
-                            'psql',
-                            '-h', DB_CONFIG['host'],
-                            '-U', DB_CONFIG['user'],
-                            '-d', DB_CONFIG['database'],
-                            '-c', copy_command
-                        ],
-                        stdin=process.stdout,
-                        env=psql_env
-                    )
-                    
-                    psql_process.wait()
-                    
-                    # 更新城市名和几何数据
-                    print(f"Updating spatial data for {city}...")
-                    cur.execute("""
-                        UPDATE listings 
-                        SET 
-                            city = %s,
-                            geom = ST_SetSRID(ST_MakePoint(
-                                CAST(longitude AS FLOAT), 
-                                CAST(latitude AS FLOAT)
-                            ), 4326)
-                        WHERE city IS NULL
-                    """, (city,))
-                    
-                    print(f"Completed {city}")
+        pending = [(city, path) for city, path in find_city_files() if city not in completed]
+        if completed:
+            print(f"Resuming: {len(completed)} cities already imported, {len(pending)} remaining")
+        
+        # 每个城市文件一个任务，并行导入
+        imported_cities = {}
+        failed_cities = []
+        total_rows = 0
+        start = time.perf_counter()
+        workers = min(workers or os.cpu_count() or 1, max(len(pending), 1))
+        with multiprocessing.Pool(workers) as pool:
+            tasks = {
+                city: pool.apply_async(import_city, ((city, path, columns),))
+                for city, path in pending
+            }
+            for city, task in tasks.items():
+                try:
+                    _, rows, seconds = task.get()
+                except Exception as e:
+                    failed_cities.append(city)
+                    print(f"Failed {city}: {str(e)}")
+                    continue
+                imported_cities[city] = rows
+                total_rows += rows
+                print(f"Completed {city}: {rows} rows in {seconds:.1f}s ({rows / max(seconds, 1e-6):,.0f} rows/s)")
+        
+        elapsed = time.perf_counter() - start
+        print(f"Imported {total_rows} rows from {len(imported_cities)} cities in {elapsed:.1f}s "
+              f"({total_rows / max(elapsed, 1e-6):,.0f} rows/s)")
+        if failed_cities:
+            raise Exception(f"Import failed for {', '.join(failed_cities)}; rerun to resume")
         
         # 创建索引
         print("Creating indices...")
         cur.execute(create_indices_sql())
+        cur.execute("ANALYZE listings")
+        
+        # 生成房东累计房源时间线，更新数据版本和城市元数据；
+        # 之前失败的运行中导入成功的城市也在这里补上
+        print("Building host timelines and city metadata...")
+        for city, rows in cities_to_build(cur):
+            build_host_timeline_table(cur, city)
+            version = bump_data_version(cur, city, inserted=rows)
+            refresh_city_metadata(cur, city, version)
         
         print("Data import completed successfully!")
         
@@ -210,6 +503,16 @@ def verify_import():
             conn.close()
 
 if __name__ == "__main__":
-    print("Starting data import process...")
-    import_data()
+    parser = argparse.ArgumentParser(description="Import Airbnb listings into PostgreSQL")
+    parser.add_argument("--workers", type=int, default=None, help="number of parallel import workers")
+    parser.add_argument("--fresh", action="store_true", help="drop existing data instead of resuming")
+    parser.add_argument("--delta", action="store_true", help="upsert changes from a new snapshot into existing data")
+    args = parser.parse_args()
+    
+    if args.delta:
+        print("Starting delta import...")
+        import_delta(workers=args.workers)
+    else:
+        print("Starting data import process...")
+        import_data(workers=args.workers, fresh=args.fresh)
     verify_import() 
\ No newline at end of file
@@ -0,0 +1,17 @@
+import os
+import shutil
+import sys
+import tempfile
+
+# utils、benchmarks 和 main 按 backend 目录下的顶层模块导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 日志和共享缓存在导入 main 之前指向临时目录，测试不在 logs/ 和 data/ 下留下文件
+RUNTIME_DIR = tempfile.mkdtemp(prefix='airbnb-tests-')
+os.environ['LOG_DIR'] = os.path.join(RUNTIME_DIR, 'logs')
+os.environ['SHARED_CACHE_URL'] = 'sqlite:///' + os.path.join(RUNTIME_DIR, 'shared_cache.sqlite3')
+os.environ['WARM_SNAPSHOTS'] = '0'
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(RUNTIME_DIR, ignore_errors=True)
@@ -0,0 +1,58 @@
+"""并发的相同请求共享一次计算，每个请求得到各自完整的响应"""
+import asyncio
+
+import httpx
+import pytest
+from fastapi.responses import Response
+
+import main
+from benchmarks.synthetic import generate_listings, to_snapshot
+from utils.classifier import TIER_NAMES
+
+CITY = 'Coalesce'
+PARAMS = {'time_point': '2019-01', 'categories': ','.join(TIER_NAMES)}
+
+
+@pytest.fixture(scope='module', autouse=True)
+def snapshot():
+    main.snapshot_store.put(to_snapshot(generate_listings(2000, CITY, seed=13)))
+    main.host_classifier.invalidate(CITY)
+
+
+async def fetch_concurrently(params: dict, count: int) -> list:
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+        return await asyncio.gather(*(
+            client.get(f'/city/{CITY}/listings_by_categories', params=params) for _ in range(count)
+        ))
+
+
+@pytest.mark.parametrize('fmt', ['json', 'columns'])
+def test_concurrent_requests_share_one_compute(monkeypatch, fmt):
+    calls = []
+    results = []
+    compute = main.compute_listings_by_categories
+
+    async def counting_compute(*args, **kwargs):
+        calls.append(args)
+        # 保证其他请求在计算完成前到达
+        await asyncio.sleep(0.05)
+        result = await compute(*args, **kwargs)
+        results.append(result)
+        return result
+
+    monkeypatch.setattr(main, 'compute_listings_by_categories', counting_compute)
+    main.http_body_cache.invalidate()
+    params = dict(PARAMS, format=fmt)
+    responses = asyncio.run(fetch_concurrently(params, 8))
+    assert len(calls) == 1
+    # 合并的是编码结果而不是 Response 对象，每个请求各自构造响应
+    assert not isinstance(results[0], Response)
+
+    main.http_body_cache.invalidate()
+    expected = asyncio.run(fetch_concurrently(params, 1))[0]
+    assert len(calls) == 2
+    for response in responses:
+        assert response.status_code == 200
+        assert response.headers['content-type'] == expected.headers['content-type']
+        assert response.content == expected.content
@@ -0,0 +1,95 @@
+"""散点接口二进制列式格式的解码与 JSON 结果一致"""
+import json
+import struct
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from benchmarks.synthetic import generate_listings, to_snapshot
+from utils.classifier import TIER_NAMES
+from utils.columnar import ARROW_MEDIA_TYPE, COLUMNS_MAGIC, COLUMNS_MEDIA_TYPE
+
+CITY = 'Columnar'
+TIME_POINT = '2020-06'
+
+
+@pytest.fixture(scope='module')
+def client():
+    main.snapshot_store.put(to_snapshot(generate_listings(3000, CITY, seed=5)))
+    main.host_classifier.invalidate(CITY)
+    main.http_body_cache.invalidate()
+    return TestClient(main.app)
+
+
+def decode_columns(content: bytes):
+    """按 utils/columnar.py 的格式说明解码，与前端读取方式相同"""
+    assert content[:4] == COLUMNS_MAGIC
+    (header_length,) = struct.unpack('<I', content[4:8])
+    header = json.loads(content[8:8 + header_length])
+    data = content[8 + header_length:]
+    assert (8 + header_length) % 8 == 0
+    columns = {}
+    for column in header['columns']:
+        assert column['offset'] % 8 == 0
+        dtype = np.dtype(column['dtype']).newbyteorder('<')
+        columns[column['name']] = np.frombuffer(data, dtype=dtype, count=column['length'], offset=column['offset'])
+    return header, columns
+
+
+def fetch(client, categories, fmt):
+    response = client.get(f'/city/{CITY}/listings_by_categories', params={
+        'time_point': TIME_POINT, 'categories': ','.join(categories), 'format': fmt
+    })
+    assert response.status_code == 200
+    return response
+
+
+def sorted_rows(host_ids, latitude, longitude) -> list:
+    return sorted(zip(np.asarray(host_ids).tolist(), np.asarray(latitude).tolist(), np.asarray(longitude).tolist()))
+
+
+def test_columns_round_trip(client):
+    expected = fetch(client, TIER_NAMES, 'json').json()
+    response = fetch(client, TIER_NAMES, 'columns')
+    assert response.headers['content-type'] == COLUMNS_MEDIA_TYPE
+    header, columns = decode_columns(response.content)
+
+    assert header['total_listings'] == expected['total_listings'] > 0
+    assert header['tier_names'] == list(TIER_NAMES)
+    assert columns['latitude'].dtype == columns['longitude'].dtype == np.float32
+    assert columns['tier'].dtype == np.uint8
+    assert columns['hosts'].dtype == np.int64
+
+    # host 是 hosts 字典的下标，字典只包含返回的房东
+    hosts = columns['hosts']
+    assert np.array_equal(np.unique(columns['host']), np.arange(len(hosts)))
+    listings = expected['listings']
+    assert sorted_rows(hosts[columns['host']], columns['latitude'], columns['longitude']) == sorted_rows(
+        [listing['host_id'] for listing in listings],
+        np.float32([listing['latitude'] for listing in listings]),
+        np.float32([listing['longitude'] for listing in listings])
+    )
+
+    # 等级编码与按单个等级查询的结果一致
+    tier_of_host = dict(zip(hosts[columns['host']].tolist(), columns['tier'].tolist()))
+    for code, name in enumerate(TIER_NAMES):
+        single = fetch(client, [name], 'json').json()['listings']
+        assert {tier_of_host[listing['host_id']] for listing in single} <= {code}
+        assert np.count_nonzero(columns['tier'] == code) == len(single)
+
+
+def test_arrow_round_trip(client):
+    pa = pytest.importorskip('pyarrow')
+    _, columns = decode_columns(fetch(client, TIER_NAMES, 'columns').content)
+    response = fetch(client, TIER_NAMES, 'arrow')
+    assert response.headers['content-type'] == ARROW_MEDIA_TYPE
+
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert json.loads(table.schema.metadata[b'tier_names']) == list(TIER_NAMES)
+    host_id = table.column('host_id').combine_chunks()
+    assert np.array_equal(host_id.dictionary.to_numpy(), columns['hosts'])
+    assert np.array_equal(host_id.indices.to_numpy(), columns['host'])
+    for name in ('latitude', 'longitude', 'tier'):
+        assert np.array_equal(table.column(name).to_numpy(), columns[name])
@@ -0,0 +1,84 @@
+"""hexgrid 的 composition 视图与按房源直接统计的结果一致"""
+from collections import Counter
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from h3.api import basic_int as h3_int
+
+import main
+from benchmarks.synthetic import generate_listings, to_snapshot
+from utils.classifier import COMMERCIAL_TIERS, NO_TIER, TIER_NAMES, HostTierClassifier
+from utils.timeline import month_index
+
+CITY = 'Composition'
+TIME_POINT = '2019-06'
+RESOLUTION = 8
+
+
+@pytest.fixture(scope='module')
+def snapshot():
+    snapshot = to_snapshot(generate_listings(3000, CITY, seed=61))
+    main.snapshot_store.put(snapshot)
+    main.host_classifier.invalidate(CITY)
+    main.hex_pyramid.invalidate(CITY)
+    return snapshot
+
+
+@pytest.fixture(scope='module')
+def client(snapshot):
+    return TestClient(main.app)
+
+
+def reference_composition(snapshot) -> dict:
+    """各单元内各等级的房源数（与 hexgrid 相同，不按时间筛选房源）"""
+    tiers = HostTierClassifier().classify(snapshot, month_index(TIME_POINT))
+    listing_tier = tiers.tier_of(snapshot.host_id)
+    valid = snapshot.has_coords & (listing_tier != NO_TIER)
+    cell_ids = snapshot.hex_index().cell_ids[RESOLUTION]
+    codes = snapshot.hex_index().code[RESOLUTION]
+    counts = Counter(zip(codes[valid].tolist(), listing_tier[valid].tolist()))
+    composition = {}
+    for (code, tier), count in counts.items():
+        cell = composition.setdefault(h3_int.h3_to_string(int(cell_ids[code])), dict.fromkeys(TIER_NAMES, 0))
+        cell[TIER_NAMES[tier]] = count
+    return composition
+
+
+@pytest.mark.parametrize('categories', [None, ('single_host', 'dual_host')])
+def test_composition_matches_reference(client, snapshot, categories):
+    params = {'time_point': TIME_POINT, 'view_type': 'composition', 'resolution': RESOLUTION}
+    if categories:
+        params['categories'] = ','.join(categories)
+    response = client.get(f'/city/{CITY}/hexgrid', params=params)
+    assert response.status_code == 200
+    payload = response.json()
+    selected = categories or TIER_NAMES
+    assert payload['categories'] == list(selected)
+
+    # 只返回所选等级非零的单元
+    reference = {
+        hex_id: tiers for hex_id, tiers in reference_composition(snapshot).items()
+        if sum(tiers[name] for name in selected) > 0
+    }
+    hexagons = {hexagon['id']: hexagon for hexagon in payload['hexagons']}
+    assert set(hexagons) == set(reference)
+    assert payload['total_hexagons'] == len(reference)
+
+    for hex_id, tiers in reference.items():
+        hexagon = hexagons[hex_id]
+        assert hexagon['tiers'] == tiers
+        assert hexagon['points_count'] == sum(tiers[name] for name in selected)
+        # 并列时取更商业化（TIER_NAMES 中靠前）的等级
+        most = max(tiers.values())
+        assert hexagon['dominant_tier'] == next(name for name in TIER_NAMES if tiers[name] == most)
+        commercial = sum(tiers[name] for name in COMMERCIAL_TIERS)
+        assert hexagon['commercial_share'] == pytest.approx(commercial / sum(tiers.values()), abs=5e-5)
+        assert 0 <= hexagon['commercial_share'] <= 1
+    assert payload['total_points'] == sum(hexagon['points_count'] for hexagon in hexagons.values())
+    assert any(0 < hexagon['commercial_share'] < 1 for hexagon in hexagons.values())
+
+
+def test_composition_requires_time_point(client, snapshot):
+    response = client.get(f'/city/{CITY}/hexgrid', params={'view_type': 'composition'})
+    assert response.status_code == 400
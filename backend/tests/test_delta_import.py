@@ -0,0 +1,165 @@
+"""
+增量导入对房东时间线和数据版本的更新
+
+没有 PostgreSQL 时用内存中的游标替身执行 update_host_timeline_table 和 bump_data_version，
+delta_import_city 中 SQL 读出的 removed / added 按同样的规则由新旧房源直接算出。
+"""
+import asyncio
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate_listings, to_snapshot
+from import_to_postgresql import timeline_deltas
+from utils.snapshot import NO_REVIEW
+from utils.timeline import UPSERT_TIMELINE_SQL, HostTimeline, update_host_timeline_table
+from utils.versions import BUMP_VERSION_SQL, DataVersionRegistry, bump_data_version
+
+CITY = 'DeltaImport'
+
+
+class MemoryCursor:
+    """psycopg2 游标的替身，在内存中维护 host_monthly_listings 和 city_data_versions"""
+
+    def __init__(self, timeline: Counter = None):
+        self.timeline = Counter(timeline or {})
+        self.versions = Counter()
+        self._row = None
+
+    def execute(self, query, params=()):
+        if query == BUMP_VERSION_SQL:
+            city = params[0]
+            self.versions[city] += 1
+            self._row = (self.versions[city],)
+        elif query.strip().startswith('DELETE FROM host_monthly_listings') and 'new_listings = 0' in query:
+            for key in [key for key, count in self.timeline.items() if key[0] == params[0] and count == 0]:
+                del self.timeline[key]
+
+    def executemany(self, query, rows):
+        assert query == UPSERT_TIMELINE_SQL
+        for city, host_id, month, delta in rows:
+            self.timeline[(city, host_id, month)] += delta
+
+    def fetchone(self):
+        return self._row
+
+
+def review_events(listings: pd.DataFrame) -> dict:
+    """每条房源的 (host_id, 评论月份)，没有评论的房源没有时间线事件"""
+    snapshot = to_snapshot(listings)
+    return {
+        listing_id: (host_id, month)
+        for listing_id, host_id, month in zip(
+            listings['id'].tolist(), snapshot.host_id.tolist(), snapshot.month.tolist()
+        )
+        if month != NO_REVIEW
+    }
+
+
+def import_changes(old: pd.DataFrame, new: pd.DataFrame):
+    """与 delta_import_city 的 SQL 相同：删除的房源，以及 (host_id, 评论月份) 有变化的房源"""
+    old_events, new_events = review_events(old), review_events(new)
+    new_ids = set(new['id'].tolist())
+    removed = [old_events[i] for i in old['id'].tolist() if i not in new_ids and i in old_events]
+    added = []
+    for listing_id in new['id'].tolist():
+        before, after = old_events.get(listing_id), new_events.get(listing_id)
+        if before != after:
+            if before is not None:
+                removed.append(before)
+            if after is not None:
+                added.append(after)
+    return removed, added
+
+
+def table_timeline(cur: MemoryCursor) -> HostTimeline:
+    """load_host_timeline 从表中读出的时间线"""
+    rows = [(host_id, month, count) for (city, host_id, month), count in cur.timeline.items() if city == CITY]
+    return HostTimeline.from_events(*zip(*rows))
+
+
+@pytest.fixture(scope='module')
+def snapshots():
+    old = generate_listings(3000, CITY, seed=21)
+    rng = np.random.default_rng(22)
+
+    new = old.drop(index=rng.choice(len(old), 150, replace=False))
+    # 换房东、改评论日期、删除评论
+    changed = rng.choice(new.index, 300, replace=False)
+    new.loc[changed[:100], 'host_id'] = rng.choice(new['host_id'].to_numpy(), 100)
+    new.loc[changed[100:200], 'first_review'] = new.loc[changed[100:200], 'first_review'] + pd.Timedelta(days=45)
+    new.loc[changed[200:], 'first_review'] = pd.NaT
+    # 新房源，部分属于已有房东
+    added = generate_listings(200, CITY, seed=23)
+    added['id'] += old['id'].max()
+    added.loc[:99, 'host_id'] = rng.choice(old['host_id'].to_numpy(), 100)
+    new = pd.concat([new, added], ignore_index=True)
+    return old, new
+
+
+def test_timeline_deltas_cancel_out():
+    hosts, months, deltas = timeline_deltas([(1, 10), (2, 11), (3, 12)], [(1, 10), (2, 13), (3, 12), (3, 12)])
+    assert sorted(zip(hosts, months, deltas)) == [(2, 11, -1), (2, 13, 1), (3, 12, 1)]
+    assert [list(values) for values in timeline_deltas([(1, 10)], [(1, 10)])] == [[], [], []]
+
+
+def test_delta_import_matches_rebuilt_timeline(snapshots):
+    old, new = snapshots
+    # 全量导入时 BUILD_TIMELINE_SQL 生成的表
+    cur = MemoryCursor(Counter((CITY, host_id, month) for host_id, month in review_events(old).values()))
+    assert np.array_equal(table_timeline(cur).cumulative, to_snapshot(old).timeline.cumulative)
+
+    update_host_timeline_table(cur, CITY, *timeline_deltas(*import_changes(old, new)))
+    assert all(count > 0 for count in cur.timeline.values())
+
+    updated = table_timeline(cur)
+    expected = to_snapshot(new).timeline
+    assert np.array_equal(updated.hosts, expected.hosts)
+    assert updated.start_month == expected.start_month
+    assert np.array_equal(updated.cumulative, expected.cumulative)
+    month = expected.end_month - 24
+    for got, want in zip(updated.host_listing_counts(month), expected.host_listing_counts(month)):
+        assert np.array_equal(got, want)
+
+
+class VersionsDB:
+    """DataVersionRegistry 使用的 asyncpg 接口替身，读取 MemoryCursor 中的版本"""
+
+    def __init__(self, cur: MemoryCursor):
+        self.cur = cur
+
+    async def fetchval(self, query, *args):
+        return True
+
+    async def fetch(self, query, *args):
+        return [
+            {'city': city, 'version': version, 'updated_at': 1_700_000_000.0 + version}
+            for city, version in self.cur.versions.items()
+        ]
+
+
+def test_version_bump_notifies_after_refresh():
+    cur = MemoryCursor()
+    assert bump_data_version(cur, CITY, inserted=3000) == 1
+    registry = DataVersionRegistry(VersionsDB(cur), poll_seconds=0)
+    seen = []
+
+    async def on_changed(city, version):
+        # 回调执行期间仍是旧版本
+        seen.append((city, version, registry.get(city)))
+
+    registry.add_listener(on_changed)
+
+    async def run():
+        await registry.load()
+        assert registry.get(CITY) == 1
+        assert await registry.check() == []
+        assert bump_data_version(cur, CITY, inserted=200, updated=300, deleted=150) == 2
+        return await registry.check()
+
+    assert asyncio.run(run()) == [CITY]
+    assert seen == [(CITY, 2, 1)]
+    assert registry.get(CITY) == 2
+    assert registry.updated_at[CITY] == 1_700_000_002.0
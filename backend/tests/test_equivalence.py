@@ -0,0 +1,225 @@
+"""
+快照接口与原始 SQL + pandas 实现的等价性
+
+reference_* 按最初版本 main.py 中各接口的 SQL 和 pandas 逻辑在合成房源上重新计算，
+与经过完整中间件的接口返回值比较。原始 SQL 对房源数相同的房东没有排序规则，
+这里和快照实现一样按 host_id 升序。
+"""
+import json
+from collections import Counter
+
+import h3
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from benchmarks.synthetic import generate_listings, to_snapshot
+from utils.classifier import TIER_NAMES
+
+CITY = 'Equivalence'
+RESOLUTION = 9
+# 包括第一条评论之前、数据中段和最后一个月
+TIME_POINTS = ['2008-01', '2012-06', '2018-03', '2024-12']
+CATEGORY_SETS = [
+    TIER_NAMES,
+    ('highly_commercial',),
+    ('commercial', 'dual_host'),
+    ('semi_commercial', 'single_host'),
+]
+
+
+@pytest.fixture(scope='module')
+def listings():
+    return generate_listings(4000, CITY, seed=7)
+
+
+@pytest.fixture(scope='module')
+def client(listings):
+    main.snapshot_store.put(to_snapshot(listings))
+    main.host_classifier.invalidate(CITY)
+    main.hex_pyramid.invalidate(CITY)
+    main.http_body_cache.invalidate()
+    return TestClient(main.app)
+
+
+def target_date(time_point: str) -> pd.Timestamp:
+    return pd.Timestamp(f'{time_point}-01')
+
+
+def reference_host_counts(listings: pd.DataFrame, time_point: str) -> pd.DataFrame:
+    """host_listings CTE：截至 time_point 每个房东的房源数，按房源数降序"""
+    reviewed = listings[listings['first_review'] <= target_date(time_point)]
+    counts = reviewed.groupby('host_id').size().rename('listing_count').reset_index()
+    return counts.sort_values(['listing_count', 'host_id'], ascending=[False, True], ignore_index=True)
+
+
+def reference_classes(df: pd.DataFrame) -> dict:
+    """原始实现的五级划分"""
+    remaining_hosts = df[df['listing_count'] > 2]
+    classes = {name: df.iloc[:0] for name in TIER_NAMES}
+    if len(remaining_hosts) > 0:
+        p5_index = max(1, int(len(remaining_hosts) * 0.05))
+        p15_index = max(p5_index + 1, int(len(remaining_hosts) * 0.15))
+        classes['highly_commercial'] = remaining_hosts.iloc[:p5_index]
+        classes['commercial'] = remaining_hosts.iloc[p5_index:p15_index]
+        classes['semi_commercial'] = remaining_hosts.iloc[p15_index:]
+    classes['dual_host'] = df[df['listing_count'] == 2]
+    classes['single_host'] = df[df['listing_count'] == 1]
+    return classes
+
+
+def reference_selected_hosts(listings: pd.DataFrame, time_point: str, categories) -> set:
+    classes = reference_classes(reference_host_counts(listings, time_point))
+    return {int(host) for name in categories for host in classes[name]['host_id']}
+
+
+def reference_hexagons(coordinates) -> dict:
+    """原始实现的 H3 分箱：id -> (points_count, boundary, center)"""
+    hex_counts = Counter(h3.geo_to_h3(lat, lng, RESOLUTION) for lat, lng in coordinates)
+    return {
+        hex_id: (count, [list(p) for p in h3.h3_to_geo_boundary(hex_id)], list(h3.h3_to_geo(hex_id)))
+        for hex_id, count in hex_counts.items()
+    }
+
+
+def reference_bounds(listings: pd.DataFrame) -> dict:
+    located = listings[listings['latitude'].notna()]
+    return {
+        'min_lat': float(located['latitude'].min()),
+        'max_lat': float(located['latitude'].max()),
+        'min_lng': float(located['longitude'].min()),
+        'max_lng': float(located['longitude'].max())
+    }
+
+
+def response_hexagons(payload: dict) -> dict:
+    return {
+        hexagon['id']: (hexagon['points_count'], hexagon['boundary'], hexagon['center'])
+        for hexagon in payload['hexagons']
+    }
+
+
+def rows(records, fields) -> list:
+    """与顺序无关的比较；NaN 价格统一为 None"""
+    def value(v):
+        if v is None or (isinstance(v, float) and np.isnan(v)) or v is pd.NA:
+            return None
+        return v.item() if isinstance(v, np.generic) else v
+    return sorted((tuple(value(record[f]) for f in fields) for record in records), key=repr)
+
+
+def listing_records(frame: pd.DataFrame, fields) -> list:
+    return frame[list(fields)].astype(object).to_dict('records')
+
+
+@pytest.mark.parametrize('time_point', TIME_POINTS)
+def test_host_ranking(client, listings, time_point):
+    df = reference_host_counts(listings, time_point)
+    if len(df) == 0:
+        expected = {"host_categories": {}, "total_hosts": 0, "total_listings": 0}
+    else:
+        classes = reference_classes(df)
+        expected = {
+            "host_categories": {
+                name: {
+                    "range": {
+                        "min": int(frame['listing_count'].min()),
+                        "max": int(frame['listing_count'].max())
+                    },
+                    "count": len(frame),
+                    "host_ids": [str(host) for host in frame['host_id']]
+                } if len(frame) else {"range": None, "count": 0, "host_ids": []}
+                for name, frame in classes.items()
+            },
+            "total_hosts": len(df),
+            "total_listings": int(df['listing_count'].sum())
+        }
+
+    response = client.get(f'/city/{CITY}/host_ranking', params={'time_point': time_point})
+    assert response.status_code == 200
+    assert response.json() == expected
+
+
+@pytest.mark.parametrize('time_point', TIME_POINTS)
+@pytest.mark.parametrize('categories', CATEGORY_SETS)
+def test_listings_by_categories(client, listings, time_point, categories):
+    hosts = reference_selected_hosts(listings, time_point, categories)
+    expected = listings[
+        listings['host_id'].isin(hosts)
+        & (listings['first_review'] <= target_date(time_point))
+        & listings['latitude'].notna()
+    ]
+    fields = ('host_id', 'latitude', 'longitude', 'name', 'price', 'processed_price')
+
+    response = client.get(f'/city/{CITY}/listings_by_categories', params={
+        'time_point': time_point, 'categories': ','.join(categories)
+    })
+    assert response.status_code == 200
+    payload = response.json()
+    assert payload['total_listings'] == len(expected)
+    assert rows(payload['listings'], fields) == rows(listing_records(expected, fields), fields)
+    # geom 为 ST_AsGeoJSON 形式的点
+    for listing in payload['listings']:
+        geom = json.loads(listing['geom'])
+        assert geom == {'type': 'Point', 'coordinates': [listing['longitude'], listing['latitude']]}
+
+
+@pytest.mark.parametrize('time_point', TIME_POINTS[1:])
+@pytest.mark.parametrize('categories', CATEGORY_SETS)
+def test_hexgrid(client, listings, time_point, categories):
+    # 原始实现不按时间筛选选中房东的房源
+    hosts = reference_selected_hosts(listings, time_point, categories)
+    expected = listings[listings['host_id'].isin(hosts) & listings['latitude'].notna()]
+    params = {'time_point': time_point, 'categories': ','.join(categories), 'resolution': RESOLUTION}
+
+    if len(expected) == 0:
+        assert client.get(f'/city/{CITY}/hexgrid', params=params).status_code == 500
+        return
+
+    grid = client.get(f'/city/{CITY}/hexgrid', params=params).json()
+    assert response_hexagons(grid) == reference_hexagons(expected[['latitude', 'longitude']].values)
+    assert grid['total_hexagons'] == len(grid['hexagons'])
+    assert grid['total_points'] == len(expected)
+    assert grid['bounds'] == reference_bounds(listings)
+
+    scatter = client.get(f'/city/{CITY}/hexgrid', params=dict(params, view_type='scatter')).json()
+    fields = ('host_id', 'latitude', 'longitude', 'name', 'price')
+    assert scatter['total_listings'] == len(expected)
+    assert rows(scatter['listings'], fields) == rows(listing_records(expected, fields), fields)
+
+
+def test_hexgrid_whole_city(client, listings):
+    located = listings[listings['latitude'].notna()]
+    grid = client.get(f'/city/{CITY}/hexgrid', params={'resolution': RESOLUTION}).json()
+    assert response_hexagons(grid) == reference_hexagons(located[['latitude', 'longitude']].values)
+    assert grid['total_points'] == len(located)
+
+
+@pytest.mark.parametrize('time_point', TIME_POINTS)
+@pytest.mark.parametrize('listing_count', [1, 3, 10, 100000])
+def test_listings_by_count(client, listings, time_point, listing_count):
+    df = reference_host_counts(listings, time_point)
+    hosts = set(df.loc[df['listing_count'] >= listing_count, 'host_id'].tolist())
+    expected = listings[
+        listings['host_id'].isin(hosts)
+        & (listings['first_review'] <= target_date(time_point))
+        & listings['latitude'].notna()
+    ]
+    params = {'time_point': time_point, 'listing_count': listing_count, 'resolution': RESOLUTION}
+
+    scatter = client.get(f'/city/{CITY}/listings_by_count', params=dict(params, view_type='scatter')).json()
+    grid = client.get(f'/city/{CITY}/listings_by_count', params=dict(params, view_type='grid')).json()
+    if len(expected) == 0:
+        assert scatter == {"listings": [], "total_listings": 0}
+        assert grid == {"listings": [], "total_listings": 0}
+        return
+
+    fields = ('host_id', 'latitude', 'longitude')
+    assert scatter['total_listings'] == len(expected)
+    assert rows(scatter['listings'], fields) == rows(listing_records(expected, fields), fields)
+
+    assert response_hexagons(grid) == reference_hexagons(expected[['latitude', 'longitude']].values)
+    assert grid['total_points'] == len(expected)
+    assert grid['bounds'] == reference_bounds(listings)
@@ -0,0 +1,90 @@
+"""/city/* 的条件请求和压缩方式协商"""
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from utils.http_cache import CachedBody, HTTPCacheMiddleware
+
+BODY = b'{"hexagons": [' + b','.join(b'{"id": "%d"}' % i for i in range(500)) + b']}'
+
+
+def make_client(versions: dict):
+    calls = []
+
+    async def endpoint(request):
+        calls.append(request.url.path)
+        return Response(BODY, media_type='application/json')
+
+    app = Starlette(routes=[Route('/city/{city}/hexgrid', endpoint)])
+    app.add_middleware(HTTPCacheMiddleware, version_of=lambda city: versions.get(city, (None, None)))
+    return TestClient(app), calls
+
+
+def test_if_none_match_returns_304():
+    versions = {'Paris': ('1', 1_700_000_000.0)}
+    client, calls = make_client(versions)
+
+    first = client.get('/city/Paris/hexgrid', params={'resolution': 8})
+    assert first.status_code == 200
+    etag = first.headers['etag']
+
+    again = client.get('/city/Paris/hexgrid', params={'resolution': 8}, headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.content == b''
+    assert again.headers['etag'] == etag
+    assert len(calls) == 1
+
+    # 其他参数和新的数据版本对应不同的 ETag
+    other = client.get('/city/Paris/hexgrid', params={'resolution': 7}, headers={'If-None-Match': etag})
+    assert other.status_code == 200
+    versions['Paris'] = ('2', 1_700_000_100.0)
+    updated = client.get('/city/Paris/hexgrid', params={'resolution': 8}, headers={'If-None-Match': etag})
+    assert updated.status_code == 200
+    assert updated.headers['etag'] != etag
+    assert updated.content == BODY
+
+
+def test_unknown_version_is_not_cached():
+    client, calls = make_client({})
+    for _ in range(2):
+        response = client.get('/city/Paris/hexgrid')
+        assert response.status_code == 200
+        assert 'etag' not in response.headers
+    assert len(calls) == 2
+
+
+def test_gzip_variant():
+    client, calls = make_client({'Paris': ('1', None)})
+    for _ in range(2):
+        response = client.get('/city/Paris/hexgrid', headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['content-encoding'] == 'gzip'
+        assert response.content == BODY
+    assert len(calls) == 1
+
+
+def test_br_variant():
+    brotli = pytest.importorskip('brotli')
+    client, calls = make_client({'Paris': ('1', None)})
+
+    # 同时接受 br 和 gzip 时优先 br
+    for _ in range(2):
+        response = client.get('/city/Paris/hexgrid', headers={'Accept-Encoding': 'gzip, br'})
+        assert response.headers['content-encoding'] == 'br'
+        assert response.content == BODY
+    assert len(calls) == 1
+
+    # 不接受 br 时回退到 gzip，br;q=0 视为不接受
+    fallback = client.get('/city/Paris/hexgrid', headers={'Accept-Encoding': 'br;q=0, gzip'})
+    assert fallback.headers['content-encoding'] == 'gzip'
+    assert fallback.content == BODY
+
+    encoding, body = CachedBody(200, [], BODY).choose('br')
+    assert encoding == 'br'
+    assert brotli.decompress(body) == BODY
+
+
+def test_small_body_is_not_compressed():
+    cached = CachedBody(200, [], b'{}')
+    assert cached.choose('gzip, br') == ('identity', b'{}')
@@ -0,0 +1,32 @@
+"""时间线范围之外的月份共享分级、六边形金字塔和价格草图的缓存项"""
+import pytest
+
+from benchmarks.synthetic import generate_listings, to_snapshot
+from utils.classifier import HostTierClassifier, clamp_month
+from utils.prices import PriceStatsService
+from utils.pyramid import HexPyramidService
+
+
+@pytest.fixture(scope='module')
+def snapshot():
+    return to_snapshot(generate_listings(1500, 'MonthKeys', seed=3))
+
+
+def test_clamp_month(snapshot):
+    timeline = snapshot.timeline
+    assert clamp_month(timeline, timeline.end_month + 30) == timeline.end_month
+    assert clamp_month(timeline, timeline.start_month - 30) == timeline.start_month - 1
+    assert clamp_month(timeline, timeline.start_month + 5) == timeline.start_month + 5
+
+
+@pytest.mark.parametrize('service_class', [HexPyramidService, PriceStatsService])
+def test_out_of_range_months_share_entry(snapshot, service_class):
+    service = service_class(HostTierClassifier())
+    end = snapshot.timeline.end_month
+    latest = service.get(snapshot, end)
+    assert service.get(snapshot, end + 1) is latest
+    assert service.get(snapshot, end + 120) is latest
+
+    start = snapshot.timeline.start_month
+    assert service.get(snapshot, start - 120) is service.get(snapshot, start - 1)
+    assert service.cache.stats()['entries'] == 2
@@ -0,0 +1,208 @@
+"""矢量瓦片编码：按 vector-tile-spec 2.1 解码后与输入一致"""
+import struct
+
+from h3.api import basic_int as h3_int
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import generate_listings, to_snapshot
+from utils.classifier import TIER_CODES, TIER_NAMES, HostTierClassifier
+from utils.mvt import (
+    EXTENT, POINT, POLYGON, LayerBuilder, encode_tile, lnglat_to_world,
+    point_geometry, polygon_geometry, tile_bounds
+)
+from utils.pyramid import HexPyramidService
+from utils.tiles import TileService
+
+CITY = 'VectorTiles'
+
+
+def read_varint(data: bytes, pos: int):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+
+def read_fields(data: bytes):
+    """逐个产生 (field, value)，长度限定字段的 value 为 bytes"""
+    pos = 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        field, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            value, pos = struct.unpack('<d', data[pos:pos + 8])[0], pos + 8
+        elif wire_type == 2:
+            length, pos = read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        else:
+            raise ValueError(f"Unexpected wire type {wire_type}")
+        yield field, value
+
+
+def read_packed(data: bytes) -> list:
+    values, pos = [], 0
+    while pos < len(data):
+        value, pos = read_varint(data, pos)
+        values.append(value)
+    return values
+
+
+def unzigzag(value: int) -> int:
+    return (value >> 1) ^ -(value & 1)
+
+
+def decode_value(data: bytes):
+    (field, value), = read_fields(data)
+    if field == 1:
+        return value.decode('utf-8')
+    if field == 6:
+        return unzigzag(value)
+    if field == 7:
+        return bool(value)
+    return value
+
+
+def decode_geometry(commands: list) -> list:
+    """几何命令解码为环 / 点的绝对坐标列表"""
+    parts, x, y, i = [], 0, 0, 0
+    while i < len(commands):
+        command, count = commands[i] & 7, commands[i] >> 3
+        i += 1
+        if command == 7:
+            parts[-1].append(parts[-1][0])
+            continue
+        if command == 1:
+            parts.append([])
+        for _ in range(count):
+            x += unzigzag(commands[i])
+            y += unzigzag(commands[i + 1])
+            parts[-1].append((x, y))
+            i += 2
+    return parts
+
+
+def decode_tile(tile: bytes) -> dict:
+    layers = {}
+    for field, layer_data in read_fields(tile):
+        assert field == 3
+        layer = {'features': [], 'keys': [], 'values': []}
+        for key, value in read_fields(layer_data):
+            if key == 15:
+                layer['version'] = value
+            elif key == 1:
+                layer['name'] = value.decode('utf-8')
+            elif key == 2:
+                layer['features'].append(dict(read_fields(value)))
+            elif key == 3:
+                layer['keys'].append(value.decode('utf-8'))
+            elif key == 4:
+                layer['values'].append(decode_value(value))
+            elif key == 5:
+                layer['extent'] = value
+        for feature in layer['features']:
+            tags = read_packed(feature.get(2, b''))
+            feature['properties'] = {
+                layer['keys'][k]: layer['values'][v] for k, v in zip(tags[::2], tags[1::2])
+            }
+            feature['geometry'] = decode_geometry(read_packed(feature[4]))
+        layers[layer['name']] = layer
+    return layers
+
+
+def ring_area(ring) -> int:
+    return sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:]))
+
+
+def test_encode_layers():
+    points = LayerBuilder('points')
+    points.add(POINT, point_geometry(10, -3), {'name': 'a', 'count': 3, 'offset': -2, 'price': 12.5}, feature_id=7)
+    points.add(POINT, point_geometry(4095, 4100), {'name': 'a', 'missing': None})
+    shapes = LayerBuilder('shapes')
+    # 逆时针输入，编码时调整为顺时针；重复点和首尾重复点去掉
+    shapes.add(POLYGON, polygon_geometry([0, 0, 0, 100, 100], [0, 0, 100, 100, 0]), {'id': 'x'})
+    shapes.add(POLYGON, polygon_geometry([0, 10, 20], [0, 0, 0]))
+    empty = LayerBuilder('empty')
+
+    layers = decode_tile(encode_tile([points, shapes, empty]))
+    assert set(layers) == {'points', 'shapes'}
+    assert layers['points']['version'] == 2
+    assert layers['points']['extent'] == EXTENT
+
+    first, second = layers['points']['features']
+    assert first[1] == 7 and first[3] == POINT
+    assert first['properties'] == {'name': 'a', 'count': 3, 'offset': -2, 'price': 12.5}
+    assert first['geometry'] == [[(10, -3)]]
+    assert 1 not in second
+    assert second['properties'] == {'name': 'a'}
+    assert second['geometry'] == [[(4095, 4100)]]
+    # 相同的键和值只写一次
+    assert layers['points']['keys'].count('name') == 1
+    assert layers['points']['values'].count('a') == 1
+
+    # 面积为零的多边形不写入
+    polygon, = layers['shapes']['features']
+    assert polygon[3] == POLYGON
+    ring, = polygon['geometry']
+    assert sorted(set(ring)) == [(0, 0), (0, 100), (100, 0), (100, 100)]
+    assert ring[0] == ring[-1]
+    assert ring_area(ring) > 0
+
+
+@pytest.fixture(scope='module')
+def snapshot():
+    return to_snapshot(generate_listings(3000, CITY, seed=17))
+
+
+def test_tile_contents(tmp_path, snapshot):
+    classifier = HostTierClassifier()
+    pyramid = HexPyramidService(classifier)
+    service = TileService(classifier, pyramid, cache_dir=str(tmp_path))
+    month = snapshot.timeline.end_month - 36
+    categories = ('highly_commercial', 'commercial', 'single_host')
+    z, resolution = 13, 8
+    wx, wy = snapshot.world_coords()
+    x = int(np.nanmedian(wx) * (1 << z))
+    y = int(np.nanmedian(wy) * (1 << z))
+
+    layers = decode_tile(service.get(snapshot, month, categories, z, x, y, resolution=resolution))
+
+    # listings：所选等级、截至 month、落在瓦片（含 buffer）内的房源
+    tiers = classifier.classify(snapshot, month)
+    listing_tier = tiers.tier_of(snapshot.host_id)
+    min_x, min_y, max_x, max_y = tile_bounds(z, x, y)
+    expected = np.flatnonzero(
+        np.isin(listing_tier, [TIER_CODES[c] for c in categories])
+        & (snapshot.month <= month) & snapshot.has_coords
+        & (wx >= min_x) & (wx < max_x) & (wy >= min_y) & (wy < max_y)
+    )
+    features = {feature[1]: feature for feature in layers['listings']['features']}
+    assert len(expected) > 0
+    assert sorted(features) == expected.tolist()
+    for listing, feature in features.items():
+        assert feature['properties']['host_id'] == snapshot.host_id[listing]
+        assert feature['properties']['host_category'] == TIER_NAMES[listing_tier[listing]]
+        (px, py), = feature['geometry'][0]
+        assert px == round((wx[listing] * (1 << z) - x) * EXTENT)
+        assert py == round((wy[listing] * (1 << z) - y) * EXTENT)
+
+    # hexagons：计数与 hexgrid 相同，中心在瓦片内的非零单元都在图层中
+    hex_ids, counts = pyramid.get(snapshot, month).counts(categories, resolution)
+    expected_counts = dict(zip(map(h3_int.h3_to_string, hex_ids.tolist()), counts.tolist()))
+    hexagons = {
+        feature['properties']['id']: feature['properties']['points_count']
+        for feature in layers['hexagons']['features']
+    }
+    assert hexagons
+    assert all(expected_counts[hex_id] == count for hex_id, count in hexagons.items())
+    for hex_id in expected_counts:
+        lat, lng = h3_int.h3_to_geo(h3_int.string_to_h3(hex_id))
+        cx, cy = lnglat_to_world(lng, lat)
+        if x <= cx * (1 << z) < x + 1 and y <= cy * (1 << z) < y + 1:
+            assert hex_id in hexagons
@@ -0,0 +1,61 @@
+"""hexgrid 时间回放：逐月应用 delta 后与当月 hexgrid 的计数一致"""
+import pytest
+from h3.api import basic_int as h3_int
+
+from benchmarks.synthetic import generate_listings, to_snapshot
+from utils.classifier import HostTierClassifier
+from utils.playback import hex_timeline_messages
+from utils.pyramid import HexPyramidService
+from utils.timeline import month_label
+
+CITY = 'Playback'
+RESOLUTION = 7
+
+
+@pytest.fixture(scope='module')
+def snapshot():
+    return to_snapshot(generate_listings(3000, CITY, seed=31))
+
+
+def hexgrid_counts(pyramids, snapshot, month: int, categories) -> dict:
+    hex_ids, counts = pyramids.get(snapshot, month).counts(categories, RESOLUTION)
+    return dict(zip(map(h3_int.h3_to_string, hex_ids.tolist()), counts.tolist()))
+
+
+@pytest.mark.parametrize('categories', [
+    ('highly_commercial', 'commercial'),
+    ('single_host',),
+])
+def test_deltas_replay_to_hexgrid(snapshot, categories):
+    pyramids = HexPyramidService(HostTierClassifier())
+    # 从第一条评论之前开始，跨过房东等级变化较多的年份
+    start = snapshot.timeline.start_month - 2
+    months = range(start, start + 60, 3)
+    messages = list(hex_timeline_messages(snapshot, months, categories, RESOLUTION))
+    assert [m['type'] for m in messages] == ['full'] + ['delta'] * (len(months) - 1) + ['end']
+    assert messages[-1]['frames'] == len(months)
+
+    grid = {}
+    seen = set()
+    for month, message in zip(months, messages):
+        assert message['time_point'] == month_label(month)
+        if message['type'] == 'full':
+            grid = {hexagon['id']: hexagon['points_count'] for hexagon in message['hexagons']}
+        else:
+            for hexagon in message['added']:
+                assert hexagon['id'] not in grid and hexagon['boundary']
+                grid[hexagon['id']] = hexagon['points_count']
+            for hexagon in message['updated']:
+                assert grid[hexagon['id']] != hexagon['points_count']
+                grid[hexagon['id']] = hexagon['points_count']
+            for hex_id in message['removed']:
+                del grid[hex_id]
+            seen.update(kind for kind in ('added', 'updated', 'removed') if message[kind])
+
+        assert grid == hexgrid_counts(pyramids, snapshot, month, categories)
+        assert message['total_hexagons'] == len(grid)
+        assert message['total_points'] == sum(grid.values())
+
+    # 第一条评论之前没有已分级的房东
+    assert messages[0]['hexagons'] == []
+    assert seen == {'added', 'updated', 'removed'}
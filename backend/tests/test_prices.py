@@ -0,0 +1,60 @@
+"""房价分布：草图分位数在误差范围内与精确分位数一致，计数和直方图精确"""
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import generate_listings, to_snapshot
+from utils.classifier import NO_TIER, TIER_CODES, TIER_NAMES, HostTierClassifier
+from utils.prices import HISTOGRAM_EDGES, PRICE_GAMMA, QUANTILE_KEYS, QUANTILES, PriceStatsService
+
+CITY = 'PriceStats'
+RESOLUTION = 8
+# 对数分桶的相对误差，加上结果保留两位小数
+RELATIVE_ERROR = (PRICE_GAMMA - 1) / (PRICE_GAMMA + 1)
+
+
+@pytest.fixture(scope='module')
+def snapshot():
+    return to_snapshot(generate_listings(4000, CITY, seed=51))
+
+
+def assert_summary(summary: dict, prices: np.ndarray):
+    assert summary['count'] == len(prices)
+    if len(prices) == 0:
+        assert summary['median'] is None and summary['mean'] is None
+        return
+    assert summary['mean'] == pytest.approx(prices.mean(), abs=0.005)
+    exact = np.quantile(prices, QUANTILES, method='lower')
+    for key, value in zip(QUANTILE_KEYS, exact.tolist()):
+        assert abs(summary['quantiles'][key] - value) <= RELATIVE_ERROR * value + 0.005 + 1e-9
+    assert summary['median'] == summary['quantiles']['p50']
+    histogram, _ = np.histogram(prices, bins=list(HISTOGRAM_EDGES) + [np.inf])
+    assert summary['histogram'] == histogram.tolist()
+
+
+@pytest.mark.parametrize('categories', [TIER_NAMES, ('commercial', 'semi_commercial')])
+def test_quantiles_match_exact(snapshot, categories):
+    classifier = HostTierClassifier()
+    month = snapshot.timeline.end_month - 12
+    stats = PriceStatsService(classifier).get(snapshot, month).stats(categories, RESOLUTION)
+
+    listing_tier = classifier.classify(snapshot, month).tier_of(snapshot.host_id)
+    prices = snapshot.processed_price
+    with np.errstate(invalid='ignore'):
+        valid = snapshot.has_coords & (snapshot.month <= month) & (listing_tier != NO_TIER) & (prices > 0)
+    selected = valid & np.isin(listing_tier, [TIER_CODES[c] for c in categories])
+
+    assert stats['quantiles'] == list(QUANTILES)
+    assert_summary(stats['overall'], prices[selected])
+    assert set(stats['tiers']) == set(categories)
+    for name, summary in stats['tiers'].items():
+        assert_summary(summary, prices[valid & (listing_tier == TIER_CODES[name])])
+
+    cell_code = snapshot.hex_index().code[RESOLUTION]
+    cell_ids = snapshot.hex_index().cell_ids[RESOLUTION]
+    expected_cells = {format(int(cell_ids[code]), 'x') for code in np.unique(cell_code[selected])}
+    assert {cell['id'] for cell in stats['cells']} == expected_cells
+    assert sum(cell['count'] for cell in stats['cells']) == stats['overall']['count']
+    # 抽查房源最多的几个单元
+    for cell in sorted(stats['cells'], key=lambda cell: -cell['count'])[:5]:
+        code = np.flatnonzero(cell_ids == int(cell['id'], 16))[0]
+        assert_summary(cell, prices[selected & (cell_code == code)])
@@ -0,0 +1,132 @@
+"""跨 worker 共享的结果缓存"""
+import asyncio
+import time
+
+import pytest
+
+from utils.cache import LRUCache, SharedCache, SQLiteCache
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'shared_cache.sqlite3')
+
+
+def worker(path: str, **kwargs) -> SharedCache:
+    """每个 worker 各自打开同一个 SQLite 文件"""
+    return SharedCache(SQLiteCache(path), poll_seconds=0.01, **kwargs)
+
+
+def test_single_flight_across_workers(path):
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return {'value': len(calls)}
+
+    async def run():
+        workers = [worker(path) for _ in range(3)]
+        # 每个 worker 内部也有并发的相同请求
+        return await asyncio.gather(*(
+            cache.get_or_compute('host_ranking:Paris', compute) for cache in workers for _ in range(2)
+        ))
+
+    assert asyncio.run(run()) == [{'value': 1}] * 6
+    assert len(calls) == 1
+
+
+def test_waiter_computes_after_lock_expires(path):
+    holder = worker(path)
+    assert holder.backend.try_lock('airbnb:warmup:Paris:3', 'crashed-worker', 60)
+
+    async def compute():
+        return True
+
+    # 持有锁的 worker 没有写入结果，等待 lock_seconds 后自行计算
+    cache = worker(path)
+    assert asyncio.run(cache.get_or_compute('warmup:Paris:3', compute, lock_seconds=0.05)) is True
+    assert cache.waits > 0
+
+
+def test_unconnected_cache_computes_directly():
+    cache = SharedCache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return [1, 2]
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_compute('key', compute) for _ in range(3)))
+
+    assert asyncio.run(run()) == [[1, 2]] * 3
+    assert len(calls) == 1
+    assert cache.stats()['backend'] is None
+    cache.close()
+
+
+def test_sqlite_entries_expire(path):
+    backend = SQLiteCache(path)
+    backend.set('short', b'1', ttl_seconds=0.05)
+    backend.set('long', b'2', ttl_seconds=60)
+    assert backend.get('short') == b'1'
+    time.sleep(0.1)
+    assert backend.get('short') is None
+    assert backend.get('long') == b'2'
+    assert backend.stats()['entries'] == 1
+
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return len(calls)
+
+    async def run():
+        cache = worker(path)
+        first = await cache.get_or_compute('yearly:Paris', compute, ttl_seconds=0.05)
+        cached = await cache.get_or_compute('yearly:Paris', compute, ttl_seconds=0.05)
+        await asyncio.sleep(0.1)
+        return first, cached, await cache.get_or_compute('yearly:Paris', compute, ttl_seconds=0.05)
+
+    # 过期后重新计算
+    assert asyncio.run(run()) == (1, 1, 2)
+
+
+def test_sqlite_evicts_least_recently_accessed(path):
+    backend = SQLiteCache(path, max_bytes=300)
+    for key in ('a', 'b', 'c'):
+        backend.set(key, b'x' * 100, ttl_seconds=60)
+        time.sleep(0.01)
+    # 读取 a 之后，最久未访问的是 b
+    assert backend.get('a') is not None
+    time.sleep(0.01)
+    backend.set('d', b'x' * 100, ttl_seconds=60)
+    assert [key for key in 'abcd' if backend.get(key) is not None] == ['a', 'c', 'd']
+    assert backend.stats()['bytes'] <= 300
+
+    # 超过上限的单个条目不写入，也不淘汰已有条目
+    backend.set('huge', b'x' * 301, ttl_seconds=60)
+    assert backend.get('huge') is None
+    assert backend.stats()['entries'] == 3
+
+    backend.invalidate('c')
+    assert backend.get('c') is None and backend.get('a') is not None
+
+
+def test_lru_cache_ttl_and_eviction():
+    cache = LRUCache(max_bytes=300, ttl_seconds=60, sizeof=lambda value: 100)
+    for key in ('a', 'b', 'c'):
+        cache.set(key, key)
+    assert cache.get('a') == 'a'
+    cache.set('d', 'd')
+    assert [key for key in 'abcd' if cache.get(key) is not None] == ['a', 'c', 'd']
+    assert cache.stats()['evictions'] == 1
+
+    expiring = LRUCache(ttl_seconds=0.05)
+    expiring.set('key', 'value')
+    assert expiring.get('key') == 'value'
+    time.sleep(0.1)
+    assert expiring.get('key') is None
+    assert expiring.stats()['entries'] == 0
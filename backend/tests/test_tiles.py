@@ -0,0 +1,95 @@
+"""矢量瓦片的磁盘缓存"""
+import os
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import generate_listings, to_snapshot
+from utils.classifier import TIER_NAMES, HostTierClassifier
+from utils.mvt import lnglat_to_world
+from utils.pyramid import HexPyramidService
+from utils.tiles import TileService
+
+CITY = 'TileCache'
+
+
+@pytest.fixture(scope='module')
+def listings():
+    return generate_listings(3000, CITY, seed=11)
+
+
+@pytest.fixture(scope='module')
+def snapshot(listings):
+    return to_snapshot(listings)
+
+
+def tile_files(cache_dir: str) -> list:
+    return [os.path.join(root, name) for root, _, names in os.walk(cache_dir) for name in names]
+
+
+def center_tile(listings, z: int):
+    """房源中心所在的瓦片"""
+    wx, wy = lnglat_to_world(np.nanmedian(listings['longitude']), np.nanmedian(listings['latitude']))
+    return int(wx * (1 << z)), int(wy * (1 << z))
+
+
+def make_service(cache_dir, max_disk_bytes=512 * 1024 * 1024) -> TileService:
+    classifier = HostTierClassifier()
+    return TileService(classifier, HexPyramidService(classifier), cache_dir=str(cache_dir),
+                       max_disk_bytes=max_disk_bytes)
+
+
+def test_new_fingerprint_drops_stale_tiles(tmp_path, listings, snapshot):
+    x, y = center_tile(listings, 12)
+    month = snapshot.timeline.end_month
+    service = make_service(tmp_path)
+    service.get(snapshot, month, TIER_NAMES, 12, x, y)
+
+    updated = to_snapshot(listings.iloc[:-100])
+    assert updated.fingerprint() != snapshot.fingerprint()
+    # 新进程第一次见到该城市时同样清理
+    service = make_service(tmp_path)
+    service.get(updated, month, TIER_NAMES, 12, x, y)
+    city_dir = os.path.join(str(tmp_path), CITY)
+    assert os.listdir(city_dir) == [updated.fingerprint()]
+
+
+def test_disk_cache_is_bounded(tmp_path, listings, snapshot):
+    month = snapshot.timeline.end_month
+    service = make_service(tmp_path)
+    tiles = []
+    for z in range(10, 15):
+        x, y = center_tile(listings, z)
+        tiles.extend((z, x + dx, y) for dx in (-1, 0, 1))
+    sizes = [len(service.get(snapshot, month, TIER_NAMES, z, x, y)) for z, x, y in tiles]
+    total = sum(sizes)
+
+    service = make_service(tmp_path / 'bounded', max_disk_bytes=total // 2)
+    for z, x, y in tiles:
+        service.get(snapshot, month, TIER_NAMES, z, x, y)
+    files = tile_files(str(tmp_path / 'bounded'))
+    assert sum(os.path.getsize(path) for path in files) <= total // 2
+    assert len(files) < len(tiles)
+
+
+def test_prune_keeps_recently_read_tiles(tmp_path, listings, snapshot):
+    month = snapshot.timeline.end_month
+    service = make_service(tmp_path)
+    tiles = [(z, *center_tile(listings, z)) for z in range(10, 14)]
+    for z, x, y in tiles:
+        service.get(snapshot, month, TIER_NAMES, z, x, y)
+    paths = sorted(tile_files(str(tmp_path)))
+    for i, path in enumerate(paths):
+        os.utime(path, (i, i))
+
+    # 从磁盘读取最旧的瓦片后它成为最近访问的瓦片，其次旧的瓦片最先被删除
+    oldest = paths[0]
+    service.cache.invalidate()
+    z, x, y = next(t for t in tiles if oldest.endswith(os.path.join(*map(str, t)) + '.mvt'))
+    service.get(snapshot, month, TIER_NAMES, z, x, y)
+
+    service.max_disk_bytes = int(os.path.getsize(oldest) / 0.9) + 1
+    service.prune()
+    remaining = tile_files(str(tmp_path))
+    assert oldest in remaining
+    assert paths[1] not in remaining
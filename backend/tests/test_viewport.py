@@ -0,0 +1,97 @@
+"""散点视口：范围筛选、屏幕网格聚合与抽稀"""
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import generate_listings, to_snapshot
+from utils.viewport import CLUSTER_PIXELS, TILE_PIXELS, Viewport, parse_bbox
+
+CITY = 'Viewport'
+
+
+@pytest.fixture(scope='module')
+def snapshot():
+    return to_snapshot(generate_listings(5000, CITY, seed=41))
+
+
+@pytest.fixture(scope='module')
+def idx(snapshot):
+    return np.flatnonzero(snapshot.has_coords)
+
+
+def corner_listing(snapshot, idx) -> int:
+    return idx[np.argsort(snapshot.lng[idx])[len(idx) // 4]]
+
+
+def central_bbox(snapshot, idx) -> str:
+    """从 corner_listing 的坐标开始、覆盖城市中间一部分的范围，该房源恰好在边界上"""
+    corner = corner_listing(snapshot, idx)
+    lng, lat = float(snapshot.lng[corner]), float(snapshot.lat[corner])
+    span_lng = float(np.ptp(snapshot.lng[idx])) / 3
+    span_lat = float(np.ptp(snapshot.lat[idx])) / 3
+    return f"{lng!r},{lat - span_lat!r},{lng + span_lng!r},{lat!r}"
+
+
+def test_parse_bbox_rejects_invalid():
+    assert parse_bbox(None) is None
+    for bbox in ('1,2,3', 'a,b,c,d', '3,0,1,1', '0,3,1,1'):
+        with pytest.raises(ValueError):
+            parse_bbox(bbox)
+
+
+def test_bbox_clipping_is_exact(snapshot, idx):
+    bbox = central_bbox(snapshot, idx)
+    min_lng, min_lat, max_lng, max_lat = parse_bbox(bbox)
+    kept, cluster_size, info = Viewport(bbox=bbox, max_points=50000).apply(snapshot, idx)
+
+    lat, lng = snapshot.lat[idx], snapshot.lng[idx]
+    expected = idx[(lng >= min_lng) & (lng <= max_lng) & (lat >= min_lat) & (lat <= max_lat)]
+    # 边界上的房源包含在内，保持原顺序
+    assert np.array_equal(kept, expected)
+    assert corner_listing(snapshot, idx) in kept
+    assert cluster_size is None
+    assert info == {'total_in_view': len(expected), 'clustered': False, 'thinned': False}
+
+
+@pytest.mark.parametrize('zoom', [9, 11.5, 13])
+def test_clusters_cover_every_listing_in_view(snapshot, idx, zoom):
+    bbox = central_bbox(snapshot, idx)
+    in_view, _, _ = Viewport(bbox=bbox, max_points=50000).apply(snapshot, idx)
+    kept, cluster_size, info = Viewport(bbox=bbox, zoom=zoom, max_points=50000).apply(snapshot, idx)
+
+    assert info['clustered'] and not info['thinned']
+    assert info['total_in_view'] == len(in_view) == int(cluster_size.sum())
+    assert np.all(np.diff(kept) > 0) and np.isin(kept, in_view).all()
+
+    # 每个屏幕网格恰好一个代表点，cluster_size 为该网格内的房源数
+    wx, wy = snapshot.world_coords()
+    scale = (2 ** zoom) * TILE_PIXELS / CLUSTER_PIXELS
+    cell = lambda i: list(zip(np.floor(wx[i] * scale).tolist(), np.floor(wy[i] * scale).tolist()))
+    cells, sizes = np.unique(np.array(cell(in_view)), axis=0, return_counts=True)
+    expected = dict(zip(map(tuple, cells.tolist()), sizes.tolist()))
+    assert dict(zip(cell(kept), cluster_size.tolist())) == expected
+
+
+def test_no_clustering_at_high_zoom(snapshot, idx):
+    kept, cluster_size, info = Viewport(zoom=15, max_points=50000).apply(snapshot, idx)
+    assert np.array_equal(kept, idx)
+    assert cluster_size is None and not info['clustered']
+
+
+def test_thinning_is_bounded_and_stable(snapshot, idx):
+    kept, _, info = Viewport(max_points=500).apply(snapshot, idx)
+    assert len(kept) == 500
+    assert info == {'total_in_view': len(idx), 'clustered': False, 'thinned': True}
+
+    # 视口缩小后，仍在视口内的已显示房源继续显示
+    bbox = central_bbox(snapshot, idx)
+    smaller, _, _ = Viewport(bbox=bbox, max_points=200).apply(snapshot, idx)
+    in_view, _, _ = Viewport(bbox=bbox, max_points=50000).apply(snapshot, idx)
+    shown_in_view = np.intersect1d(kept, in_view)
+    assert len(smaller) == 200
+    assert 0 < len(shown_in_view) <= len(smaller)
+    assert np.isin(shown_in_view, smaller).all()
+
+    # 与房源在快照中的位置无关
+    shuffled = np.random.default_rng(0).permutation(idx)
+    again, _, _ = Viewport(max_points=500).apply(snapshot, shuffled)
+    assert np.array_equal(np.sort(again), kept)
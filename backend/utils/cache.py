@@ -1,24 +1,449 @@
+"""
+缓存
+
+    LRUCache      进程内缓存，保存 NumPy 数组等不便序列化的派生结果
+    SharedCache   同一台机器上所有 worker 共享的 JSON 结果缓存，后端可选：
+                    SQLiteCache  默认，单个 SQLite 文件（WAL 模式）
+                    RedisCache   Redis 或兼容 Redis 协议的本地服务，需要安装 redis
+                  未命中时通过后端的锁保证只有一个 worker 计算（single-flight），
+                  其他 worker 等待结果写入后直接读取。后端在 connect() 时才创建，
+                  未连接时（例如测试中没有执行 startup）只做进程内的合并，直接计算。
+    CityDataCache /city/{city} 等按城市缓存的接口结果，存放在 SharedCache 中
+
+SHARED_CACHE_URL 选择共享缓存后端：sqlite:///path/to/cache.sqlite3 或 redis://host:port/db
+"""
 from functools import lru_cache
 import asyncio
-from typing import Dict, Any
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, Awaitable, Callable, Hashable, Optional
 import json
 from datetime import datetime
 
+try:
+    import redis
+except ImportError:
+    redis = None
+
+SHARED_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'shared_cache.sqlite3')
+
+def estimate_nbytes(value) -> int:
+    """估算缓存对象占用的内存，优先使用对象自身的 nbytes"""
+    nbytes = getattr(value, 'nbytes', None)
+    if nbytes is not None:
+        return int(nbytes)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """按内存大小限制的 LRU 缓存，支持 TTL 与命中统计，线程安全"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 3600,
+                 sizeof: Callable[[Any], int] = estimate_nbytes):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._sizeof = sizeof
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, size, expires_at = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value):
+        size = self._sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            # 单个对象超过上限时不缓存
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size, time.monotonic() + self.ttl_seconds)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, predicate: Callable[[Hashable], bool] = None):
+        """删除满足 predicate 的键，不传时清空缓存"""
+        with self._lock:
+            for key in [k for k in self._entries if predicate is None or predicate(k)]:
+                self._remove(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+
+class SQLiteCache:
+    """保存在 SQLite 文件中的共享缓存，按 TTL 过期，超过 max_bytes 时淘汰最久未访问的条目"""
+
+    def __init__(self, path: str = SHARED_CACHE_PATH, max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed_at ON cache_entries(accessed_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_locks (
+                key TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+
+    def _conn(self) -> sqlite3.Connection:
+        # 每个线程一个连接，autocommit
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT value FROM cache_entries WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key: str, value: bytes, ttl_seconds: float):
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now + ttl_seconds, now)
+            )
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+            if total > self.max_bytes:
+                # 按访问时间从旧到新淘汰，直到总大小不超过上限
+                conn.execute("""
+                    DELETE FROM cache_entries WHERE key IN (
+                        SELECT key FROM (
+                            SELECT key, size, SUM(size) OVER (ORDER BY accessed_at, key) AS running
+                            FROM cache_entries
+                            WHERE key != ?
+                        )
+                        WHERE running - size < ?
+                    )
+                """, (key, total - self.max_bytes))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, key: str):
+        self._conn().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    def invalidate(self, prefix: str = None):
+        if prefix is None:
+            self._conn().execute("DELETE FROM cache_entries")
+        else:
+            self._conn().execute(
+                "DELETE FROM cache_entries WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+            )
+
+    def try_lock(self, key: str, owner: str, ttl_seconds: float) -> bool:
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM cache_locks WHERE key = ? AND expires_at <= ?", (key, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO cache_locks (key, owner, expires_at) VALUES (?, ?, ?)",
+                (key, owner, now + ttl_seconds)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return cursor.rowcount == 1
+
+    def unlock(self, key: str, owner: str):
+        self._conn().execute("DELETE FROM cache_locks WHERE key = ? AND owner = ?", (key, owner))
+
+    def stats(self) -> dict:
+        entries, size = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries WHERE expires_at > ?", (time.time(),)
+        ).fetchone()
+        return {
+            "backend": "sqlite",
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes
+        }
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class RedisCache:
+    """Redis（或兼容 Redis 协议的服务）共享缓存，容量上限由服务端的 maxmemory 策略控制"""
+
+    def __init__(self, url: str):
+        if redis is None:
+            raise RuntimeError("RedisCache requires the redis package")
+        self.url = url
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(key)
+
+    def set(self, key: str, value: bytes, ttl_seconds: float):
+        self._client.set(key, value, px=max(int(ttl_seconds * 1000), 1))
+
+    def delete(self, key: str):
+        self._client.delete(key)
+
+    def invalidate(self, prefix: str = None):
+        keys = list(self._client.scan_iter(match=f'{prefix or ""}*'))
+        if keys:
+            self._client.delete(*keys)
+
+    def try_lock(self, key: str, owner: str, ttl_seconds: float) -> bool:
+        return bool(self._client.set(f'lock:{key}', owner, nx=True, px=max(int(ttl_seconds * 1000), 1)))
+
+    def unlock(self, key: str, owner: str):
+        # 只释放自己持有的锁
+        self._client.eval(
+            "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0",
+            1, f'lock:{key}', owner
+        )
+
+    def stats(self) -> dict:
+        info = self._client.info('memory')
+        return {
+            "backend": "redis",
+            "entries": self._client.dbsize(),
+            "bytes": info.get('used_memory'),
+            "max_bytes": info.get('maxmemory')
+        }
+
+    def close(self):
+        self._client.close()
+
+
+class SharedCache:
+    """跨 worker 共享的 JSON 结果缓存，未命中时只有一个 worker 计算"""
+
+    def __init__(self, backend=None, namespace: str = 'airbnb', ttl_seconds: float = 3600,
+                 lock_seconds: float = 60, poll_seconds: float = 0.05):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds
+        self.poll_seconds = poll_seconds
+        self._owner = uuid.uuid4().hex
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    def connect(self, backend=None):
+        """创建后端，不传时按 SHARED_CACHE_URL 创建（见 create_cache_backend）"""
+        self.backend = backend if backend is not None else create_cache_backend()
+
+    def _key(self, key: str) -> str:
+        return f'{self.namespace}:{key}'
+
+    def _load(self, key: str):
+        data = self.backend.get(self._key(key))
+        return None if data is None else json.loads(data)
+
+    def _store(self, key: str, value, ttl_seconds: float):
+        self.backend.set(self._key(key), json.dumps(value).encode('utf-8'), ttl_seconds)
+
+    async def get(self, key: str):
+        if self.backend is None:
+            return None
+        # 较大的结果解码也放在线程中
+        return await asyncio.to_thread(self._load, key)
+
+    async def set(self, key: str, value, ttl_seconds: float = None):
+        if self.backend is None:
+            return
+        await asyncio.to_thread(self._store, key, value, self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+
+    async def delete(self, key: str):
+        if self.backend is not None:
+            await asyncio.to_thread(self.backend.delete, self._key(key))
+
+    async def invalidate(self, prefix: str = ''):
+        if self.backend is not None:
+            await asyncio.to_thread(self.backend.invalidate, self._key(prefix))
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]], ttl_seconds: float = None,
+                             lock_seconds: float = None):
+        """
+        读取 key，未命中时计算并写入；所有 worker 中只有一个执行 compute，其他等待结果。
+        lock_seconds 为等待的上限，超过后认为持有锁的 worker 已经退出，自行计算
+        """
+        value = await self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+
+        # 同一进程内的并发请求共享一次计算
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            if self.backend is None:
+                value = await compute()
+            else:
+                value = await self._fill(key, compute, ttl_seconds, lock_seconds or self.lock_seconds)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _fill(self, key: str, compute, ttl_seconds, lock_seconds: float):
+        full_key = self._key(key)
+        deadline = time.monotonic() + lock_seconds
+        while True:
+            if await asyncio.to_thread(self.backend.try_lock, full_key, self._owner, lock_seconds):
+                try:
+                    # 拿到锁之前可能已经有其他 worker 写入
+                    value = await self.get(key)
+                    if value is None:
+                        value = await compute()
+                        await self.set(key, value, ttl_seconds)
+                    return value
+                finally:
+                    await asyncio.to_thread(self.backend.unlock, full_key, self._owner)
+
+            # 其他 worker 正在计算，等待结果
+            self.waits += 1
+            await asyncio.sleep(self.poll_seconds)
+            value = await self.get(key)
+            if value is not None:
+                return value
+            if time.monotonic() > deadline:
+                # 持有锁的 worker 可能已经退出，自行计算
+                return await compute()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        stats = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "waits": self.waits,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+        if self.backend is None:
+            stats["backend"] = None
+            return stats
+        try:
+            stats.update(self.backend.stats())
+        except Exception as e:
+            stats["error"] = str(e)
+        return stats
+
+    def close(self):
+        if self.backend is not None:
+            self.backend.close()
+            self.backend = None
+
+
+def create_cache_backend(url: str = None, max_bytes: int = None):
+    """按 SHARED_CACHE_URL 创建共享缓存后端，默认使用 data/ 下的 SQLite 文件"""
+    url = url or os.getenv('SHARED_CACHE_URL', '')
+    max_bytes = max_bytes or int(os.getenv('SHARED_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisCache(url)
+    if url.startswith('sqlite:///'):
+        return SQLiteCache(url[len('sqlite:///'):], max_bytes=max_bytes)
+    return SQLiteCache(max_bytes=max_bytes)
+
+
+def create_shared_cache(url: str = None, max_bytes: int = None) -> SharedCache:
+    """创建并连接共享缓存"""
+    return SharedCache(create_cache_backend(url, max_bytes))
+
+
 class CityDataCache:
-    def __init__(self):
-        self._cache: Dict[str, Any] = {}
-        self._last_update: Dict[str, datetime] = {}
-    
+    """按城市缓存接口结果，所有 worker 共享"""
+
+    def __init__(self, shared: SharedCache, prefix: str = 'city'):
+        self._shared = shared
+        self._prefix = prefix
+
     async def get_or_set(self, city_name: str, getter_func, ttl_seconds: int = 3600):
-        now = datetime.now()
-        if (city_name in self._cache and 
-            city_name in self._last_update and 
-            (now - self._last_update[city_name]).seconds < ttl_seconds):
-            return self._cache[city_name]
-        
-        data = await getter_func(city_name)
-        self._cache[city_name] = data
-        self._last_update[city_name] = now
-        return data
-
-city_cache = CityDataCache() 
\ No newline at end of file
+        return await self._shared.get_or_compute(
+            f'{self._prefix}:{city_name}',
+            lambda: getter_func(city_name),
+            ttl_seconds
+        )
+
+    async def invalidate(self, city_name: str = None):
+        if city_name is None:
+            await self._shared.invalidate(f'{self._prefix}:')
+        else:
+            await self._shared.delete(f'{self._prefix}:{city_name}')
@@ -0,0 +1,148 @@
+"""
+房东分级
+
+五个等级：
+    single_host        截至该月只有 1 个房源
+    dual_host          截至该月有 2 个房源
+    highly_commercial  房源数 > 2 的房东中按房源数排名前 5%（至少 1 个）
+    commercial         接下来的 10%（至少 1 个）
+    semi_commercial    其余房源数 > 2 的房东
+
+同一 (city, month) 的分级结果在所有接口之间共享，缓存在 LRUCache 中。
+"""
+from typing import Iterable
+
+import numpy as np
+
+from utils.cache import LRUCache
+from utils.timing import stage
+
+TIER_NAMES = (
+    'highly_commercial',
+    'commercial',
+    'semi_commercial',
+    'dual_host',
+    'single_host'
+)
+TIER_CODES = {name: code for code, name in enumerate(TIER_NAMES)}
+# 房源数 > 2 的房东
+COMMERCIAL_TIERS = ('highly_commercial', 'commercial', 'semi_commercial')
+NO_TIER = np.uint8(255)
+
+
+class HostTiers:
+    """某个时间点的房东分级结果：按 host_id 排序的房东、等级编码和房源数"""
+
+    def __init__(self, host_ids: np.ndarray, tiers: np.ndarray, counts: np.ndarray, source=None):
+        self.host_ids = host_ids
+        self.tiers = tiers
+        self.counts = counts
+        # 生成该结果的时间线，快照刷新后据此判断缓存是否过期
+        self.source = source
+
+    @property
+    def nbytes(self) -> int:
+        return self.host_ids.nbytes + self.tiers.nbytes + self.counts.nbytes
+
+    def __len__(self) -> int:
+        return len(self.host_ids)
+
+    def codes_for(self, categories: Iterable[str]) -> np.ndarray:
+        return np.array([TIER_CODES[c] for c in categories if c in TIER_CODES], dtype=np.uint8)
+
+    def hosts_in(self, categories: Iterable[str]) -> np.ndarray:
+        """属于所选等级的房东（升序）"""
+        return self.host_ids[np.isin(self.tiers, self.codes_for(categories))]
+
+    def tier_of(self, host_ids: np.ndarray) -> np.ndarray:
+        """查询房东的等级编码，不在结果中的房东返回 NO_TIER"""
+        host_ids = np.asarray(host_ids, dtype=np.int64)
+        result = np.full(len(host_ids), NO_TIER, dtype=np.uint8)
+        if len(self.host_ids) == 0:
+            return result
+        positions = np.minimum(np.searchsorted(self.host_ids, host_ids), len(self.host_ids) - 1)
+        found = self.host_ids[positions] == host_ids
+        result[found] = self.tiers[positions[found]]
+        return result
+
+    def category_info(self, category: str) -> dict:
+        """host_ranking 中单个等级的描述，host_ids 按房源数降序"""
+        members = np.flatnonzero(self.tiers == TIER_CODES[category])
+        if len(members) == 0:
+            return {
+                "range": None,
+                "count": 0,
+                "host_ids": []
+            }
+        counts = self.counts[members]
+        order = np.lexsort((self.host_ids[members], -counts))
+        return {
+            "range": {
+                "min": int(counts.min()),
+                "max": int(counts.max())
+            },
+            "count": len(members),
+            "host_ids": [str(id) for id in self.host_ids[members[order]].tolist()]
+        }
+
+
+def classify_hosts(host_ids: np.ndarray, counts: np.ndarray, source=None) -> HostTiers:
+    """
+    对房东分级，host_ids / counts 需按房源数降序排列
+    （与 HostTimeline.host_listing_counts 的输出一致）
+    """
+    tiers = np.empty(len(host_ids), dtype=np.uint8)
+    tiers[counts == 1] = TIER_CODES['single_host']
+    tiers[counts == 2] = TIER_CODES['dual_host']
+
+    multi = np.flatnonzero(counts > 2)
+    if len(multi) > 0:
+        p5_count = max(1, int(len(multi) * 0.05))
+        p15_count = max(p5_count + 1, int(len(multi) * 0.15))
+        tiers[multi[:p5_count]] = TIER_CODES['highly_commercial']
+        tiers[multi[p5_count:p15_count]] = TIER_CODES['commercial']
+        tiers[multi[p15_count:]] = TIER_CODES['semi_commercial']
+
+    order = np.argsort(host_ids, kind='stable')
+    return HostTiers(
+        np.asarray(host_ids, dtype=np.int64)[order],
+        tiers[order],
+        np.asarray(counts, dtype=np.int32)[order],
+        source
+    )
+
+
+def clamp_month(timeline, month: int) -> int:
+    """时间线范围之外的月份结果相同，归并到范围边界，用作各 (city, month) 缓存的键"""
+    return min(max(month, timeline.start_month - 1), timeline.end_month)
+
+
+class HostTierClassifier:
+    """按 (city, month) 缓存房东分级结果"""
+
+    def __init__(self, cache: LRUCache = None):
+        self.cache = cache or LRUCache()
+
+    def classify(self, snapshot, month: int) -> HostTiers:
+        timeline = snapshot.timeline
+        key_month = clamp_month(timeline, month)
+        key = (snapshot.city, key_month)
+
+        tiers = self.cache.get(key)
+        if tiers is not None and tiers.source is timeline:
+            return tiers
+
+        with stage('classify'):
+            host_ids, counts = timeline.host_listing_counts(key_month)
+            tiers = classify_hosts(host_ids, counts, source=timeline)
+        self.cache.set(key, tiers)
+        return tiers
+
+    def invalidate(self, city_name: str = None):
+        if city_name is None:
+            self.cache.invalidate()
+        else:
+            self.cache.invalidate(lambda key: key[0] == city_name)
+
+    def stats(self) -> dict:
+        return self.cache.stats()
@@ -0,0 +1,106 @@
+"""
+请求合并与取代
+
+拖动时间滑块时，同一个城市的 host_ranking / listings_by_categories 请求会成批到达：
+    - 参数完全相同的并发请求共享一次计算（coalescing），完成后所有等待者拿到同一个结果
+    - 请求可以带 X-Supersede-Token 头，同一接口上 token 相同的新请求到达后，旧请求
+      立即返回 409；旧请求的计算如果没有其他等待者会被取消，把数据库连接和 CPU
+      留给用户真正在等的请求
+取消只在 await 处生效，已经交给线程执行的部分会执行完，但结果被丢弃。
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+SUPERSEDE_HEADER = 'x-supersede-token'
+
+
+class Superseded(Exception):
+    """请求被同一 token 的新请求取代"""
+
+
+class _Flight:
+    """一次进行中的计算及其等待者数量"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class RequestCoalescer:
+    """按 (接口名, 参数...) 合并并发请求，按 (接口名, token) 取代旧请求"""
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._slots: Dict[tuple, asyncio.Future] = {}
+        self.computed = 0
+        self.coalesced = 0
+        self.superseded = 0
+        self.cancelled = 0
+
+    def _finish(self, key: tuple, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # 没有等待者时避免 "exception was never retrieved" 警告
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def _join(self, key: tuple, compute: Callable[[], Awaitable[Any]]) -> _Flight:
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            return flight
+
+        flight = _Flight(asyncio.create_task(compute()))
+        flight.task.add_done_callback(lambda _: self._finish(key, flight))
+        self._flights[key] = flight
+        self.computed += 1
+        return flight
+
+    def _leave(self, key: tuple, flight: _Flight):
+        flight.waiters -= 1
+        if flight.waiters == 0 and not flight.task.done():
+            # 最后一个等待者离开，后来的相同请求重新计算
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.task.cancel()
+            self.cancelled += 1
+
+    async def run(self, key: tuple, compute: Callable[[], Awaitable[Any]], token: Optional[str] = None):
+        """
+        key 的第一个元素是接口名；compute 返回协程，只在没有相同的进行中计算时调用。
+        被取代时抛出 Superseded
+        """
+        flight = self._join(key, compute)
+        flight.waiters += 1
+        if not token:
+            try:
+                return await asyncio.shield(flight.task)
+            finally:
+                self._leave(key, flight)
+
+        slot = (key[0], token)
+        previous = self._slots.get(slot)
+        if previous is not None and not previous.done():
+            previous.set_result(None)
+        superseded = asyncio.get_running_loop().create_future()
+        self._slots[slot] = superseded
+
+        try:
+            await asyncio.wait((flight.task, superseded), return_when=asyncio.FIRST_COMPLETED)
+            if flight.task.done():
+                return flight.task.result()
+            self.superseded += 1
+            raise Superseded(f"Superseded by a newer {key[0]} request")
+        finally:
+            if self._slots.get(slot) is superseded:
+                del self._slots[slot]
+            self._leave(key, flight)
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': len(self._flights),
+            'computed': self.computed,
+            'coalesced': self.coalesced,
+            'superseded': self.superseded,
+            'cancelled': self.cancelled
+        }
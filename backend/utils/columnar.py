@@ -0,0 +1,140 @@
+"""
+散点数据的二进制列式格式
+
+JSON 格式下每条房源都是一个字典，坐标、价格都以文本传输。散点接口可以通过
+format=columns / format=arrow 参数，或 Accept 头，改为返回列式二进制数据：
+
+    latitude / longitude   float32
+    tier                   uint8，房东等级编码（见 utils/classifier.py 的 TIER_NAMES）
+    host                   uint32，指向 hosts 字典的下标
+    hosts                  int64，本次返回涉及的房东 id（字典）
+    price                  float32，price 文本解析出的数值，无法解析为 NaN
+    processed_price        float32，空值为 NaN
+
+columns 格式（application/vnd.hosts-study.columns）：
+    4 字节魔数 b'HCOL'，uint32 小端头部长度，UTF-8 JSON 头部，随后是各列的原始字节。
+    头部包含 columns: [{name, dtype, offset, length}]，offset 相对于数据区起点，
+    每列按 8 字节对齐，前端可以直接用 new Float32Array(buffer, offset, length) 读取。
+    其余元数据（total_listings、tier_names 等）也放在头部。
+
+arrow 格式（application/vnd.apache.arrow.stream）使用 pyarrow（见 requirements.txt），
+hosts 字典以 dictionary 编码的 host_id 列表示；未安装 pyarrow 时 format=arrow 返回 400。
+"""
+import json
+import struct
+from typing import Dict, Optional
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+from utils.classifier import TIER_NAMES
+
+COLUMNS_MEDIA_TYPE = 'application/vnd.hosts-study.columns'
+ARROW_MEDIA_TYPE = 'application/vnd.apache.arrow.stream'
+
+COLUMNS_MAGIC = b'HCOL'
+ALIGNMENT = 8
+
+FORMATS = {
+    'json': 'application/json',
+    'columns': COLUMNS_MEDIA_TYPE,
+    'arrow': ARROW_MEDIA_TYPE
+}
+
+
+def negotiate_format(requested: Optional[str] = None, accept: Optional[str] = None) -> str:
+    """按 format 参数或 Accept 头选择返回格式，默认 json"""
+    if requested:
+        requested = requested.lower()
+        if requested not in FORMATS:
+            raise ValueError(f"Unsupported format: {requested}. Use one of {', '.join(FORMATS)}")
+        if requested == 'arrow' and pa is None:
+            raise ValueError("Arrow format requires pyarrow to be installed")
+        return requested
+
+    if accept:
+        media_types = [part.split(';')[0].strip().lower() for part in accept.split(',')]
+        if COLUMNS_MEDIA_TYPE in media_types:
+            return 'columns'
+        if ARROW_MEDIA_TYPE in media_types and pa is not None:
+            return 'arrow'
+    return 'json'
+
+
+def scatter_columns(snapshot, idx: np.ndarray, tiers) -> Dict[str, np.ndarray]:
+    """选中房源的列式数据，房东 id 做字典编码"""
+    hosts, host = np.unique(snapshot.host_id[idx], return_inverse=True)
+    return {
+        'latitude': snapshot.lat[idx].astype(np.float32),
+        'longitude': snapshot.lng[idx].astype(np.float32),
+        'tier': tiers.tier_of(hosts)[host],
+        'host': host.reshape(-1).astype(np.uint32),
+        'hosts': hosts.astype(np.int64),
+        'price': snapshot.price_values()[idx].astype(np.float32),
+        'processed_price': snapshot.processed_price[idx].astype(np.float32)
+    }
+
+
+def encode_columns(columns: Dict[str, np.ndarray], meta: dict = None) -> bytes:
+    """编码为 columns 格式"""
+    descriptors = []
+    chunks = []
+    offset = 0
+    for name, values in columns.items():
+        data = np.ascontiguousarray(values, dtype=values.dtype.newbyteorder('<')).tobytes()
+        descriptors.append({
+            'name': name,
+            'dtype': values.dtype.name,
+            'offset': offset,
+            'length': len(values)
+        })
+        padding = -len(data) % ALIGNMENT
+        chunks.append(data + b'\0' * padding)
+        offset += len(data) + padding
+
+    header = dict(meta or {})
+    header['tier_names'] = list(TIER_NAMES)
+    header['columns'] = descriptors
+    header_bytes = json.dumps(header).encode('utf-8')
+    # 头部补齐到 8 字节，使数据区起点对齐
+    header_bytes += b' ' * (-(len(header_bytes) + 8) % ALIGNMENT)
+
+    return COLUMNS_MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes + b''.join(chunks)
+
+
+def encode_arrow(columns: Dict[str, np.ndarray], meta: dict = None) -> bytes:
+    """编码为 Arrow IPC stream，hosts 字典并入 host_id 的 dictionary 列"""
+    if pa is None:
+        raise RuntimeError("pyarrow is not installed")
+
+    host_id = pa.DictionaryArray.from_arrays(
+        pa.array(columns['host'], type=pa.uint32()),
+        pa.array(columns['hosts'], type=pa.int64())
+    )
+    arrays = [host_id]
+    names = ['host_id']
+    for name, values in columns.items():
+        if name in ('host', 'hosts'):
+            continue
+        arrays.append(pa.array(values))
+        names.append(name)
+
+    metadata = {key: json.dumps(value) for key, value in (meta or {}).items()}
+    metadata['tier_names'] = json.dumps(list(TIER_NAMES))
+    table = pa.Table.from_arrays(arrays, names=names, metadata=metadata)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def encode(fmt: str, columns: Dict[str, np.ndarray], meta: dict = None) -> bytes:
+    """按 negotiate_format 选出的二进制格式编码"""
+    if fmt == 'arrow':
+        return encode_arrow(columns, meta)
+    return encode_columns(columns, meta)
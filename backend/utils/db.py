@@ -0,0 +1,161 @@
+"""
+异步数据库访问层
+
+所有接口通过同一个 asyncpg 连接池访问 PostgreSQL，避免在事件循环里同步调用
+psycopg2.connect。固定查询以常量形式定义，asyncpg 会在每个连接上把它们
+prepare 一次并缓存（statement_cache_size），之后只传参数执行。
+
+连接池和超时可以通过环境变量配置：
+    DATABASE_URL          连接串
+    DB_POOL_MIN_SIZE      最小连接数（默认 2）
+    DB_POOL_MAX_SIZE      最大连接数（默认 10）
+    DB_QUERY_TIMEOUT      单条查询超时秒数（默认 30）
+    DB_ACQUIRE_TIMEOUT    等待空闲连接的超时秒数（默认 10）
+
+每条查询的耗时计入所在请求的 db 阶段（见 utils/timing.py）。
+"""
+import os
+import time
+from contextlib import asynccontextmanager
+
+import asyncpg
+
+from utils.logger import logger
+from utils.timing import record_query
+
+
+class DataAccess:
+    """asyncpg 连接池封装，附带连接池饱和度统计"""
+
+    def __init__(
+        self,
+        dsn: str,
+        min_size: int = 2,
+        max_size: int = 10,
+        query_timeout: float = 30.0,
+        acquire_timeout: float = 10.0,
+        statement_cache_size: int = 100
+    ):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.query_timeout = query_timeout
+        self.acquire_timeout = acquire_timeout
+        self.statement_cache_size = statement_cache_size
+        self.pool = None
+
+        self._waiting = 0
+        self._max_waiting = 0
+        self._acquires = 0
+        self._acquire_wait_total = 0.0
+        self._acquire_wait_max = 0.0
+        self._queries = 0
+        self._timeouts = 0
+        self._errors = 0
+
+    @classmethod
+    def from_env(cls, default_dsn: str) -> "DataAccess":
+        return cls(
+            os.getenv('DATABASE_URL', default_dsn),
+            min_size=int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            max_size=int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            query_timeout=float(os.getenv('DB_QUERY_TIMEOUT', 30)),
+            acquire_timeout=float(os.getenv('DB_ACQUIRE_TIMEOUT', 10))
+        )
+
+    async def connect(self):
+        if self.pool is None:
+            self.pool = await asyncpg.create_pool(
+                self.dsn,
+                min_size=self.min_size,
+                max_size=self.max_size,
+                statement_cache_size=self.statement_cache_size
+            )
+            logger.info(f"Database pool ready (min={self.min_size}, max={self.max_size})")
+
+    async def disconnect(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    @asynccontextmanager
+    async def acquire(self):
+        """从连接池取连接，并记录等待情况"""
+        if self.pool is None:
+            raise RuntimeError("Database pool is not connected")
+
+        self._waiting += 1
+        self._max_waiting = max(self._max_waiting, self._waiting)
+        start = time.perf_counter()
+        try:
+            conn = await self.pool.acquire(timeout=self.acquire_timeout)
+        finally:
+            self._waiting -= 1
+        waited = time.perf_counter() - start
+        self._acquires += 1
+        self._acquire_wait_total += waited
+        self._acquire_wait_max = max(self._acquire_wait_max, waited)
+
+        try:
+            yield conn
+        finally:
+            await self.pool.release(conn)
+
+    async def _run(self, method: str, query: str, args, timeout):
+        self._queries += 1
+        start = time.perf_counter()
+        try:
+            async with self.acquire() as conn:
+                return await getattr(conn, method)(
+                    query, *args,
+                    timeout=self.query_timeout if timeout is None else timeout
+                )
+        except asyncpg.exceptions.QueryCanceledError:
+            self._timeouts += 1
+            raise
+        except TimeoutError:
+            self._timeouts += 1
+            raise
+        except Exception:
+            self._errors += 1
+            raise
+        finally:
+            record_query(query, args, time.perf_counter() - start)
+
+    async def fetch(self, query: str, *args, timeout: float = None):
+        return await self._run('fetch', query, args, timeout)
+
+    async def fetchrow(self, query: str, *args, timeout: float = None):
+        return await self._run('fetchrow', query, args, timeout)
+
+    async def fetchval(self, query: str, *args, timeout: float = None):
+        return await self._run('fetchval', query, args, timeout)
+
+    async def execute(self, query: str, *args, timeout: float = None):
+        return await self._run('execute', query, args, timeout)
+
+    async def explain(self, query: str, args: tuple) -> str:
+        """只读查询的 EXPLAIN ANALYZE 结果，会再执行一次查询"""
+        if not query.lstrip().upper().startswith(('SELECT', 'WITH')):
+            return 'EXPLAIN skipped: not a read-only query'
+        rows = await self.fetch(f"EXPLAIN (ANALYZE, BUFFERS) {query}", *args)
+        return '\n'.join(row[0] for row in rows)
+
+    def stats(self) -> dict:
+        """连接池饱和度：连接数、空闲数、排队数以及等待时间"""
+        size = self.pool.get_size() if self.pool else 0
+        idle = self.pool.get_idle_size() if self.pool else 0
+        return {
+            "size": size,
+            "idle": idle,
+            "in_use": size - idle,
+            "max_size": self.max_size,
+            "waiting": self._waiting,
+            "max_waiting": self._max_waiting,
+            "acquires": self._acquires,
+            "acquire_wait_avg_ms": round(self._acquire_wait_total / self._acquires * 1000, 3) if self._acquires else 0.0,
+            "acquire_wait_max_ms": round(self._acquire_wait_max * 1000, 3),
+            "queries": self._queries,
+            "timeouts": self._timeouts,
+            "errors": self._errors
+        }
@@ -0,0 +1,177 @@
+"""
+H3 六边形分箱
+
+latlng_to_cells / latlng_to_cells_multi 把坐标数组批量转换为 H3 单元（uint64 数组）。
+h3 3.x 没有数组接口，每个点仍需调用一次 geo_to_h3，因此：
+    - 多个分辨率在同一次遍历中计算，坐标只转换、传输一次
+    - 点数达到 PARALLEL_MIN_POINTS 时分块交给模块级的进程池；进程池用 spawn 方式
+      创建并在整个进程中复用（服务进程里有线程，不能 fork），关闭时调用 shutdown_pool
+bin_points 在单元数组上用 np.unique 统计点数。
+
+六边形的边界和中心点不会变化，HexBoundaryCache 在进程内按分辨率缓存，
+并可以保存到 data/hex_boundaries/ 下，重启后直接读取。
+"""
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Dict, Iterable, List
+
+import numpy as np
+from h3.api import basic_int as h3_int
+
+DEFAULT_RESOLUTION = 9
+
+# 达到该点数时使用进程池，一般城市的房源数都会超过
+PARALLEL_MIN_POINTS = int(os.getenv('H3_PARALLEL_MIN_POINTS', 10_000))
+H3_WORKERS = int(os.getenv('H3_WORKERS', os.cpu_count() or 1))
+MIN_CHUNK_SIZE = 2_000
+
+BOUNDARY_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'hex_boundaries')
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=H3_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def shutdown_pool():
+    """关闭进程池，下次使用时重新创建"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _cells_chunk(args) -> np.ndarray:
+    """一块坐标在各分辨率上的单元，返回 len(resolutions) × 点数"""
+    lat, lng, resolutions = args
+    lat, lng = lat.tolist(), lng.tolist()
+    cells = np.empty((len(resolutions), len(lat)), dtype=np.uint64)
+    for row, resolution in enumerate(resolutions):
+        cells[row] = np.fromiter(map(h3_int.geo_to_h3, lat, lng, repeat(resolution)), dtype=np.uint64, count=len(lat))
+    return cells
+
+
+def latlng_to_cells_multi(lat: np.ndarray, lng: np.ndarray, resolutions: Iterable[int],
+                          workers: int = None) -> Dict[int, np.ndarray]:
+    """一次遍历计算坐标在多个分辨率上的 H3 单元，坐标为 NaN 的位置为 0"""
+    lat = np.asarray(lat, dtype=np.float64)
+    lng = np.asarray(lng, dtype=np.float64)
+    resolutions = list(resolutions)
+    cells = np.zeros((len(resolutions), len(lat)), dtype=np.uint64)
+    valid = np.flatnonzero(~(np.isnan(lat) | np.isnan(lng)))
+
+    if workers is None:
+        workers = H3_WORKERS if len(valid) >= PARALLEL_MIN_POINTS else 1
+    if len(valid) > 0 and workers > 1:
+        chunk_size = max(MIN_CHUNK_SIZE, -(-len(valid) // (workers * 2)))
+        chunks = [
+            (lat[valid[i:i + chunk_size]], lng[valid[i:i + chunk_size]], resolutions)
+            for i in range(0, len(valid), chunk_size)
+        ]
+        cells[:, valid] = np.concatenate(list(_get_pool().map(_cells_chunk, chunks)), axis=1)
+    elif len(valid) > 0:
+        cells[:, valid] = _cells_chunk((lat[valid], lng[valid], resolutions))
+
+    return dict(zip(resolutions, cells))
+
+
+def latlng_to_cells(lat: np.ndarray, lng: np.ndarray, resolution: int = DEFAULT_RESOLUTION,
+                    workers: int = None) -> np.ndarray:
+    """批量计算坐标所在的 H3 单元，坐标为 NaN 的位置返回 0"""
+    return latlng_to_cells_multi(lat, lng, [resolution], workers)[resolution]
+
+
+def bin_points(cells: np.ndarray):
+    """统计每个 H3 单元的点数，忽略值为 0 的无效单元"""
+    cells = np.asarray(cells, dtype=np.uint64)
+    hex_ids, counts = np.unique(cells[cells != 0], return_counts=True)
+    return hex_ids, counts
+
+
+class HexBoundaryCache:
+    """进程级六边形边界 / 中心点缓存"""
+
+    def __init__(self, cache_dir: str = BOUNDARY_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._entries: Dict[int, Dict[int, dict]] = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def _path(self, resolution: int) -> str:
+        return os.path.join(self.cache_dir, f'res{resolution}.json')
+
+    def _resolution_entries(self, resolution: int) -> Dict[int, dict]:
+        entries = self._entries.get(resolution)
+        if entries is None:
+            with self._lock:
+                entries = self._entries.get(resolution)
+                if entries is None:
+                    entries = {}
+                    path = self._path(resolution)
+                    if os.path.exists(path):
+                        with open(path) as f:
+                            entries = {
+                                h3_int.string_to_h3(hex_id): entry
+                                for hex_id, entry in json.load(f).items()
+                            }
+                    self._entries[resolution] = entries
+        return entries
+
+    def get(self, cell: int) -> dict:
+        cell = int(cell)
+        resolution = h3_int.h3_get_resolution(cell)
+        entries = self._resolution_entries(resolution)
+        entry = entries.get(cell)
+        if entry is None:
+            entry = {
+                'id': h3_int.h3_to_string(cell),
+                'boundary': [list(p) for p in h3_int.h3_to_geo_boundary(cell)],
+                'center': list(h3_int.h3_to_geo(cell))
+            }
+            # 工作线程中调用，插入与 save 的复制互斥
+            with self._lock:
+                entry = entries.setdefault(cell, entry)
+                self._dirty.add(resolution)
+        return entry
+
+    def hexagons(self, hex_ids: np.ndarray, counts: np.ndarray) -> List[dict]:
+        """生成接口返回的六边形列表"""
+        result = []
+        for cell, count in zip(hex_ids.tolist(), counts.tolist()):
+            entry = self.get(cell)
+            result.append({
+                'id': entry['id'],
+                'boundary': entry['boundary'],
+                'center': entry['center'],
+                'points_count': count
+            })
+        return result
+
+    def save(self):
+        """把新增的边界写入磁盘"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            if not dirty:
+                return
+            os.makedirs(self.cache_dir, exist_ok=True)
+            for resolution in dirty:
+                entries = dict(self._entries.get(resolution, {}))
+                path = self._path(resolution)
+                with open(path + '.tmp', 'w') as f:
+                    json.dump({entry['id']: entry for entry in entries.values()}, f)
+                os.replace(path + '.tmp', path)
+
+
+hex_boundaries = HexBoundaryCache()
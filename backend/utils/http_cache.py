@@ -0,0 +1,203 @@
+"""
+/city/* 接口的 HTTP 条件缓存与预压缩响应体
+
+数据只在导入时变化，因此同一个城市、同一个数据版本下，同样的请求返回同样的内容：
+    - ETag 由 (数据版本, 路径, 查询参数, Accept) 生成，If-None-Match 命中时直接返回 304
+    - Last-Modified 使用 city_data_versions.updated_at
+    - 200 响应体连同 gzip / brotli 压缩结果一起缓存在 LRUCache 中，
+      重复请求跳过路由、JSON 编码和压缩
+    - 分块发送的响应（没有 Content-Length，见 utils/responses.py）第一次请求时
+      边 gzip 压缩边转发，同时收集原始内容和压缩结果，不等整个响应体生成完
+城市没有数据版本且快照尚未加载时无法确定版本，这类请求不做缓存。
+
+需要放在 CORSMiddleware 内层，CORS 头仍按每个请求的 Origin 生成；
+外层的 GZipMiddleware 看到 Content-Encoding 后不会重复压缩。
+"""
+import gzip
+import hashlib
+import zlib
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Callable, Optional, Tuple
+from urllib.parse import unquote
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from utils.cache import LRUCache
+
+# 流式响应不缓存
+STREAMING_TYPES = ('text/event-stream', 'application/x-ndjson')
+# 小于该大小的响应体不压缩
+MINIMUM_COMPRESS_SIZE = 1000
+
+
+def accepted_encodings(accept_encoding: str) -> set:
+    return {
+        part.split(';')[0].strip().lower()
+        for part in accept_encoding.split(',')
+        if not part.strip().endswith(';q=0')
+    }
+
+
+class CachedBody:
+    """一个响应的原始内容和各压缩版本"""
+
+    def __init__(self, status: int, headers: list, body: bytes, gzipped: Optional[bytes] = None):
+        self.status = status
+        self.headers = headers
+        self.variants = {'identity': body}
+        if len(body) >= MINIMUM_COMPRESS_SIZE:
+            self.variants['gzip'] = gzipped or gzip.compress(body, compresslevel=6)
+            if brotli is not None:
+                self.variants['br'] = brotli.compress(body, quality=5)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(body) for body in self.variants.values())
+
+    def choose(self, accept_encoding: str) -> Tuple[str, bytes]:
+        """按 Accept-Encoding 选择压缩方式，优先 br，其次 gzip"""
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in self.variants:
+                return encoding, self.variants[encoding]
+        return 'identity', self.variants['identity']
+
+
+class HTTPCacheMiddleware:
+    """
+    version_of(city) 返回 (版本标识, 最后修改时间戳)，版本未知时返回 (None, None)
+    """
+
+    def __init__(self, app: ASGIApp, version_of: Callable[[str], Tuple[Optional[str], Optional[float]]],
+                 cache: LRUCache = None, max_age: int = 300, prefix: str = '/city/'):
+        self.app = app
+        self.version_of = version_of
+        self.cache = cache or LRUCache(max_bytes=256 * 1024 * 1024, ttl_seconds=24 * 3600)
+        self.cache_control = f'public, max-age={max_age}'
+        self.prefix = prefix
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http' or scope['method'] not in ('GET', 'HEAD') or not scope['path'].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+
+        city_name = unquote(scope['path'][len(self.prefix):].split('/', 1)[0])
+        version, last_modified = self.version_of(city_name)
+        if version is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        query = '&'.join(sorted(scope.get('query_string', b'').decode('latin-1').split('&')))
+        key = (city_name, version, scope['path'], query, headers.get('accept', ''))
+        etag = 'W/"' + hashlib.blake2b(repr(key).encode('utf-8'), digest_size=12).hexdigest() + '"'
+
+        response_headers = [
+            (b'etag', etag.encode('latin-1')),
+            (b'cache-control', self.cache_control.encode('latin-1')),
+            (b'vary', b'Accept, Accept-Encoding')
+        ]
+        if last_modified is not None:
+            response_headers.append((b'last-modified', formatdate(last_modified, usegmt=True).encode('latin-1')))
+
+        if self._not_modified(headers, etag, last_modified):
+            await send({'type': 'http.response.start', 'status': 304, 'headers': response_headers})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        cached = self.cache.get(key)
+        if cached is None:
+            cached, sent = await self._capture(scope, receive, send, response_headers)
+            if cached is not None:
+                self.cache.set(key, cached)
+            if sent:
+                return
+
+        encoding, body = cached.choose(headers.get('accept-encoding', ''))
+        out = MutableHeaders(raw=list(cached.headers))
+        out['content-length'] = str(len(body))
+        if encoding != 'identity':
+            out['content-encoding'] = encoding
+        await send({'type': 'http.response.start', 'status': cached.status, 'headers': out.raw + response_headers})
+        await send({'type': 'http.response.body', 'body': b'' if scope['method'] == 'HEAD' else body})
+
+    @staticmethod
+    def _not_modified(headers: Headers, etag: str, last_modified: Optional[float]) -> bool:
+        if_none_match = headers.get('if-none-match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            # 弱比较：忽略 W/ 前缀
+            return '*' in tags or any(tag.removeprefix('W/') == etag.removeprefix('W/') for tag in tags)
+
+        if_modified_since = headers.get('if-modified-since')
+        if if_modified_since and last_modified is not None:
+            try:
+                return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    async def _capture(self, scope: Scope, receive: Receive, send: Send,
+                       response_headers: list) -> Tuple[Optional[CachedBody], bool]:
+        """
+        执行接口并收集响应，返回 (可缓存的响应, 是否已经发送)。
+        只有完整的 200 非流式响应会被缓存；有 Content-Length 的由调用方发送，
+        分块发送的边转发边收集；其他响应直接转发
+        """
+        start: Optional[Message] = None
+        chunks = []
+        gzipped = []
+        passthrough = False
+        tee = False
+        compressor = None
+
+        async def capture_send(message: Message):
+            nonlocal start, passthrough, tee, compressor
+            if message['type'] == 'http.response.start':
+                headers = Headers(raw=message['headers'])
+                if message['status'] != 200 or headers.get('content-type', '').startswith(STREAMING_TYPES):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message
+                    if 'content-length' not in headers:
+                        tee = True
+                        out = [
+                            (name, value) for name, value in message['headers']
+                            if name.lower() not in (b'etag', b'cache-control', b'vary')
+                        ]
+                        # 压缩结果同时作为缓存的 gzip 版本，外层 GZipMiddleware 不再重复压缩
+                        if 'gzip' in accepted_encodings(Headers(scope=scope).get('accept-encoding', '')):
+                            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+                            out.append((b'content-encoding', b'gzip'))
+                        await send({**message, 'headers': out + response_headers})
+            elif passthrough:
+                await send(message)
+            else:
+                body = message.get('body', b'')
+                chunks.append(body)
+                if tee and compressor is not None:
+                    body = compressor.compress(body)
+                    if not message.get('more_body', False):
+                        body += compressor.flush()
+                    gzipped.append(body)
+                    await send({**message, 'body': body})
+                elif tee:
+                    await send(message)
+
+        await self.app(scope, receive, capture_send)
+        if passthrough or start is None:
+            return None, True
+
+        # content-length 和 content-encoding 在发送时按选中的版本重新设置
+        headers = [
+            (name, value) for name, value in start['headers']
+            if name.lower() not in (b'content-length', b'content-encoding', b'etag', b'cache-control', b'vary')
+        ]
+        return CachedBody(start['status'], headers, b''.join(chunks), b''.join(gzipped) or None), tee
@@ -3,8 +3,8 @@ import os
 from logging.handlers import RotatingFileHandler
 from datetime import datetime
 
-# 创建日志目录
-LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logs')
+# 创建日志目录，LOG_DIR 环境变量可以指定其他位置（测试中指向临时目录）
+LOG_DIR = os.getenv('LOG_DIR') or os.path.join(os.path.dirname(os.path.dirname(__file__)), 'logs')
 if not os.path.exists(LOG_DIR):
     os.makedirs(LOG_DIR)
 
@@ -0,0 +1,144 @@
+"""
+城市元数据
+
+city_metadata 在导入时按城市生成（边界、中心点、首末评论时间、房源数和房东数、数据版本），
+后端启动时整表读入内存，/cities、/city/{city} 和预热的城市列表直接使用，
+不再在每次请求时对整个城市做聚合。数据版本变化时重新读取该城市的一行。
+表不存在或没有某个城市时，调用方回退到原来的查询。
+"""
+from typing import Dict, List, Optional
+
+from utils.logger import logger
+from utils.timeline import REVIEW_MONTH_SQL
+
+CREATE_CITY_METADATA_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS city_metadata (
+        city TEXT PRIMARY KEY,
+        min_lat DOUBLE PRECISION,
+        max_lat DOUBLE PRECISION,
+        min_lng DOUBLE PRECISION,
+        max_lng DOUBLE PRECISION,
+        center_lat DOUBLE PRECISION,
+        center_lng DOUBLE PRECISION,
+        earliest_review DATE,
+        latest_review DATE,
+        first_review_month INTEGER,
+        last_review_month INTEGER,
+        total_listings BIGINT NOT NULL DEFAULT 0,
+        listing_count BIGINT NOT NULL DEFAULT 0,
+        host_count BIGINT NOT NULL DEFAULT 0,
+        data_version BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP NOT NULL DEFAULT now()
+    )
+"""
+
+# 中心点、评论时间和 total_listings 只统计有评论且有坐标的房源，与 /city/{city} 一致
+REFRESH_CITY_METADATA_SQL = f"""
+    INSERT INTO city_metadata (
+        city, min_lat, max_lat, min_lng, max_lng, center_lat, center_lng,
+        earliest_review, latest_review, first_review_month, last_review_month,
+        total_listings, listing_count, host_count, data_version, updated_at
+    )
+    SELECT
+        %(city)s,
+        ST_YMin(ST_Extent(geom)),
+        ST_YMax(ST_Extent(geom)),
+        ST_XMin(ST_Extent(geom)),
+        ST_XMax(ST_Extent(geom)),
+        AVG(ST_Y(geom)) FILTER (WHERE first_review IS NOT NULL),
+        AVG(ST_X(geom)) FILTER (WHERE first_review IS NOT NULL),
+        MIN(first_review) FILTER (WHERE geom IS NOT NULL),
+        MAX(first_review) FILTER (WHERE geom IS NOT NULL),
+        MIN({REVIEW_MONTH_SQL}),
+        MAX({REVIEW_MONTH_SQL}),
+        COUNT(*) FILTER (WHERE first_review IS NOT NULL AND geom IS NOT NULL),
+        COUNT(*),
+        COUNT(DISTINCT host_id),
+        %(version)s,
+        now()
+    FROM listings
+    WHERE city = %(city)s
+    ON CONFLICT (city) DO UPDATE SET
+        min_lat = EXCLUDED.min_lat,
+        max_lat = EXCLUDED.max_lat,
+        min_lng = EXCLUDED.min_lng,
+        max_lng = EXCLUDED.max_lng,
+        center_lat = EXCLUDED.center_lat,
+        center_lng = EXCLUDED.center_lng,
+        earliest_review = EXCLUDED.earliest_review,
+        latest_review = EXCLUDED.latest_review,
+        first_review_month = EXCLUDED.first_review_month,
+        last_review_month = EXCLUDED.last_review_month,
+        total_listings = EXCLUDED.total_listings,
+        listing_count = EXCLUDED.listing_count,
+        host_count = EXCLUDED.host_count,
+        data_version = EXCLUDED.data_version,
+        updated_at = now()
+"""
+
+
+def refresh_city_metadata(cur, city_name: str, version: int = 0):
+    """导入时重新生成城市元数据（psycopg2）"""
+    cur.execute(CREATE_CITY_METADATA_TABLE_SQL)
+    cur.execute(REFRESH_CITY_METADATA_SQL, {'city': city_name, 'version': version or 0})
+
+
+class CityMetadataStore:
+    """内存中的 city_metadata"""
+
+    def __init__(self, db):
+        self._db = db
+        self.rows: Dict[str, dict] = {}
+
+    async def _table_exists(self) -> bool:
+        return await self._db.fetchval("SELECT to_regclass('city_metadata') IS NOT NULL")
+
+    async def load(self):
+        """启动时读取整表，表不存在时为空"""
+        if not await self._table_exists():
+            logger.info("city_metadata not found, falling back to aggregate queries")
+            self.rows = {}
+            return
+        rows = await self._db.fetch("SELECT * FROM city_metadata ORDER BY city")
+        self.rows = {row['city']: dict(row) for row in rows}
+        logger.info(f"Loaded metadata for {len(self.rows)} cities")
+
+    async def refresh(self, city_name: str):
+        """重新读取单个城市（数据版本变化后调用）"""
+        if not await self._table_exists():
+            return
+        row = await self._db.fetchrow("SELECT * FROM city_metadata WHERE city = $1", city_name)
+        if row is None:
+            self.rows.pop(city_name, None)
+        else:
+            self.rows[city_name] = dict(row)
+
+    def get(self, city_name: str) -> Optional[dict]:
+        return self.rows.get(city_name)
+
+    def cities(self, reviewed_only: bool = False) -> List[str]:
+        """所有城市；reviewed_only 时只包含有评论且有坐标房源的城市"""
+        return sorted(
+            city for city, row in self.rows.items()
+            if not reviewed_only or row['total_listings'] > 0
+        )
+
+    def overview(self, city_name: str) -> Optional[dict]:
+        """/city/{city} 的结果，没有元数据或没有有效房源时返回 None"""
+        row = self.rows.get(city_name)
+        if row is None or row['total_listings'] == 0:
+            return None
+        return {
+            "center": {
+                "latitude": float(row['center_lat']),
+                "longitude": float(row['center_lng'])
+            },
+            "time_window": {
+                "earliest": row['earliest_review'].strftime('%Y-%m-%d') if row['earliest_review'] else None,
+                "latest": row['latest_review'].strftime('%Y-%m-%d') if row['latest_review'] else None
+            },
+            "total_listings": row['total_listings']
+        }
+
+    def stats(self) -> dict:
+        return {'cities': len(self.rows)}
@@ -0,0 +1,173 @@
+"""
+Mapbox Vector Tile 编码
+
+只实现接口需要的部分：点、多边形要素以及字符串 / 数值属性，按
+vector-tile-spec 2.1 直接写出 protobuf，不依赖额外的库。
+坐标先由 lng/lat 投影为 Web Mercator 的 [0, 1) 世界坐标（y 向下），
+再换算为瓦片内坐标（0 ~ extent）。
+"""
+import math
+import struct
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+EXTENT = 4096
+# 瓦片边缘外保留的范围（瓦片坐标），避免边缘要素被截断
+BUFFER = 64
+
+POINT = 1
+POLYGON = 3
+
+_MOVE_TO = 1
+_LINE_TO = 2
+_CLOSE_PATH = 7
+
+
+def lnglat_to_world(lng, lat):
+    """lng/lat 转换为 Web Mercator 世界坐标，范围 [0, 1)，y 向下"""
+    lng = np.asarray(lng, dtype=np.float64)
+    lat = np.clip(np.asarray(lat, dtype=np.float64), -85.05112878, 85.05112878)
+    x = (lng + 180.0) / 360.0
+    sin_lat = np.sin(np.radians(lat))
+    y = 0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return x, y
+
+
+def tile_bounds(z: int, x: int, y: int, buffer: int = BUFFER, extent: int = EXTENT):
+    """瓦片（含 buffer）在世界坐标中的范围 (min_x, min_y, max_x, max_y)"""
+    size = 1.0 / (1 << z)
+    pad = size * buffer / extent
+    return x * size - pad, y * size - pad, (x + 1) * size + pad, (y + 1) * size + pad
+
+
+def to_tile_coords(wx, wy, z: int, x: int, y: int, extent: int = EXTENT):
+    """世界坐标转换为瓦片内整数坐标"""
+    scale = (1 << z) * extent
+    return (
+        np.round(np.asarray(wx) * scale - x * extent).astype(np.int64),
+        np.round(np.asarray(wy) * scale - y * extent).astype(np.int64)
+    )
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field: int, wire_type: int) -> bytes:
+    return _varint((field << 3) | wire_type)
+
+
+def _bytes_field(field: int, data: bytes) -> bytes:
+    return _key(field, 2) + _varint(len(data)) + data
+
+
+def _packed(field: int, values: Sequence[int]) -> bytes:
+    return _bytes_field(field, b''.join(_varint(v) for v in values))
+
+
+def _encode_value(value) -> bytes:
+    if isinstance(value, bool):
+        return _key(7, 0) + _varint(int(value))
+    if isinstance(value, int):
+        return _key(6, 0) + _varint(_zigzag(value)) if value < 0 else _key(5, 0) + _varint(value)
+    if isinstance(value, float):
+        return _key(3, 1) + struct.pack('<d', value)
+    return _bytes_field(1, str(value).encode('utf-8'))
+
+
+def _command(command: int, count: int) -> int:
+    return (command & 0x7) | (count << 3)
+
+
+def point_geometry(px: int, py: int) -> List[int]:
+    return [_command(_MOVE_TO, 1), _zigzag(px), _zigzag(py)]
+
+
+def polygon_geometry(xs: Sequence[int], ys: Sequence[int]) -> List[int]:
+    """单个外环，按规范调整为顺时针（瓦片坐标下面积为正），点数不足时返回空列表"""
+    ring = []
+    for point in zip(xs, ys):
+        if not ring or ring[-1] != point:
+            ring.append(point)
+    if len(ring) > 1 and ring[0] == ring[-1]:
+        ring.pop()
+    if len(ring) < 3:
+        return []
+
+    area = sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]))
+    if area == 0:
+        return []
+    if area < 0:
+        ring.reverse()
+
+    geometry = [_command(_MOVE_TO, 1), _zigzag(ring[0][0]), _zigzag(ring[0][1])]
+    geometry.append(_command(_LINE_TO, len(ring) - 1))
+    cx, cy = ring[0]
+    for x, y in ring[1:]:
+        geometry.extend((_zigzag(x - cx), _zigzag(y - cy)))
+        cx, cy = x, y
+    geometry.append(_command(_CLOSE_PATH, 1))
+    return geometry
+
+
+class LayerBuilder:
+    """逐个添加要素，最后编码为一个 MVT 图层"""
+
+    def __init__(self, name: str, extent: int = EXTENT):
+        self.name = name
+        self.extent = extent
+        self._features: List[bytes] = []
+        self._keys: Dict[str, int] = {}
+        self._values: Dict[tuple, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._features)
+
+    def _tags(self, properties: dict) -> List[int]:
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(self._keys.setdefault(key, len(self._keys)))
+            tags.append(self._values.setdefault((type(value), value), len(self._values)))
+        return tags
+
+    def add(self, geom_type: int, geometry: List[int], properties: dict = None, feature_id: int = None):
+        if not geometry:
+            return
+        data = b''
+        if feature_id is not None:
+            data += _key(1, 0) + _varint(feature_id)
+        tags = self._tags(properties or {})
+        if tags:
+            data += _packed(2, tags)
+        data += _key(3, 0) + _varint(geom_type)
+        data += _packed(4, geometry)
+        self._features.append(_bytes_field(2, data))
+
+    def encode(self) -> bytes:
+        data = _key(15, 0) + _varint(2)
+        data += _bytes_field(1, self.name.encode('utf-8'))
+        data += b''.join(self._features)
+        data += b''.join(_bytes_field(3, key.encode('utf-8')) for key in self._keys)
+        data += b''.join(_bytes_field(4, _encode_value(value)) for _, value in self._values)
+        data += _key(5, 0) + _varint(self.extent)
+        return data
+
+
+def encode_tile(layers: Sequence[LayerBuilder]) -> bytes:
+    """编码瓦片，跳过没有要素的图层"""
+    return b''.join(_bytes_field(3, layer.encode()) for layer in layers if len(layer))
@@ -0,0 +1,138 @@
+"""
+hexgrid 时间回放
+
+/city/{city}/hexgrid/timeline 按月依次输出所选等级的六边形计数，每个月的结果与
+以同样参数请求 /hexgrid 一致：第一个月输出全部非零单元，之后每个月只输出计数
+有变化的单元（新出现的单元附带边界）。
+
+hexgrid 统计的是截至该月已分级房东的全部房源，逐月变化的只是房东的等级，
+因此每个月只对进入 / 离开所选等级的房东的房源做 bincount 增减，
+不再重新统计整个城市。早于第一条评论的月份没有已分级的房东，输出空网格
+（/hexgrid 此时返回整个城市）。
+
+两种输出格式：
+    ndjson  application/x-ndjson，每行一个 JSON 对象
+    sse     text/event-stream，event 为消息类型（full / delta / end）
+"""
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+from utils.classifier import TIER_CODES, classify_hosts
+from utils.hexbin import hex_boundaries
+from utils.responses import dumps
+from utils.timeline import month_label
+
+STREAM_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream'
+}
+# 单次回放最多的月份数
+MAX_TIMELINE_MONTHS = 600
+
+
+def negotiate_stream_format(requested: Optional[str] = None, accept: Optional[str] = None) -> str:
+    """按 format 参数或 Accept 头选择输出格式，默认 ndjson"""
+    if requested:
+        requested = requested.lower()
+        if requested not in STREAM_FORMATS:
+            raise ValueError(f"Unsupported format: {requested}. Use one of {', '.join(STREAM_FORMATS)}")
+        return requested
+    if accept and 'text/event-stream' in accept:
+        return 'sse'
+    return 'ndjson'
+
+
+def encode_message(fmt: str, message: dict) -> bytes:
+    """与其他接口相同，用 utils.responses.dumps 编码"""
+    data = dumps(message)
+    if fmt == 'sse':
+        return f"event: {message['type']}\ndata: ".encode('utf-8') + data + b'\n\n'
+    return data + b'\n'
+
+
+class HostListingIndex:
+    """按房东分组的房源下标（只含落在单元内的房源），用于取出一批房东的全部房源"""
+
+    def __init__(self, snapshot, code: np.ndarray):
+        order = np.argsort(snapshot.host_code, kind='stable')
+        self.order = order[code[order] >= 0]
+        self.offsets = np.searchsorted(snapshot.host_code[self.order], np.arange(len(snapshot.hosts) + 1))
+
+    def listings_of(self, hosts: np.ndarray) -> np.ndarray:
+        """hosts 为 snapshot.hosts 中的下标"""
+        starts = self.offsets[hosts]
+        lengths = self.offsets[hosts + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.int64)
+        # 每段的起点减去该段在结果中的起始位置，再加上连续编号
+        shift = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return self.order[shift + np.arange(total)]
+
+
+def iter_hex_counts(snapshot, months: Iterable[int], categories: Iterable[str], resolution: int) -> Iterator[tuple]:
+    """
+    逐月产生 (month, changed, counts)：counts 为各单元当月的房源数，
+    changed 为与上个月相比计数有变化的单元下标（第一个月与全零比较）
+    """
+    code = snapshot.hex_index().code[resolution]
+    n_cells = len(snapshot.hex_index().cell_ids[resolution])
+    codes = np.array([TIER_CODES[c] for c in categories if c in TIER_CODES], dtype=np.uint8)
+    by_host = HostListingIndex(snapshot, code)
+
+    counts = np.zeros(n_cells, dtype=np.int64)
+    member = np.zeros(len(snapshot.hosts), dtype=bool)
+    for month in months:
+        # 分级只用于回放，不写入 HostTierClassifier 的缓存
+        tiers = classify_hosts(*snapshot.timeline.host_listing_counts(month))
+        now = np.isin(tiers.tier_of(snapshot.hosts), codes)
+
+        entered = code[by_host.listings_of(np.flatnonzero(now & ~member))]
+        left = code[by_host.listings_of(np.flatnonzero(member & ~now))]
+        delta = np.bincount(entered, minlength=n_cells) - np.bincount(left, minlength=n_cells)
+        counts += delta
+        member = now
+        yield month, np.flatnonzero(delta), counts
+
+
+def hex_timeline_messages(snapshot, months: range, categories: Iterable[str], resolution: int) -> Iterator[dict]:
+    """回放消息：第一个月 full，之后每月 delta，最后 end"""
+    cell_ids = snapshot.hex_index().cell_ids[resolution]
+    previous = None
+    frames = 0
+    for month, changed, counts in iter_hex_counts(snapshot, months, categories, resolution):
+        present = np.flatnonzero(counts)
+        totals = {
+            'total_hexagons': len(present),
+            'total_points': int(counts[present].sum())
+        }
+        if previous is None:
+            message = {
+                'type': 'full',
+                'time_point': month_label(month),
+                'bounds': snapshot.bounds,
+                'resolution': resolution,
+                'hexagons': hex_boundaries.hexagons(cell_ids[present], counts[present]),
+                **totals
+            }
+        else:
+            added = changed[(previous[changed] == 0) & (counts[changed] > 0)]
+            removed = changed[counts[changed] == 0]
+            updated = changed[(previous[changed] > 0) & (counts[changed] > 0)]
+            message = {
+                'type': 'delta',
+                'time_point': month_label(month),
+                'added': hex_boundaries.hexagons(cell_ids[added], counts[added]),
+                'updated': [
+                    {'id': hex_boundaries.get(cell)['id'], 'points_count': count}
+                    for cell, count in zip(cell_ids[updated].tolist(), counts[updated].tolist())
+                ],
+                'removed': [hex_boundaries.get(cell)['id'] for cell in cell_ids[removed].tolist()],
+                **totals
+            }
+        previous = counts.copy()
+        frames += 1
+        yield message
+
+    yield {'type': 'end', 'frames': frames}
@@ -0,0 +1,227 @@
+"""
+房价分布
+
+/city/{city}/price_stats 按 H3 单元和房东等级返回 processed_price 的中位数、分位数和直方图。
+
+价格记入固定的对数分桶（DDSketch 的做法）：第 i 个桶为 (γ^(i-1), γ^i]，γ = PRICE_GAMMA，
+桶内以 2γ^i / (γ+1) 作为代表值，分位数的相对误差不超过 (γ-1)/(γ+1)（约 1%）。
+直方图使用 HISTOGRAM_EDGES 的整数区间，单独精确计数。所有城市、月份的分桶都相同，
+草图相加即合并，查询时不再排序原始价格。
+
+PriceSketches 每个 (city, month) 一份：截至该月有评论、有坐标、有价格且房东已分级的房源，
+在各分辨率上按 (单元, 等级, 价格桶) 稀疏保存房源数和价格和（非零项不超过房源数）。
+任意等级组合、任意单元或整个城市的分布都由对应的草图相加得到。
+房东等级随月份变化，一个月份的草图不能由其他月份推出，因此和 HexPyramid 一样按月缓存。
+"""
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+from utils.cache import LRUCache
+from utils.classifier import NO_TIER, TIER_CODES, TIER_NAMES, clamp_month
+from utils.pyramid import MIN_RESOLUTION, FINEST_RESOLUTION
+from utils.timing import stage
+
+PRICE_GAMMA = 1.02
+LOG_GAMMA = np.log(PRICE_GAMMA)
+# 超出范围的价格记入两端的桶
+MIN_PRICE = 1
+MAX_PRICE = 1_000_000
+N_BINS = int(np.ceil(np.log(MAX_PRICE) / LOG_GAMMA)) + 1
+
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+QUANTILE_KEYS = tuple(f'p{round(q * 100)}' for q in QUANTILES)
+# 直方图区间 [edges[k], edges[k+1])，最后一个区间没有上限
+HISTOGRAM_EDGES = (0, 50, 100, 150, 200, 300, 500, 1000)
+N_BUCKETS = len(HISTOGRAM_EDGES)
+
+
+def price_bins(prices: np.ndarray) -> np.ndarray:
+    """价格所在的对数桶"""
+    clipped = np.clip(prices, MIN_PRICE, MAX_PRICE)
+    return np.ceil(np.log(clipped) / LOG_GAMMA - 1e-9).astype(np.int64)
+
+
+def bin_values(bins: np.ndarray) -> np.ndarray:
+    """对数桶的代表值"""
+    return 2 * PRICE_GAMMA ** bins / (PRICE_GAMMA + 1)
+
+
+def grouped_quantiles(group: np.ndarray, bins: np.ndarray, counts: np.ndarray, n_groups: int) -> np.ndarray:
+    """
+    把稀疏草图按 group 合并后求各组分位数，返回 n_groups × len(QUANTILES)，空组为 NaN；
+    与 DDSketch 相同，q 分位数取第 floor(q * (n-1)) 个值所在桶的代表值
+    """
+    keys, inverse = np.unique(group.astype(np.int64) * N_BINS + bins, return_inverse=True)
+    merged = np.bincount(inverse, weights=counts, minlength=len(keys))
+    bins = keys % N_BINS
+    totals = np.bincount(keys // N_BINS, weights=merged, minlength=n_groups)
+    cumulative = np.cumsum(merged)
+    before = np.cumsum(totals) - totals
+
+    result = np.full((n_groups, len(QUANTILES)), np.nan)
+    present = np.flatnonzero(totals > 0)
+    for j, q in enumerate(QUANTILES):
+        rank = before[present] + np.floor(q * (totals[present] - 1)) + 1
+        positions = np.searchsorted(cumulative, rank)
+        result[present, j] = bin_values(bins[positions])
+    return result
+
+
+def summaries(counts: np.ndarray, totals: np.ndarray, quantiles: np.ndarray, histograms: np.ndarray) -> List[dict]:
+    """各组房源的价格分布，空组的均值和分位数为 None"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.round(totals / counts, 2)
+    quantiles = np.round(quantiles, 2).astype(object)
+    quantiles[np.isnan(quantiles.astype(np.float64))] = None
+    means = means.astype(object)
+    means[counts == 0] = None
+    median = QUANTILES.index(0.5)
+    return [
+        {
+            'count': count,
+            'mean': mean,
+            'median': values[median],
+            'quantiles': dict(zip(QUANTILE_KEYS, values)),
+            'histogram': histogram
+        }
+        for count, mean, values, histogram in zip(
+            counts.astype(np.int64).tolist(), means.tolist(), quantiles.tolist(), histograms.tolist()
+        )
+    ]
+
+
+class PriceLevel:
+    """单个分辨率上 (单元, 等级, 价格桶) 和 (单元, 等级, 直方图区间) 的稀疏计数"""
+
+    def __init__(self, code: np.ndarray, tier: np.ndarray, bins: np.ndarray, buckets: np.ndarray, prices: np.ndarray):
+        n_tiers = len(TIER_NAMES)
+        keys, inverse = np.unique((code * n_tiers + tier) * N_BINS + bins, return_inverse=True)
+        self.cell = keys // (n_tiers * N_BINS)
+        self.tier = (keys // N_BINS % n_tiers).astype(np.uint8)
+        self.bin = keys % N_BINS
+        self.count = np.bincount(inverse, minlength=len(keys))
+        self.sum = np.bincount(inverse, weights=prices, minlength=len(keys))
+
+        keys, counts = np.unique((code * n_tiers + tier) * N_BUCKETS + buckets, return_counts=True)
+        self.hist_cell = keys // (n_tiers * N_BUCKETS)
+        self.hist_tier = (keys // N_BUCKETS % n_tiers).astype(np.uint8)
+        self.hist_bucket = keys % N_BUCKETS
+        self.hist_count = counts
+
+    @property
+    def nbytes(self) -> int:
+        return sum(values.nbytes for values in vars(self).values())
+
+
+class PriceSketches:
+    """某个 (city, month) 各分辨率的价格草图"""
+
+    def __init__(self, levels: Dict[int, PriceLevel], cell_ids: Dict[int, np.ndarray], source=None):
+        self.levels = levels
+        self.cell_ids = cell_ids
+        # 生成该结果的分级，快照刷新后据此判断缓存是否过期
+        self.source = source
+
+    @property
+    def nbytes(self) -> int:
+        return sum(level.nbytes for level in self.levels.values())
+
+    def stats(self, categories: Iterable[str], resolution: int) -> dict:
+        """所选等级合并后的整体分布、各等级分布和各单元分布"""
+        level = self.levels[resolution]
+        codes = [TIER_CODES[c] for c in categories if c in TIER_CODES]
+        n_tiers = len(TIER_NAMES)
+
+        # 按等级合并各单元的草图
+        tier_quantiles = grouped_quantiles(level.tier, level.bin, level.count, n_tiers)
+        tier_counts = np.bincount(level.tier, weights=level.count, minlength=n_tiers)
+        tier_sums = np.bincount(level.tier, weights=level.sum, minlength=n_tiers)
+        tier_histograms = np.zeros((n_tiers, N_BUCKETS), dtype=np.int64)
+        np.add.at(tier_histograms, (level.hist_tier, level.hist_bucket), level.hist_count)
+
+        # 所选等级合并为整体，以及按单元合并
+        selected = np.isin(level.tier, codes)
+        cells, bins, counts = level.cell[selected], level.bin[selected], level.count[selected]
+        overall_quantiles = grouped_quantiles(np.zeros(len(bins), dtype=np.int64), bins, counts, 1)[0]
+        n_cells = len(self.cell_ids[resolution])
+        cell_quantiles = grouped_quantiles(cells, bins, counts, n_cells)
+        cell_counts = np.bincount(cells, weights=counts, minlength=n_cells)
+        cell_sums = np.bincount(cells, weights=level.sum[selected], minlength=n_cells)
+        hist_selected = np.isin(level.hist_tier, codes)
+        cell_histograms = np.zeros((n_cells, N_BUCKETS), dtype=np.int64)
+        np.add.at(
+            cell_histograms,
+            (level.hist_cell[hist_selected], level.hist_bucket[hist_selected]),
+            level.hist_count[hist_selected]
+        )
+
+        overall = summaries(
+            tier_counts[codes].sum(keepdims=True),
+            tier_sums[codes].sum(keepdims=True),
+            overall_quantiles[np.newaxis],
+            tier_histograms[codes].sum(axis=0, keepdims=True)
+        )[0]
+        tiers = summaries(tier_counts[codes], tier_sums[codes], tier_quantiles[codes], tier_histograms[codes])
+        present = cell_counts > 0
+        # H3 单元的字符串编号就是整数编号的十六进制
+        cells = [
+            {'id': format(cell_id, 'x'), **cell}
+            for cell_id, cell in zip(
+                self.cell_ids[resolution][present].tolist(),
+                summaries(cell_counts[present], cell_sums[present], cell_quantiles[present], cell_histograms[present])
+            )
+        ]
+
+        return {
+            'histogram_edges': list(HISTOGRAM_EDGES),
+            'quantiles': list(QUANTILES),
+            'overall': overall,
+            'tiers': {TIER_NAMES[code]: tier for code, tier in zip(codes, tiers)},
+            'cells': cells
+        }
+
+
+def build_price_sketches(snapshot, tiers, month: int) -> PriceSketches:
+    """截至 month 的房源按等级和单元生成各分辨率的价格草图"""
+    hex_index = snapshot.hex_index()
+    listing_tier = tiers.tier_of(snapshot.hosts)[snapshot.host_code]
+    prices = snapshot.processed_price
+    with np.errstate(invalid='ignore'):
+        valid = snapshot.has_coords & (snapshot.month <= month) & (listing_tier != NO_TIER) & (prices > 0)
+
+    prices = prices[valid]
+    tier = listing_tier[valid].astype(np.int64)
+    bins = price_bins(prices)
+    buckets = np.searchsorted(HISTOGRAM_EDGES, prices, side='right') - 1
+    levels = {
+        resolution: PriceLevel(hex_index.code[resolution][valid].astype(np.int64), tier, bins, buckets, prices)
+        for resolution in range(MIN_RESOLUTION, FINEST_RESOLUTION + 1)
+    }
+    return PriceSketches(levels, hex_index.cell_ids, tiers)
+
+
+class PriceStatsService:
+    """按 (city, month) 缓存 PriceSketches"""
+
+    def __init__(self, classifier, cache: LRUCache = None):
+        self._classifier = classifier
+        self.cache = cache or LRUCache()
+
+    def get(self, snapshot, month: int) -> PriceSketches:
+        tiers = self._classifier.classify(snapshot, month)
+        key = (snapshot.city, clamp_month(snapshot.timeline, month))
+        sketches = self.cache.get(key)
+        if sketches is not None and sketches.source is tiers:
+            return sketches
+
+        with stage('prices'):
+            sketches = build_price_sketches(snapshot, tiers, month)
+        self.cache.set(key, sketches)
+        return sketches
+
+    def invalidate(self, city_name: str = None):
+        if city_name is None:
+            self.cache.invalidate()
+        else:
+            self.cache.invalidate(lambda key: key[0] == city_name)
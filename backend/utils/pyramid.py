@@ -0,0 +1,165 @@
+"""
+多分辨率 H3 计数金字塔
+
+每条房源在 MIN_RESOLUTION ~ FINEST_RESOLUTION 各分辨率下所在的单元只计算一次，
+之后任何分辨率的网格都只是对单元编号做 bincount，不再对原始坐标重新分箱。
+
+H3 的子单元并不严格铺满父单元，用 h3_to_parent 逐级汇总会让边缘附近的点落到
+相邻六边形里，与直接分箱的结果不一致，因此每个分辨率都按坐标单独分箱。
+
+    CityHexIndex   每个城市快照一份：各分辨率的单元编号
+    HexPyramid     每个 (city, month) 一份：各分辨率上 单元 × 房东等级 的房源数矩阵
+"""
+from typing import Dict, Iterable
+
+import numpy as np
+
+from utils.cache import LRUCache
+from utils.classifier import TIER_NAMES, TIER_CODES, NO_TIER, clamp_month
+from utils.hexbin import DEFAULT_RESOLUTION, hex_boundaries
+from utils.mvt import lnglat_to_world
+from utils.timing import stage
+
+MIN_RESOLUTION = 5
+FINEST_RESOLUTION = 10
+
+
+def resolution_for_zoom(zoom: float) -> int:
+    """地图缩放级别对应的 H3 分辨率"""
+    return int(min(max(round(zoom * 0.75 - 1), MIN_RESOLUTION), FINEST_RESOLUTION))
+
+
+def resolve_resolution(resolution: int = None, zoom: float = None) -> int:
+    """resolution 优先，其次按 zoom 推算，都没有时使用默认分辨率"""
+    if resolution is not None:
+        if not MIN_RESOLUTION <= resolution <= FINEST_RESOLUTION:
+            raise ValueError(f"resolution must be between {MIN_RESOLUTION} and {FINEST_RESOLUTION}")
+        return resolution
+    if zoom is not None:
+        return resolution_for_zoom(zoom)
+    return DEFAULT_RESOLUTION
+
+
+class CityHexIndex:
+    """城市房源在各分辨率下的单元编号"""
+
+    def __init__(self, cells_by_resolution: Dict[int, np.ndarray]):
+        self.cell_ids: Dict[int, np.ndarray] = {}
+        # code[res]：每条房源在该分辨率单元列表中的下标，无坐标为 -1
+        self.code: Dict[int, np.ndarray] = {}
+
+        for resolution, cells in cells_by_resolution.items():
+            valid = cells != 0
+            cell_ids, code = np.unique(cells[valid], return_inverse=True)
+            self.cell_ids[resolution] = cell_ids
+            self.code[resolution] = np.full(len(cells), -1, dtype=np.int32)
+            self.code[resolution][valid] = code.reshape(-1)
+
+        # 各分辨率单元边界的世界坐标，矢量瓦片使用，首次访问时计算
+        self._outlines: Dict[int, tuple] = {}
+
+    @classmethod
+    def from_snapshot(cls, snapshot) -> "CityHexIndex":
+        return cls(snapshot.cells_at(range(MIN_RESOLUTION, FINEST_RESOLUTION + 1)))
+
+    def counts(self, idx: np.ndarray, resolution: int) -> np.ndarray:
+        """选中房源在指定分辨率各单元中的计数"""
+        with stage('binning'):
+            code = self.code[resolution][idx]
+            return np.bincount(code[code >= 0], minlength=len(self.cell_ids[resolution]))
+
+    def outlines(self, resolution: int):
+        """
+        单元边界的 Web Mercator 世界坐标：
+        返回 (bbox, vertices)，bbox 为 cells × 4 的 (min_x, min_y, max_x, max_y)，
+        vertices[i] 为第 i 个单元边界顶点的 (xs, ys)
+        """
+        outlines = self._outlines.get(resolution)
+        if outlines is None:
+            vertices = []
+            bbox = np.empty((len(self.cell_ids[resolution]), 4))
+            for i, cell in enumerate(self.cell_ids[resolution].tolist()):
+                boundary = np.array(hex_boundaries.get(cell)['boundary'])
+                xs, ys = lnglat_to_world(boundary[:, 1], boundary[:, 0])
+                vertices.append((xs, ys))
+                bbox[i] = xs.min(), ys.min(), xs.max(), ys.max()
+            outlines = self._outlines[resolution] = (bbox, vertices)
+        return outlines
+
+    def nonzero(self, counts: np.ndarray, resolution: int):
+        """返回计数大于 0 的单元及其计数"""
+        present = np.flatnonzero(counts)
+        return self.cell_ids[resolution][present], counts[present]
+
+
+class HexPyramid:
+    """某个 (city, month) 在各分辨率上的 单元 × 房东等级 房源数"""
+
+    def __init__(self, hex_index: CityHexIndex, levels: Dict[int, np.ndarray], source=None):
+        self.hex_index = hex_index
+        self.levels = levels
+        # 生成该结果的分级，快照刷新后据此判断缓存是否过期
+        self.source = source
+
+    @property
+    def nbytes(self) -> int:
+        return sum(level.nbytes for level in self.levels.values())
+
+    def level(self, resolution: int) -> np.ndarray:
+        return self.levels[resolution]
+
+    def counts(self, categories: Iterable[str], resolution: int):
+        """所选等级在指定分辨率上的非零单元及房源数"""
+        columns = [TIER_CODES[c] for c in categories if c in TIER_CODES]
+        totals = self.level(resolution)[:, columns].sum(axis=1)
+        return self.hex_index.nonzero(totals, resolution)
+
+    def composition(self, categories: Iterable[str], resolution: int):
+        """所选等级非零的单元，返回 (单元, 所选等级房源数, 单元 × 全部等级房源数)"""
+        level = self.level(resolution)
+        columns = [TIER_CODES[c] for c in categories if c in TIER_CODES]
+        totals = level[:, columns].sum(axis=1)
+        present = np.flatnonzero(totals)
+        return self.hex_index.cell_ids[resolution][present], totals[present], level[present]
+
+
+def build_hex_pyramid(snapshot, tiers) -> HexPyramid:
+    """按分级结果统计每个单元内各等级房东的房源数（与 hexgrid 一致，不按时间筛选房源）"""
+    hex_index = snapshot.hex_index()
+    n_tiers = len(TIER_NAMES)
+    listing_tier = tiers.tier_of(snapshot.hosts)[snapshot.host_code]
+    valid = snapshot.has_coords & (listing_tier != NO_TIER)
+
+    levels = {}
+    for resolution, code in hex_index.code.items():
+        n_cells = len(hex_index.cell_ids[resolution])
+        flat = code[valid].astype(np.int64) * n_tiers + listing_tier[valid]
+        levels[resolution] = np.bincount(flat, minlength=n_cells * n_tiers) \
+            .reshape(n_cells, n_tiers).astype(np.int32)
+    return HexPyramid(hex_index, levels, tiers)
+
+
+class HexPyramidService:
+    """按 (city, month) 缓存 HexPyramid"""
+
+    def __init__(self, classifier, cache: LRUCache = None):
+        self._classifier = classifier
+        self.cache = cache or LRUCache()
+
+    def get(self, snapshot, month: int) -> HexPyramid:
+        tiers = self._classifier.classify(snapshot, month)
+        key = (snapshot.city, clamp_month(snapshot.timeline, month))
+        pyramid = self.cache.get(key)
+        if pyramid is not None and pyramid.source is tiers:
+            return pyramid
+
+        with stage('binning'):
+            pyramid = build_hex_pyramid(snapshot, tiers)
+        self.cache.set(key, pyramid)
+        return pyramid
+
+    def invalidate(self, city_name: str = None):
+        if city_name is None:
+            self.cache.invalidate()
+        else:
+            self.cache.invalidate(lambda key: key[0] == city_name)
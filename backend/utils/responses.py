@@ -0,0 +1,128 @@
+"""
+JSON 响应编码
+
+FastAPI 默认先用 jsonable_encoder 逐个对象转换接口的返回值，再用标准库 json 编码，
+大的散点和网格结果大部分 CPU 花在这两步上。这里：
+    - FastJSONRoute 让接口返回的普通对象跳过 jsonable_encoder，直接交给 json_response
+    - dumps 使用 orjson（未安装时回退到标准库 json），原生支持 NumPy 数组和标量、
+      Decimal、datetime / date，以及 asyncpg Record、psycopg2 RealDictRow
+    - 顶层字典中最长的列表（listings、hexagons 等）达到 STREAM_MIN_ITEMS 时，
+      StreamingJSONResponse 每次编码 STREAM_CHUNK_ITEMS 个元素并分块发送，
+      不生成整个响应字符串；该列表放在输出的最后
+orjson 把 NaN / Infinity 编码为 null，标准库回退时和原来一样报错。
+路由不使用 response_model，返回值不做 FastAPI 的校验和转换。
+"""
+import asyncio
+import functools
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Iterator, Optional
+
+import numpy as np
+from fastapi.routing import APIRoute
+from starlette.responses import JSONResponse, Response, StreamingResponse
+
+from utils.timing import stage
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 列表达到该长度时分块发送
+STREAM_MIN_ITEMS = 5000
+STREAM_CHUNK_ITEMS = 2000
+
+
+def default(obj):
+    """orjson / json 不能直接编码的类型"""
+    if isinstance(obj, Decimal):
+        # 与 jsonable_encoder 一致：整数值的 Decimal 编码为整数
+        return int(obj) if obj.as_tuple().exponent >= 0 else float(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if hasattr(obj, 'items'):
+        # asyncpg Record 等类字典对象
+        return dict(obj.items())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(content) -> bytes:
+        return orjson.dumps(content, default=default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+else:
+    def dumps(content) -> bytes:
+        return json.dumps(
+            content, default=default, ensure_ascii=False, allow_nan=False, separators=(',', ':')
+        ).encode('utf-8')
+
+
+class FastJSONResponse(JSONResponse):
+    """编码计入 serialize 阶段"""
+
+    def render(self, content) -> bytes:
+        with stage('serialize'):
+            return dumps(content)
+
+
+def iter_json(content: dict, key: str, chunk_items: int = STREAM_CHUNK_ITEMS) -> Iterator[bytes]:
+    """先输出其他字段，再分块输出 content[key] 列表"""
+    items = content[key]
+    rest = dumps({name: value for name, value in content.items() if name != key})
+    yield (rest[:-1] + b',' if len(rest) > 2 else b'{') + dumps(key) + b':['
+    for start in range(0, len(items), chunk_items):
+        with stage('serialize'):
+            chunk = dumps(items[start:start + chunk_items])[1:-1]
+        yield b',' + chunk if start else chunk
+    yield b']}'
+
+
+class StreamingJSONResponse(StreamingResponse):
+    def __init__(self, content: dict, key: str, status_code: int = 200, headers: dict = None):
+        super().__init__(iter_json(content, key), status_code, headers, media_type='application/json')
+
+
+def stream_key(content) -> Optional[str]:
+    """需要分块发送的列表字段，没有时返回 None"""
+    if not isinstance(content, dict):
+        return None
+    sizes = {key: len(value) for key, value in content.items() if isinstance(value, list)}
+    if not sizes:
+        return None
+    key = max(sizes, key=sizes.get)
+    return key if sizes[key] >= STREAM_MIN_ITEMS else None
+
+
+def json_response(content, status_code: int = 200) -> Response:
+    key = stream_key(content)
+    if key is not None:
+        return StreamingJSONResponse(content, key, status_code)
+    return FastJSONResponse(content, status_code)
+
+
+class FastJSONRoute(APIRoute):
+    """接口返回 Response 以外的对象时用 json_response 编码，不经过 jsonable_encoder"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        status_code = kwargs.get('status_code') or 200
+
+        def to_response(content):
+            return content if isinstance(content, Response) else json_response(content, status_code)
+
+        if asyncio.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def wrapped(*args, **kw):
+                return to_response(await endpoint(*args, **kw))
+        else:
+            @functools.wraps(endpoint)
+            def wrapped(*args, **kw):
+                return to_response(endpoint(*args, **kw))
+
+        super().__init__(path, wrapped, **kwargs)
@@ -0,0 +1,437 @@
+"""
+城市列式快照
+
+每个城市的房源只从 PostgreSQL 读取一次，按列保存为 NumPy 数组：
+host_id、month（月份索引）、review_year、lat、lng、processed_price，以及散点图需要回传的
+name / price 文本列。/city/* 下的排名、分类、网格接口都直接在这些数组上做
+向量化筛选，不再为每次请求查询数据库。房东累计房源数来自随快照一起加载的
+HostTimeline（见 utils/timeline.py）。
+
+月份索引 = year * 12 + (month - 1)。这里保存的 month 是满足
+``first_review <= YYYY-MM-01`` 的最小月份，因此接口里的
+``first_review <= time_point`` 等价于 ``snapshot.month <= month_index(time_point)``。
+first_review 为空的房源记为 NO_REVIEW，任何时间点都不会被计入。
+
+刷新 / 失效：
+    快照创建后只读，不会被原地修改。
+    - await snapshot_store.refresh(city) 重新从数据库加载并原子替换，旧快照上的请求不受影响
+    - snapshot_store.invalidate(city) 丢弃该城市快照，下次访问时重新加载
+    - snapshot_store.invalidate()     丢弃所有城市快照
+    导入新数据后需要调用以上任意一种方式。
+
+预热快照文件：
+    save_snapshot 把快照的数值列、时间线和已计算的 H3 单元写成 .npy 文件，
+    目录按城市和数据版本区分（data/snapshots/<city>/v<version>/）。
+    新 worker 启动时 CitySnapshotStore 优先用 mmap 方式读取当前版本的文件，
+    不再查询 PostgreSQL，也不用重新计算 H3 单元。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Callable, Dict, List, Optional
+from urllib.parse import quote
+
+import numpy as np
+
+from utils.hexbin import latlng_to_cells_multi
+from utils.logger import logger
+from utils.mvt import lnglat_to_world
+from utils.pyramid import CityHexIndex
+from utils.timeline import REVIEW_MONTH_SQL, HostTimeline, load_host_timeline
+from utils.timing import stage
+
+NO_REVIEW = np.iinfo(np.int32).max
+
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'snapshots')
+
+# 预热文件中按 .npy 保存的数值列
+NUMERIC_FIELDS = ('host_id', 'month', 'review_year', 'lat', 'lng', 'processed_price')
+
+SNAPSHOT_QUERY = f"""
+    SELECT
+        host_id,
+        {REVIEW_MONTH_SQL} as month,
+        ST_Y(geom) as latitude,
+        ST_X(geom) as longitude,
+        processed_price,
+        name,
+        price,
+        EXTRACT(YEAR FROM first_review)::int as review_year
+    FROM listings
+    WHERE city = $1
+    AND host_id IS NOT NULL
+"""
+
+
+class CitySnapshot:
+    """单个城市的只读列式数据"""
+
+    def __init__(
+        self,
+        city: str,
+        host_id: np.ndarray,
+        month: np.ndarray,
+        lat: np.ndarray,
+        lng: np.ndarray,
+        processed_price: np.ndarray,
+        name: np.ndarray,
+        price: np.ndarray,
+        timeline: Optional[HostTimeline] = None,
+        review_year: Optional[np.ndarray] = None,
+    ):
+        self.city = city
+        self.host_id = np.asarray(host_id, dtype=np.int64)
+        self.month = np.asarray(month, dtype=np.int32)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lng = np.asarray(lng, dtype=np.float64)
+        self.processed_price = np.asarray(processed_price, dtype=np.float64)
+        self.name = np.asarray(name, dtype=object)
+        self.price = np.asarray(price, dtype=object)
+        # first_review 的自然年，没有评论为 0（month 可能因月中的日期进到下一年）
+        if review_year is None:
+            review_year = np.where(self.month != NO_REVIEW, self.month // 12, 0)
+        self.review_year = np.asarray(review_year, dtype=np.int32)
+        self.loaded_at = time.time()
+
+        # 房东编码：hosts 为排序后的唯一 host_id，host_code 为每条房源对应的下标
+        self.hosts, host_code = np.unique(self.host_id, return_inverse=True)
+        self.host_code = host_code.astype(np.int32).reshape(-1)
+        self.has_coords = ~(np.isnan(self.lat) | np.isnan(self.lng))
+
+        if self.has_coords.any():
+            self.bounds = {
+                'min_lat': float(self.lat[self.has_coords].min()),
+                'max_lat': float(self.lat[self.has_coords].max()),
+                'min_lng': float(self.lng[self.has_coords].min()),
+                'max_lng': float(self.lng[self.has_coords].max())
+            }
+        else:
+            self.bounds = None
+
+        if timeline is None:
+            reviewed = self.month != NO_REVIEW
+            timeline = HostTimeline.from_events(self.host_id[reviewed], self.month[reviewed])
+        self.timeline = timeline
+
+        # 每个分辨率下房源所在的 H3 单元，首次使用时计算
+        self._cells: Dict[int, np.ndarray] = {}
+        self._hex_index = None
+        self._price_values = None
+        self._world = None
+        self._fingerprint = None
+
+    def __len__(self) -> int:
+        return len(self.host_id)
+
+    @classmethod
+    def from_rows(cls, city: str, rows: list, timeline: Optional[HostTimeline] = None) -> "CitySnapshot":
+        """由 SNAPSHOT_QUERY 的结果行构建快照"""
+        n = len(rows)
+        host_id = np.empty(n, dtype=np.int64)
+        month = np.empty(n, dtype=np.int32)
+        lat = np.empty(n, dtype=np.float64)
+        lng = np.empty(n, dtype=np.float64)
+        processed_price = np.empty(n, dtype=np.float64)
+        name = np.empty(n, dtype=object)
+        price = np.empty(n, dtype=object)
+        review_year = np.empty(n, dtype=np.int32)
+
+        for i, (h, m, la, ln, pp, nm, pr, ry) in enumerate(rows):
+            host_id[i] = h
+            month[i] = NO_REVIEW if m is None else m
+            lat[i] = np.nan if la is None else la
+            lng[i] = np.nan if ln is None else ln
+            processed_price[i] = np.nan if pp is None else pp
+            name[i] = nm
+            price[i] = pr
+            review_year[i] = 0 if ry is None else ry
+
+        return cls(city, host_id, month, lat, lng, processed_price, name, price, timeline, review_year)
+
+    def host_listing_counts(self, month: int):
+        """
+        返回截至 month 有房源的房东及其房源数，按房源数降序排列
+        （房源数相同时按 host_id 升序，保证结果稳定）
+        """
+        return self.timeline.host_listing_counts(month)
+
+    def cells(self, resolution: int) -> np.ndarray:
+        """每条房源所在的 H3 单元（uint64，无坐标的房源为 0）"""
+        return self.cells_at([resolution])[resolution]
+
+    def cells_at(self, resolutions) -> Dict[int, np.ndarray]:
+        """多个分辨率的 H3 单元，未计算的分辨率在一次遍历中一起计算"""
+        missing = [resolution for resolution in resolutions if resolution not in self._cells]
+        if missing:
+            self._cells.update(latlng_to_cells_multi(self.lat, self.lng, missing))
+        return {resolution: self._cells[resolution] for resolution in resolutions}
+
+    def hex_index(self):
+        """各分辨率的单元编号（见 utils/pyramid.py）"""
+        if self._hex_index is None:
+            with stage('binning'):
+                self._hex_index = CityHexIndex.from_snapshot(self)
+        return self._hex_index
+
+    def price_values(self) -> np.ndarray:
+        """price 文本（如 "$1,200.00"）解析出的数值，无法解析为 NaN，首次使用时计算"""
+        if self._price_values is None:
+            values = np.full(len(self.price), np.nan)
+            for i, text in enumerate(self.price.tolist()):
+                if text is None:
+                    continue
+                try:
+                    values[i] = float(str(text).replace('$', '').replace(',', ''))
+                except ValueError:
+                    pass
+            self._price_values = values
+        return self._price_values
+
+    def world_coords(self):
+        """房源的 Web Mercator 世界坐标 (x, y)，矢量瓦片使用"""
+        if self._world is None:
+            self._world = lnglat_to_world(self.lng, self.lat)
+        return self._world
+
+    def fingerprint(self) -> str:
+        """快照内容的摘要，数据不变时重启后也保持一致，用作磁盘缓存的版本"""
+        if self._fingerprint is None:
+            digest = hashlib.blake2b(digest_size=8)
+            for values in (self.host_id, self.month, self.review_year, self.lat, self.lng,
+                           self.processed_price, self.timeline.cumulative):
+                digest.update(np.ascontiguousarray(values).tobytes())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def select(
+        self,
+        host_ids=None,
+        month: Optional[int] = None,
+        require_coords: bool = True
+    ) -> np.ndarray:
+        """按房东、时间点筛选房源，返回房源下标"""
+        mask = np.ones(len(self), dtype=bool)
+        if require_coords:
+            mask &= self.has_coords
+        if month is not None:
+            mask &= self.month <= month
+        if host_ids is not None:
+            selected = np.isin(self.hosts, np.asarray(host_ids, dtype=np.int64))
+            mask &= selected[self.host_code]
+        return np.flatnonzero(mask)
+
+    def records(self, idx: np.ndarray, fields: List[str]) -> List[dict]:
+        """将选中的房源转换为接口返回的字典列表"""
+        with stage('records'):
+            return self._records(idx, fields)
+
+    def _records(self, idx: np.ndarray, fields: List[str]) -> List[dict]:
+        columns = []
+        for field in fields:
+            if field == 'host_id':
+                columns.append(self.host_id[idx].tolist())
+            elif field == 'latitude':
+                columns.append(self.lat[idx].tolist())
+            elif field == 'longitude':
+                columns.append(self.lng[idx].tolist())
+            elif field == 'processed_price':
+                columns.append([
+                    None if p != p else int(p)
+                    for p in self.processed_price[idx].tolist()
+                ])
+            elif field == 'name':
+                columns.append(self.name[idx].tolist())
+            elif field == 'price':
+                columns.append(self.price[idx].tolist())
+            elif field == 'geom':
+                columns.append([
+                    f'{{"type":"Point","coordinates":[{lng},{lat}]}}'
+                    for lat, lng in zip(self.lat[idx].tolist(), self.lng[idx].tolist())
+                ])
+            else:
+                raise KeyError(f"Unknown snapshot field: {field}")
+
+        return [dict(zip(fields, values)) for values in zip(*columns)]
+
+
+async def load_city_snapshot(db, city_name: str) -> CitySnapshot:
+    """从数据库加载城市快照，时间线优先读取导入时生成的 host_monthly_listings"""
+    rows = await db.fetch(SNAPSHOT_QUERY, city_name)
+    timeline = await load_host_timeline(db, city_name)
+    return CitySnapshot.from_rows(city_name, [tuple(row) for row in rows], timeline)
+
+
+def snapshot_path(directory: str, city_name: str, version: int) -> str:
+    return os.path.join(directory, quote(city_name, safe=''), f'v{version}')
+
+
+def save_snapshot(snapshot: CitySnapshot, directory: str, version: int) -> str:
+    """
+    把快照写成预热文件。先写临时目录再整体改名，多个 worker 同时写入时只有一个生效；
+    同一城市其他版本的文件会被删除。
+    """
+    target = snapshot_path(directory, snapshot.city, version)
+    if os.path.exists(target):
+        return target
+
+    tmp = f'{target}.tmp-{os.getpid()}'
+    os.makedirs(tmp, exist_ok=True)
+    try:
+        for field in NUMERIC_FIELDS:
+            np.save(os.path.join(tmp, f'{field}.npy'), getattr(snapshot, field))
+        np.save(os.path.join(tmp, 'timeline_hosts.npy'), snapshot.timeline.hosts)
+        np.save(os.path.join(tmp, 'timeline_cumulative.npy'), snapshot.timeline.cumulative)
+        resolutions = sorted(snapshot._cells)
+        for resolution in resolutions:
+            np.save(os.path.join(tmp, f'cells_{resolution}.npy'), snapshot._cells[resolution])
+        with open(os.path.join(tmp, 'text.json'), 'w') as f:
+            json.dump({'name': snapshot.name.tolist(), 'price': snapshot.price.tolist()}, f)
+        # meta.json 最后写入，作为文件完整的标志
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({
+                'city': snapshot.city,
+                'version': version,
+                'start_month': snapshot.timeline.start_month,
+                'resolutions': resolutions,
+                'saved_at': time.time()
+            }, f)
+        os.rename(tmp, target)
+    except OSError:
+        # 其他 worker 已经写好了同一版本
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.exists(target):
+            raise
+
+    city_dir = os.path.dirname(target)
+    for name in os.listdir(city_dir):
+        if name != os.path.basename(target) and not name.startswith(f'{os.path.basename(target)}.tmp'):
+            shutil.rmtree(os.path.join(city_dir, name), ignore_errors=True)
+    return target
+
+
+def load_snapshot_file(directory: str, city_name: str, version: int) -> Optional[CitySnapshot]:
+    """用 mmap 读取预热文件，不存在时返回 None"""
+    path = snapshot_path(directory, city_name, version)
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    def load(name: str) -> np.ndarray:
+        return np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+
+    with open(os.path.join(path, 'text.json')) as f:
+        text = json.load(f)
+
+    timeline = HostTimeline(load('timeline_hosts'), meta['start_month'], load('timeline_cumulative'))
+    columns = {field: load(field) for field in NUMERIC_FIELDS}
+    snapshot = CitySnapshot(
+        city_name,
+        columns['host_id'],
+        columns['month'],
+        columns['lat'],
+        columns['lng'],
+        columns['processed_price'],
+        text['name'],
+        text['price'],
+        timeline,
+        columns['review_year']
+    )
+    for resolution in meta['resolutions']:
+        snapshot._cells[resolution] = load(f'cells_{resolution}')
+    return snapshot
+
+
+class CityNotFound(LookupError):
+    """数据库中没有该城市的房源"""
+
+
+class CitySnapshotStore:
+    """
+    进程内城市快照缓存
+
+    设置 warm_dir 和 version_of（返回城市当前数据版本）后，加载时优先读取预热文件，
+    从数据库加载的快照可以通过 save_warm 写成预热文件供其他 worker 使用。
+    """
+
+    def __init__(self, db, warm_dir: Optional[str] = None, version_of: Callable[[str], int] = None):
+        self._db = db
+        self.warm_dir = warm_dir
+        self._version_of = version_of or (lambda city_name: 0)
+        self._snapshots: Dict[str, CitySnapshot] = {}
+        self._versions: Dict[str, int] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _lock_for(self, city_name: str) -> asyncio.Lock:
+        return self._locks.setdefault(city_name, asyncio.Lock())
+
+    async def _load(self, city_name: str, version: int) -> CitySnapshot:
+        with stage('snapshot'):
+            return await self._read(city_name, version)
+
+    async def _read(self, city_name: str, version: int) -> CitySnapshot:
+        if self.warm_dir is not None:
+            try:
+                snapshot = await asyncio.to_thread(load_snapshot_file, self.warm_dir, city_name, version)
+                if snapshot is not None:
+                    return snapshot
+            except Exception as e:
+                logger.error(f"Failed to read warm snapshot for {city_name}: {e}")
+        return await load_city_snapshot(self._db, city_name)
+
+    async def get(self, city_name: str) -> CitySnapshot:
+        snapshot = self._snapshots.get(city_name)
+        if snapshot is not None:
+            return snapshot
+
+        # 同一城市只加载一次
+        async with self._lock_for(city_name):
+            snapshot = self._snapshots.get(city_name)
+            if snapshot is None:
+                version = self._version_of(city_name)
+                snapshot = await self._load(city_name, version)
+                if len(snapshot) == 0:
+                    # 不存在的城市不缓存，避免任意城市名占用内存
+                    self._locks.pop(city_name, None)
+                    raise CityNotFound(city_name)
+                self._snapshots[city_name] = snapshot
+                self._versions[city_name] = version
+            return snapshot
+
+    async def refresh(self, city_name: str, version: int = None) -> CitySnapshot:
+        if version is None:
+            version = self._version_of(city_name)
+        async with self._lock_for(city_name):
+            snapshot = await self._load(city_name, version)
+            self._snapshots[city_name] = snapshot
+            self._versions[city_name] = version
+            return snapshot
+
+    async def save_warm(self, city_name: str):
+        """把当前快照（包括已计算的 H3 单元）写成预热文件"""
+        snapshot = self._snapshots.get(city_name)
+        if self.warm_dir is None or snapshot is None:
+            return
+        await asyncio.to_thread(save_snapshot, snapshot, self.warm_dir, self._versions.get(city_name, 0))
+
+    def put(self, snapshot: CitySnapshot, version: int = 0):
+        """直接放入已构建的快照（基准测试的进程内数据使用）"""
+        self._snapshots[snapshot.city] = snapshot
+        self._versions[snapshot.city] = version
+
+    def invalidate(self, city_name: str = None):
+        if city_name is None:
+            self._snapshots.clear()
+        else:
+            self._snapshots.pop(city_name, None)
+
+    def loaded(self, city_name: str) -> Optional[CitySnapshot]:
+        """已加载的快照，不触发加载"""
+        return self._snapshots.get(city_name)
+
+    def cities(self) -> List[str]:
+        return list(self._snapshots)
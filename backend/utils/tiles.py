@@ -0,0 +1,271 @@
+"""
+城市矢量瓦片
+
+/city/{city}/tiles/{z}/{x}/{y}.mvt 只返回可见范围内的要素，包含两个图层：
+    listings   所选等级房东的房源点（与 listings_by_categories 一致，按时间筛选）
+    hexagons   所选等级的六边形网格（与 hexgrid 一致，来自 HexPyramid）
+
+瓦片在内存（LRUCache）和磁盘（data/tiles/）上各缓存一份，键为
+(city, 快照摘要, month, categories, layers, resolution, z/x/y)。快照摘要随数据变化，
+数据更新后旧瓦片自然失效；invalidate(city) 可以直接删除某个城市的缓存。
+
+磁盘缓存的大小受 TILE_CACHE_MAX_BYTES 限制：
+    - 某个城市第一次出现新的快照摘要时，删除该城市其他摘要下的瓦片
+    - 每写入约 1/10 上限的数据检查一次总大小，超过上限时按最近访问时间（mtime，
+      读取命中时更新）删除最旧的瓦片，直到降到上限的 90%
+"""
+import os
+import shutil
+import threading
+from typing import Iterable, Optional
+from urllib.parse import quote
+
+import numpy as np
+from h3.api import basic_int as h3_int
+
+from utils.cache import LRUCache
+from utils.classifier import TIER_NAMES, TIER_CODES, clamp_month
+from utils.mvt import (
+    POINT, POLYGON, LayerBuilder, encode_tile,
+    point_geometry, polygon_geometry, tile_bounds, to_tile_coords
+)
+from utils.pyramid import resolution_for_zoom
+from utils.timing import stage
+
+MEDIA_TYPE = 'application/vnd.mapbox-vector-tile'
+TILE_LAYERS = ('listings', 'hexagons')
+MAX_ZOOM = 22
+
+TILE_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'tiles')
+TILE_CACHE_MAX_BYTES = int(os.getenv('TILE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+
+def parse_layers(layers: Optional[str]) -> tuple:
+    """逗号分隔的图层名，不传时返回全部图层"""
+    if not layers:
+        return TILE_LAYERS
+    selected = tuple(name for name in TILE_LAYERS if name in layers.split(','))
+    if not selected:
+        raise ValueError(f"layers must be a subset of {', '.join(TILE_LAYERS)}")
+    return selected
+
+
+def check_tile(z: int, x: int, y: int):
+    if not 0 <= z <= MAX_ZOOM:
+        raise ValueError(f"z must be between 0 and {MAX_ZOOM}")
+    if not (0 <= x < (1 << z) and 0 <= y < (1 << z)):
+        raise ValueError(f"Tile {z}/{x}/{y} is out of range")
+
+
+def listings_layer(snapshot, tiers, month: int, categories: Iterable[str], z: int, x: int, y: int) -> LayerBuilder:
+    layer = LayerBuilder('listings')
+    idx = snapshot.select(host_ids=tiers.hosts_in(categories), month=month)
+    wx, wy = snapshot.world_coords()
+    min_x, min_y, max_x, max_y = tile_bounds(z, x, y)
+    idx = idx[(wx[idx] >= min_x) & (wx[idx] < max_x) & (wy[idx] >= min_y) & (wy[idx] < max_y)]
+    if len(idx) == 0:
+        return layer
+
+    px, py = to_tile_coords(wx[idx], wy[idx], z, x, y)
+    tier = tiers.tier_of(snapshot.host_id[idx])
+    for i, listing in enumerate(idx.tolist()):
+        processed_price = snapshot.processed_price[listing]
+        layer.add(POINT, point_geometry(int(px[i]), int(py[i])), {
+            'host_id': int(snapshot.host_id[listing]),
+            'host_category': TIER_NAMES[tier[i]],
+            'price': snapshot.price[listing],
+            'processed_price': None if processed_price != processed_price else float(processed_price)
+        }, feature_id=listing)
+    return layer
+
+
+def hexagons_layer(pyramid, categories: Iterable[str], resolution: int, z: int, x: int, y: int) -> LayerBuilder:
+    layer = LayerBuilder('hexagons')
+    hex_index = pyramid.hex_index
+    columns = [TIER_CODES[c] for c in categories if c in TIER_CODES]
+    counts = pyramid.level(resolution)[:, columns].sum(axis=1)
+
+    bbox, vertices = hex_index.outlines(resolution)
+    min_x, min_y, max_x, max_y = tile_bounds(z, x, y)
+    visible = np.flatnonzero(
+        (counts > 0)
+        & (bbox[:, 2] >= min_x) & (bbox[:, 0] < max_x)
+        & (bbox[:, 3] >= min_y) & (bbox[:, 1] < max_y)
+    )
+
+    cell_ids = hex_index.cell_ids[resolution]
+    for cell in visible.tolist():
+        xs, ys = to_tile_coords(*vertices[cell], z, x, y)
+        layer.add(POLYGON, polygon_geometry(xs.tolist(), ys.tolist()), {
+            'id': h3_int.h3_to_string(int(cell_ids[cell])),
+            'points_count': int(counts[cell])
+        })
+    return layer
+
+
+class TileService:
+    """生成并缓存城市矢量瓦片"""
+
+    def __init__(self, classifier, pyramid, cache: LRUCache = None, cache_dir: Optional[str] = TILE_CACHE_DIR,
+                 max_disk_bytes: int = TILE_CACHE_MAX_BYTES):
+        self._classifier = classifier
+        self._pyramid = pyramid
+        self.cache = cache or LRUCache()
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        # 每个城市当前的快照摘要
+        self._fingerprints = {}
+        self._written = 0
+        self._lock = threading.Lock()
+        self._prune_lock = threading.Lock()
+
+    def _city_dir(self, city_name: str) -> str:
+        return os.path.join(self.cache_dir, quote(city_name, safe=''))
+
+    def _path(self, key: tuple) -> str:
+        city, fingerprint, month, categories, layers, resolution, z, x, y = key
+        return os.path.join(
+            self._city_dir(city), fingerprint, str(month),
+            '-'.join(map(str, categories)) or 'none', '-'.join(layers),
+            str(resolution), str(z), str(x), f'{y}.mvt'
+        )
+
+    def _read(self, key: tuple) -> Optional[bytes]:
+        if self.cache_dir is None:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                tile = f.read()
+        except FileNotFoundError:
+            return None
+        # mtime 作为最近访问时间，供按大小清理时使用
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return tile
+
+    def _write(self, key: tuple, tile: bytes):
+        if self.cache_dir is None:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 同一瓦片可能在多个工作线程中同时生成，临时文件各自独立
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(tile)
+        os.replace(tmp, path)
+
+        with self._lock:
+            self._written += len(tile)
+            due = self._written >= self.max_disk_bytes // 10
+            if due:
+                self._written = 0
+        if due:
+            self.prune()
+
+    def _drop_stale(self, city_name: str, fingerprint: str):
+        """城市第一次出现新的快照摘要时删除其他摘要下的瓦片"""
+        with self._lock:
+            if self._fingerprints.get(city_name) == fingerprint:
+                return
+            self._fingerprints[city_name] = fingerprint
+        if self.cache_dir is None:
+            return
+        city_dir = self._city_dir(city_name)
+        try:
+            stale = [name for name in os.listdir(city_dir) if name != fingerprint]
+        except FileNotFoundError:
+            return
+        for name in stale:
+            shutil.rmtree(os.path.join(city_dir, name), ignore_errors=True)
+
+    def prune(self):
+        """磁盘缓存超过上限时删除最久未访问的瓦片，直到降到上限的 90%"""
+        if self.cache_dir is None:
+            return
+        # 已有线程在清理时跳过
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            files = []
+            total = 0
+            for root, _, names in os.walk(self.cache_dir):
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        info = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((info.st_mtime, info.st_size, path))
+                    total += info.st_size
+            if total <= self.max_disk_bytes:
+                return
+
+            target = self.max_disk_bytes * 0.9
+            files.sort()
+            for _, size, path in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                # 删除变空的上级目录，cache_dir 本身保留
+                parent = os.path.dirname(path)
+                while parent != self.cache_dir:
+                    try:
+                        os.rmdir(parent)
+                    except OSError:
+                        break
+                    parent = os.path.dirname(parent)
+        finally:
+            self._prune_lock.release()
+
+    def get(self, snapshot, month: int, categories: Iterable[str], z: int, x: int, y: int,
+            layers: tuple = TILE_LAYERS, resolution: int = None) -> bytes:
+        check_tile(z, x, y)
+        codes = sorted({TIER_CODES[c] for c in categories if c in TIER_CODES})
+        categories = [TIER_NAMES[code] for code in codes]
+        if resolution is None:
+            resolution = resolution_for_zoom(z)
+
+        fingerprint = snapshot.fingerprint()
+        self._drop_stale(snapshot.city, fingerprint)
+        key = (snapshot.city, fingerprint, clamp_month(snapshot.timeline, month),
+               tuple(codes), tuple(layers), resolution, z, x, y)
+        tile = self.cache.get(key)
+        if tile is not None:
+            return tile
+
+        tile = self._read(key)
+        if tile is None:
+            builders = []
+            if 'listings' in layers:
+                tiers = self._classifier.classify(snapshot, month)
+                builders.append(listings_layer(snapshot, tiers, month, categories, z, x, y))
+            if 'hexagons' in layers:
+                pyramid = self._pyramid.get(snapshot, month)
+                builders.append(hexagons_layer(pyramid, categories, resolution, z, x, y))
+            with stage('serialize'):
+                tile = encode_tile(builders)
+            self._write(key, tile)
+
+        self.cache.set(key, tile)
+        return tile
+
+    def invalidate(self, city_name: str = None):
+        """删除内存和磁盘上的瓦片缓存"""
+        if city_name is None:
+            self.cache.invalidate()
+            if self.cache_dir is not None:
+                shutil.rmtree(self.cache_dir, ignore_errors=True)
+        else:
+            self.cache.invalidate(lambda key: key[0] == city_name)
+            if self.cache_dir is not None:
+                shutil.rmtree(self._city_dir(city_name), ignore_errors=True)
+
+    def stats(self) -> dict:
+        return self.cache.stats()
@@ -0,0 +1,141 @@
+"""
+房东累计房源时间线
+
+以 房东 × 月份 的前缀和矩阵保存每个房东截至每个月的累计房源数，
+任意 YYYY-MM 的房东房源数只需要取矩阵的一列，不再扫描房源。
+
+持久化在 host_monthly_listings 表中（每个城市、房东、月份新增的房源数），
+由 import_to_postgresql.py 在全量导入时生成，增量导入时用 update_host_timeline_table
+累加变化的房源；后端在城市数据版本变化后重新加载该城市的时间线。
+月份索引 = year * 12 + (month - 1)。
+"""
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+def review_month_sql(column: str = 'first_review') -> str:
+    """评论日期列对应的月份索引：满足 column <= YYYY-MM-01 的最小月份"""
+    return f"""(
+    EXTRACT(YEAR FROM {column})::int * 12
+    + EXTRACT(MONTH FROM {column})::int - 1
+    + CASE WHEN {column} > date_trunc('month', {column}) THEN 1 ELSE 0 END
+)"""
+
+
+REVIEW_MONTH_SQL = review_month_sql()
+
+CREATE_TIMELINE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS host_monthly_listings (
+        city TEXT NOT NULL,
+        host_id BIGINT NOT NULL,
+        month INTEGER NOT NULL,
+        new_listings INTEGER NOT NULL,
+        PRIMARY KEY (city, host_id, month)
+    )
+"""
+
+BUILD_TIMELINE_SQL = f"""
+    INSERT INTO host_monthly_listings (city, host_id, month, new_listings)
+    SELECT city, host_id, {REVIEW_MONTH_SQL} as month, COUNT(*)
+    FROM listings
+    WHERE city = %s
+    AND host_id IS NOT NULL
+    AND first_review IS NOT NULL
+    GROUP BY city, host_id, month
+"""
+
+UPSERT_TIMELINE_SQL = """
+    INSERT INTO host_monthly_listings (city, host_id, month, new_listings)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (city, host_id, month)
+    DO UPDATE SET new_listings = host_monthly_listings.new_listings + EXCLUDED.new_listings
+"""
+
+
+def month_index(time_point: str) -> int:
+    """将 YYYY-MM 转换为月份索引，格式错误时抛出 ValueError"""
+    target_date = datetime.strptime(time_point, "%Y-%m")
+    return target_date.year * 12 + target_date.month - 1
+
+
+def month_label(index: int) -> str:
+    """月份索引转换回 YYYY-MM"""
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+class HostTimeline:
+    """房东 × 月份 累计房源矩阵，创建后只读"""
+
+    def __init__(self, hosts: np.ndarray, start_month: int, cumulative: np.ndarray):
+        self.hosts = hosts
+        self.start_month = start_month
+        self.cumulative = cumulative
+
+    @property
+    def end_month(self) -> int:
+        return self.start_month + self.cumulative.shape[1] - 1
+
+    @classmethod
+    def from_events(cls, host_ids, months, counts=None) -> "HostTimeline":
+        """由 (房东, 月份, 新增房源数) 事件构建时间线"""
+        host_ids = np.asarray(host_ids, dtype=np.int64)
+        months = np.asarray(months, dtype=np.int64)
+        counts = np.ones(len(host_ids), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+
+        if len(host_ids) == 0:
+            return cls(np.empty(0, dtype=np.int64), 0, np.zeros((0, 1), dtype=np.int32))
+
+        hosts, host_code = np.unique(host_ids, return_inverse=True)
+        start_month = int(months.min())
+        increments = np.zeros((len(hosts), int(months.max()) - start_month + 1), dtype=np.int32)
+        np.add.at(increments, (host_code.reshape(-1), months - start_month), counts)
+        return cls(hosts, start_month, np.cumsum(increments, axis=1, dtype=np.int32))
+
+    def counts_at(self, month: int) -> np.ndarray:
+        """截至 month 每个房东的累计房源数（与 hosts 对齐）"""
+        if month < self.start_month:
+            return np.zeros(len(self.hosts), dtype=np.int32)
+        return self.cumulative[:, min(month, self.end_month) - self.start_month]
+
+    def host_listing_counts(self, month: int):
+        """截至 month 有房源的房东及房源数，按房源数降序、host_id 升序排列"""
+        counts = self.counts_at(month)
+        present = np.flatnonzero(counts)
+        order = np.lexsort((self.hosts[present], -counts[present]))
+        present = present[order]
+        return self.hosts[present], counts[present].astype(np.int64)
+
+
+async def load_host_timeline(db, city_name: str) -> Optional[HostTimeline]:
+    """从 host_monthly_listings 加载时间线，表不存在或没有该城市数据时返回 None"""
+    if not await db.fetchval("SELECT to_regclass('host_monthly_listings') IS NOT NULL"):
+        return None
+
+    rows = await db.fetch("""
+        SELECT host_id, month, new_listings
+        FROM host_monthly_listings
+        WHERE city = $1
+    """, city_name)
+
+    if not rows:
+        return None
+    host_ids, months, counts = zip(*rows)
+    return HostTimeline.from_events(host_ids, months, counts)
+
+
+def build_host_timeline_table(cur, city_name: str):
+    """导入时重建某个城市的时间线"""
+    cur.execute(CREATE_TIMELINE_TABLE_SQL)
+    cur.execute("DELETE FROM host_monthly_listings WHERE city = %s", (city_name,))
+    cur.execute(BUILD_TIMELINE_SQL, (city_name,))
+
+
+def update_host_timeline_table(cur, city_name: str, host_ids, months, deltas):
+    """增量累加新快照带来的 (房东, 月份, 房源数变化)"""
+    cur.execute(CREATE_TIMELINE_TABLE_SQL)
+    cur.executemany(UPSERT_TIMELINE_SQL, [
+        (city_name, int(h), int(m), int(d))
+        for h, m, d in zip(host_ids, months, deltas)
+    ])
+    cur.execute("DELETE FROM host_monthly_listings WHERE city = %s AND new_listings = 0", (city_name,))
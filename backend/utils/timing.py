@@ -0,0 +1,202 @@
+"""
+请求分阶段计时与 Prometheus 指标
+
+    with stage('classify'):      标记请求中的一个阶段，同名阶段累加
+    TimingMiddleware             为每个请求建立计时上下文：
+                                   - 响应头 Server-Timing 列出各阶段和 total 的耗时（毫秒）
+                                   - 按 (路由, 阶段) 累计延迟直方图，/metrics 以 Prometheus 文本格式输出
+                                   - 超过 SLOW_REQUEST_SECONDS 的请求连同参数、各阶段耗时和慢查询
+                                     写入日志；SLOW_QUERY_EXPLAIN=1 时对慢查询附带 EXPLAIN ANALYZE
+
+数据库查询由 utils/db.py 自动计入 db 阶段。asyncio.to_thread 和 create_task 会复制
+上下文，线程和任务中的阶段计入发起它们的请求。阶段之间可能嵌套（例如 snapshot 包含 db），
+Server-Timing 中各阶段之和不一定等于 total。
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from utils.logger import logger
+
+# 直方图分桶（秒）
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+SLOW_REQUEST_SECONDS = float(os.getenv('SLOW_REQUEST_SECONDS', 1.0))
+SLOW_QUERY_SECONDS = float(os.getenv('SLOW_QUERY_SECONDS', 0.2))
+
+
+class RequestTimings:
+    """单个请求的各阶段耗时和慢查询"""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.slow_queries: List[Tuple[str, tuple, float]] = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_query(self, query: str, args: tuple, seconds: float):
+        self.add('db', seconds)
+        if seconds >= SLOW_QUERY_SECONDS:
+            with self._lock:
+                self.slow_queries.append((query, args, seconds))
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar('request_timings', default=None)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    """计时一个阶段；不在请求中时什么也不做"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - start)
+
+
+def record_query(query: str, args: tuple, seconds: float):
+    timings = _current.get()
+    if timings is not None:
+        timings.add_query(query, args, seconds)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+def _label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsRegistry:
+    """按 (路由, 阶段) 的延迟直方图和按 (路由, 方法, 状态码) 的请求计数"""
+
+    def __init__(self):
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        self.requests: Dict[Tuple[str, str, int], int] = {}
+
+    def observe(self, route: str, method: str, status: int, stages: Dict[str, float]):
+        key = (route, method, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        for name, seconds in stages.items():
+            histogram = self.histograms.get((route, name))
+            if histogram is None:
+                histogram = self.histograms[(route, name)] = Histogram()
+            histogram.observe(seconds)
+
+    def render(self) -> str:
+        """Prometheus 文本格式"""
+        lines = [
+            '# HELP http_requests_total Requests by route, method and status.',
+            '# TYPE http_requests_total counter'
+        ]
+        for (route, method, status), count in sorted(self.requests.items()):
+            lines.append(f'http_requests_total{{route="{_label(route)}",method="{method}",status="{status}"}} {count}')
+
+        lines += [
+            '# HELP http_request_stage_seconds Request latency by route and stage.',
+            '# TYPE http_request_stage_seconds histogram'
+        ]
+        for (route, name), histogram in sorted(self.histograms.items()):
+            labels = f'route="{_label(route)}",stage="{_label(name)}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float('inf'),), histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'http_request_stage_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'http_request_stage_seconds_sum{{{labels}}} {histogram.sum:.6f}')
+            lines.append(f'http_request_stage_seconds_count{{{labels}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+class TimingMiddleware:
+    """
+    explain(query, args) 为可选的协程函数，返回慢查询的执行计划；
+    只在请求超过 slow_seconds 时、响应发送完成后调用
+    """
+
+    def __init__(self, app: ASGIApp, metrics: MetricsRegistry, slow_seconds: float = SLOW_REQUEST_SECONDS,
+                 explain: Callable[[str, tuple], Awaitable[str]] = None):
+        self.app = app
+        self.metrics = metrics
+        self.slow_seconds = slow_seconds
+        self.explain = explain
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def timed_send(message: Message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                # 响应头发出时 JSON 编码和压缩已经完成
+                stages = dict(timings.stages, total=time.perf_counter() - start)
+                headers = MutableHeaders(scope=message)
+                headers.append('Server-Timing', ', '.join(
+                    f'{name};dur={seconds * 1000:.1f}' for name, seconds in stages.items()
+                ))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            _current.reset(token)
+            total = time.perf_counter() - start
+            route = scope.get('route')
+            route = getattr(route, 'path', None) or 'unmatched'
+            self.metrics.observe(route, scope['method'], status, dict(timings.stages, total=total))
+            if total >= self.slow_seconds:
+                await self._log_slow(scope, route, status, total, timings)
+
+    async def _log_slow(self, scope: Scope, route: str, status: int, total: float, timings: RequestTimings):
+        query_string = scope.get('query_string', b'').decode('latin-1')
+        stages = ', '.join(f'{name}={seconds * 1000:.1f}ms' for name, seconds in timings.stages.items())
+        logger.warning(
+            f"Slow request: {scope['path']}{'?' + query_string if query_string else ''} | "
+            f"Route: {route} | Status: {status} | Duration: {total:.3f}s | Stages: {stages or '-'}"
+        )
+        for query, args, seconds in timings.slow_queries:
+            message = f"Slow query ({seconds:.3f}s): {' '.join(query.split())} | Args: {args!r}"
+            if self.explain is not None:
+                try:
+                    message += '\n' + await self.explain(query, args)
+                except Exception as e:
+                    message += f'\nEXPLAIN failed: {e}'
+            logger.warning(message)
@@ -0,0 +1,117 @@
+"""
+城市数据版本
+
+每次导入（全量或增量）都会在 city_data_versions 中把该城市的 version 加 1，
+并记录本次新增 / 更新 / 删除的行数。后端定期读取这张表，版本变化时调用
+注册的回调刷新快照、清理派生缓存，旧数据在新快照就绪前继续提供服务。
+"""
+import asyncio
+import inspect
+from typing import Callable, Dict, List
+
+from utils.logger import logger
+
+CREATE_VERSIONS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS city_data_versions (
+        city TEXT PRIMARY KEY,
+        version BIGINT NOT NULL,
+        rows_inserted BIGINT NOT NULL DEFAULT 0,
+        rows_updated BIGINT NOT NULL DEFAULT 0,
+        rows_deleted BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP NOT NULL DEFAULT now()
+    )
+"""
+
+BUMP_VERSION_SQL = """
+    INSERT INTO city_data_versions (city, version, rows_inserted, rows_updated, rows_deleted)
+    VALUES (%s, 1, %s, %s, %s)
+    ON CONFLICT (city) DO UPDATE SET
+        version = city_data_versions.version + 1,
+        rows_inserted = EXCLUDED.rows_inserted,
+        rows_updated = EXCLUDED.rows_updated,
+        rows_deleted = EXCLUDED.rows_deleted,
+        updated_at = now()
+    RETURNING version
+"""
+
+
+def bump_data_version(cur, city_name: str, inserted: int = 0, updated: int = 0, deleted: int = 0) -> int:
+    """导入时更新城市数据版本（psycopg2），返回新版本号"""
+    cur.execute(CREATE_VERSIONS_TABLE_SQL)
+    cur.execute(BUMP_VERSION_SQL, (city_name, inserted, updated, deleted))
+    return cur.fetchone()[0]
+
+
+class DataVersionRegistry:
+    """跟踪各城市的数据版本，版本变化时通知监听者"""
+
+    def __init__(self, db, poll_seconds: float = 60):
+        self._db = db
+        self.poll_seconds = poll_seconds
+        self.versions: Dict[str, int] = {}
+        # 各城市最近一次导入的时间（Unix 时间戳）
+        self.updated_at: Dict[str, float] = {}
+        self._listeners: List[Callable] = []
+        self._task = None
+
+    def add_listener(self, callback: Callable):
+        """注册 callback(city, version)，可以是普通函数或协程函数"""
+        self._listeners.append(callback)
+
+    def get(self, city_name: str) -> int:
+        """城市当前的数据版本，没有记录时为 0"""
+        return self.versions.get(city_name, 0)
+
+    async def _fetch(self) -> Dict[str, tuple]:
+        if not await self._db.fetchval("SELECT to_regclass('city_data_versions') IS NOT NULL"):
+            return {}
+        rows = await self._db.fetch(
+            "SELECT city, version, EXTRACT(EPOCH FROM updated_at)::float8 AS updated_at FROM city_data_versions"
+        )
+        return {row['city']: (row['version'], row['updated_at']) for row in rows}
+
+    async def load(self):
+        """启动时读取当前版本，不触发回调"""
+        latest = await self._fetch()
+        self.versions = {city: version for city, (version, _) in latest.items()}
+        self.updated_at = {city: updated_at for city, (_, updated_at) in latest.items()}
+
+    async def check(self) -> List[str]:
+        """重新读取版本，返回数据有变化的城市"""
+        latest = await self._fetch()
+        changed = [city for city, (version, _) in latest.items() if self.versions.get(city) != version]
+        for city in changed:
+            version, updated_at = latest[city]
+            logger.info(f"Data version of {city} changed to {version}")
+            for callback in self._listeners:
+                try:
+                    result = callback(city, version)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    logger.error(f"Failed to apply data version {version} for {city}: {e}")
+            # 回调完成（新快照就绪）后再切换版本，避免旧快照的结果记在新版本下
+            self.versions[city] = version
+            self.updated_at[city] = updated_at
+        return changed
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"Failed to check data versions: {e}")
+
+    def start(self):
+        if self._task is None and self.poll_seconds > 0:
+            self._task = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,118 @@
+"""
+散点接口的视口筛选与抽稀
+
+散点数据可以带上视口参数，不传时仍返回整个城市：
+    bbox        min_lng,min_lat,max_lng,max_lat，只返回范围内的房源
+    zoom        低于 CLUSTER_MAX_ZOOM 时按屏幕网格（CLUSTER_PIXELS 像素）聚合，
+                每个网格只保留一个代表点，cluster_size 为网格内的房源数
+    max_points  返回的点数上限，超过时按优先级抽稀
+
+代表点和抽稀都按房源的固定优先级（host_id 与坐标的哈希）选择，平移、缩放后同一房源
+是否显示保持稳定。快照已经在内存中，范围筛选直接比较坐标，不再查询数据库。
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+
+CLUSTER_MAX_ZOOM = 14
+CLUSTER_PIXELS = 32
+DEFAULT_MAX_POINTS = 5000
+MAX_POINTS_LIMIT = 50000
+# Web Mercator 瓦片的像素大小
+TILE_PIXELS = 256
+
+
+def parse_bbox(bbox: Optional[str]) -> Optional[Tuple[float, float, float, float]]:
+    """解析 min_lng,min_lat,max_lng,max_lat，格式错误时抛出 ValueError"""
+    if not bbox:
+        return None
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(value) for value in bbox.split(','))
+    except ValueError:
+        raise ValueError("bbox must be min_lng,min_lat,max_lng,max_lat")
+    if min_lng > max_lng or min_lat > max_lat:
+        raise ValueError("bbox minimum must not exceed its maximum")
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def _mix(values: np.ndarray) -> np.ndarray:
+    """splitmix64 的混合步骤"""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def listing_priority(snapshot, idx: np.ndarray) -> np.ndarray:
+    """房源的固定优先级，值越小越优先，与快照中的位置无关"""
+    with np.errstate(over='ignore'):
+        host = _mix(snapshot.host_id[idx].astype(np.uint64))
+        lat = _mix(snapshot.lat[idx].view(np.uint64) ^ host)
+        return _mix(snapshot.lng[idx].view(np.uint64) ^ lat)
+
+
+class Viewport:
+    """视口参数，is_set 为 False 时不做任何筛选"""
+
+    def __init__(self, bbox: Optional[str] = None, zoom: Optional[float] = None, max_points: Optional[int] = None):
+        self.bbox = parse_bbox(bbox)
+        self.zoom = zoom
+        if max_points is not None and not 1 <= max_points <= MAX_POINTS_LIMIT:
+            raise ValueError(f"max_points must be between 1 and {MAX_POINTS_LIMIT}")
+        self.is_set = self.bbox is not None or zoom is not None or max_points is not None
+        self.max_points = max_points or DEFAULT_MAX_POINTS
+
+    @property
+    def key(self) -> tuple:
+        """用于缓存和请求合并的键"""
+        return (self.bbox, self.zoom, self.max_points) if self.is_set else ()
+
+    def apply(self, snapshot, idx: np.ndarray):
+        """
+        返回 (idx, cluster_size, info)：idx 为保留的房源（保持原顺序），
+        cluster_size 为各代表点所在网格的房源数，没有聚合时为 None
+        """
+        if not self.is_set:
+            return idx, None, None
+
+        if self.bbox is not None:
+            min_lng, min_lat, max_lng, max_lat = self.bbox
+            lat, lng = snapshot.lat[idx], snapshot.lng[idx]
+            idx = idx[(lng >= min_lng) & (lng <= max_lng) & (lat >= min_lat) & (lat <= max_lat)]
+        total = len(idx)
+
+        cluster_size = None
+        if self.zoom is not None and self.zoom < CLUSTER_MAX_ZOOM and len(idx) > 1:
+            idx, cluster_size = self._cluster(snapshot, idx)
+
+        thinned = len(idx) > self.max_points
+        if thinned:
+            keep = np.sort(np.argpartition(listing_priority(snapshot, idx), self.max_points - 1)[:self.max_points])
+            idx = idx[keep]
+            if cluster_size is not None:
+                cluster_size = cluster_size[keep]
+
+        return idx, cluster_size, {
+            'total_in_view': total,
+            'clustered': cluster_size is not None,
+            'thinned': thinned
+        }
+
+    def _cluster(self, snapshot, idx: np.ndarray):
+        """按屏幕网格聚合，每个网格保留优先级最高的房源"""
+        wx, wy = snapshot.world_coords()
+        scale = (2 ** self.zoom) * TILE_PIXELS / CLUSTER_PIXELS
+        gx = np.floor(wx[idx] * scale).astype(np.int64)
+        gy = np.floor(wy[idx] * scale).astype(np.int64)
+        grid = gx * (int(scale) + 1) + gy
+
+        order = np.lexsort((listing_priority(snapshot, idx), grid))
+        grid = grid[order]
+        first = np.flatnonzero(np.r_[True, grid[1:] != grid[:-1]])
+        sizes = np.diff(np.r_[first, len(order)]).astype(np.uint32)
+
+        # 代表点按原顺序返回
+        representatives = order[first]
+        restore = np.argsort(representatives)
+        return idx[representatives[restore]], sizes[restore]
@@ -0,0 +1,218 @@
+"""
+逐年房东分级统计（yearly_stats）
+
+以 房东 × 年份 的累计房源矩阵一次性计算所有年份的分级门槛、房东数和房源数：
+每个房东在首条房源之后的年份都会被计入（累计值向后延续），即使当年没有新增房源。
+分级规则与 utils/classifier.py 相同，年份按 first_review 的自然年计算。
+
+结果按 (city, 数据版本) 保存在 yearly_stats_cache 表中，并在进程内缓存；
+数据版本为 0（没有版本记录）时只做进程内缓存。
+"""
+import asyncio
+import json
+from typing import Optional
+
+import numpy as np
+
+from utils.cache import LRUCache
+from utils.logger import logger
+from utils.timing import stage
+
+CREATE_YEARLY_STATS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS yearly_stats_cache (
+        city TEXT NOT NULL,
+        version BIGINT NOT NULL,
+        stats TEXT NOT NULL,
+        computed_at TIMESTAMP NOT NULL DEFAULT now(),
+        PRIMARY KEY (city, version)
+    )
+"""
+
+# 接口返回中各等级的顺序
+CATEGORY_ORDER = ('single_host', 'dual_host', 'highly_commercial', 'commercial', 'semi_commercial')
+
+
+def _percentages(values: dict) -> dict:
+    total = sum(values.values())
+    return {
+        category: round(value / total * 100, 2) if total else 0.0
+        for category, value in values.items()
+    }
+
+
+def compute_yearly_stats(host_ids: np.ndarray, years: np.ndarray) -> dict:
+    """由每条房源的 (host_id, 首次评论年份) 计算 yearly_stats 接口的返回值"""
+    host_ids = np.asarray(host_ids, dtype=np.int64)
+    years = np.asarray(years, dtype=np.int64)
+    if len(host_ids) == 0:
+        return {
+            "yearly_stats": {},
+            "year_range": {
+                "start": None,
+                "end": None
+            }
+        }
+
+    # 房东 × 年份 累计房源数，行按 host_id 升序
+    hosts, host_code = np.unique(host_ids, return_inverse=True)
+    min_year, max_year = int(years.min()), int(years.max())
+    cumulative = np.zeros((len(hosts), max_year - min_year + 1), dtype=np.int32)
+    np.add.at(cumulative, (host_code.reshape(-1), years - min_year), 1)
+    np.cumsum(cumulative, axis=1, out=cumulative)
+
+    # 第一年只作为累计起点，与原接口一致从 min_year + 1 开始统计
+    cumulative = cumulative[:, 1:]
+    if cumulative.shape[1] == 0:
+        return {
+            "yearly_stats": {},
+            "year_range": {
+                "start": min_year + 1,
+                "end": max_year
+            }
+        }
+
+    # 每列按房源数降序排列（稳定排序，房源数相同时 host_id 小的在前）
+    order = np.argsort(-cumulative, axis=0, kind='stable')
+    ranked = np.take_along_axis(cumulative, order, axis=0)
+
+    # 房源数 > 2 的房东排在每列最前面，按排名划分等级
+    n_multi = (ranked > 2).sum(axis=0)
+    p5 = np.where(n_multi > 0, np.maximum(1, (n_multi * 0.05).astype(np.int64)), 0)
+    p15 = np.where(n_multi > 0, np.maximum(p5 + 1, (n_multi * 0.15).astype(np.int64)), 0)
+    p5 = np.minimum(p5, n_multi)
+    p15 = np.minimum(p15, n_multi)
+
+    rank = np.arange(len(hosts))[:, None]
+    masks = {
+        'single_host': ranked == 1,
+        'dual_host': ranked == 2,
+        'highly_commercial': rank < p5,
+        'commercial': (rank >= p5) & (rank < p15),
+        'semi_commercial': (rank >= p15) & (rank < n_multi)
+    }
+
+    counts = {category: mask.sum(axis=0) for category, mask in masks.items()}
+    listing_counts = {category: np.where(mask, ranked, 0).sum(axis=0) for category, mask in masks.items()}
+    big = np.iinfo(np.int32).max
+    minimums = {category: np.where(mask, ranked, big).min(axis=0) for category, mask in masks.items()}
+    maximums = {category: np.where(mask, ranked, 0).max(axis=0) for category, mask in masks.items()}
+
+    yearly_stats = {}
+    for column, year in enumerate(range(min_year + 1, max_year + 1)):
+        thresholds = {
+            "single_host": {"min": 1, "max": 1},
+            "dual_host": {"min": 2, "max": 2}
+        }
+        for category in ('highly_commercial', 'commercial', 'semi_commercial'):
+            present = counts[category][column] > 0
+            thresholds[category] = {
+                "min": int(minimums[category][column]) if present else None,
+                "max": int(maximums[category][column]) if present else None
+            }
+
+        year_counts = {category: int(counts[category][column]) for category in CATEGORY_ORDER}
+        year_listings = {category: int(listing_counts[category][column]) for category in CATEGORY_ORDER}
+        yearly_stats[str(year)] = {
+            "thresholds": thresholds,
+            "counts": year_counts,
+            "percentages": _percentages(year_counts),
+            "listing_counts": year_listings,
+            "listing_percentages": _percentages(year_listings)
+        }
+
+    return {
+        "yearly_stats": yearly_stats,
+        "year_range": {
+            "start": min_year + 1,
+            "end": max_year
+        }
+    }
+
+
+def snapshot_yearly_stats(snapshot) -> dict:
+    reviewed = snapshot.review_year > 0
+    return compute_yearly_stats(snapshot.host_id[reviewed], snapshot.review_year[reviewed])
+
+
+class YearlyStats:
+    """缓存中的 yearly_stats 结果"""
+
+    def __init__(self, payload: dict, encoded: str, source=None):
+        self.payload = payload
+        self.encoded = encoded
+        # 生成该结果的快照，快照刷新后据此判断缓存是否过期
+        self.source = source
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.encoded) * 2
+
+
+class YearlyStatsService:
+    """按 (city, 数据版本) 缓存 yearly_stats，并持久化到数据库"""
+
+    def __init__(self, db, cache: LRUCache = None):
+        self._db = db
+        self.cache = cache or LRUCache()
+        self._table_ready = False
+
+    async def _load(self, city_name: str, version: int) -> Optional[str]:
+        if not await self._db.fetchval("SELECT to_regclass('yearly_stats_cache') IS NOT NULL"):
+            return None
+        return await self._db.fetchval(
+            "SELECT stats FROM yearly_stats_cache WHERE city = $1 AND version = $2",
+            city_name, version
+        )
+
+    async def _store(self, city_name: str, version: int, encoded: str):
+        if not self._table_ready:
+            await self._db.execute(CREATE_YEARLY_STATS_TABLE_SQL)
+            self._table_ready = True
+        await self._db.execute("""
+            INSERT INTO yearly_stats_cache (city, version, stats)
+            VALUES ($1, $2, $3)
+            ON CONFLICT (city, version) DO UPDATE SET stats = EXCLUDED.stats, computed_at = now()
+        """, city_name, version, encoded)
+        # 旧版本的结果不再需要
+        await self._db.execute(
+            "DELETE FROM yearly_stats_cache WHERE city = $1 AND version < $2",
+            city_name, version
+        )
+
+    async def get(self, snapshot, version: int = 0) -> dict:
+        key = (snapshot.city, version)
+        stats = self.cache.get(key)
+        if stats is not None and (version > 0 or stats.source is snapshot):
+            return stats.payload
+
+        encoded = None
+        if version > 0:
+            try:
+                encoded = await self._load(snapshot.city, version)
+            except Exception as e:
+                logger.error(f"Failed to read yearly stats for {snapshot.city}: {e}")
+
+        if encoded is not None:
+            payload = json.loads(encoded)
+        else:
+            # 逐年分组计算在线程中执行，不阻塞事件循环
+            with stage('yearly'):
+                payload = await asyncio.to_thread(snapshot_yearly_stats, snapshot)
+            encoded = json.dumps(payload)
+            if version > 0:
+                try:
+                    await self._store(snapshot.city, version, encoded)
+                except Exception as e:
+                    logger.error(f"Failed to persist yearly stats for {snapshot.city}: {e}")
+
+        self.cache.set(key, YearlyStats(payload, encoded, snapshot))
+        return payload
+
+    def invalidate(self, city_name: str = None):
+        if city_name is None:
+            self.cache.invalidate()
+        else:
+            self.cache.invalidate(lambda key: key[0] == city_name)
+
+    def stats(self) -> dict:
+        return self.cache.stats()
@@ -27,4 +27,13 @@ api.interceptors.response.use(response => {
   return Promise.reject(error)
 })
 
+// 每个页面会话一个随机 id，同一 channel 的新请求会让后端放弃旧请求（返回 409）
+const sessionId = Math.random().toString(36).slice(2)
+
+export const supersedeHeaders = (channel) => ({
+  'X-Supersede-Token': `${sessionId}:${channel}`
+})
+
+export const isSuperseded = (error) => error?.response?.status === 409
+
 export default api
@@ -0,0 +1,52 @@
+// 解析后端 format=columns 返回的列式二进制数据（格式见 backend/utils/columnar.py）
+const TYPED_ARRAYS = {
+  float32: Float32Array,
+  float64: Float64Array,
+  uint8: Uint8Array,
+  uint32: Uint32Array,
+  int32: Int32Array,
+  int64: BigInt64Array
+}
+
+export const decodeColumns = (buffer) => {
+  const view = new DataView(buffer)
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4))
+  if (magic !== 'HCOL') {
+    throw new Error('Invalid columns payload')
+  }
+
+  const headerLength = view.getUint32(4, true)
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)))
+  const dataStart = 8 + headerLength
+
+  const columns = {}
+  header.columns.forEach(({ name, dtype, offset, length }) => {
+    const ArrayType = TYPED_ARRAYS[dtype]
+    columns[name] = new ArrayType(buffer, dataStart + offset, length)
+  })
+  return { header, columns }
+}
+
+// 将散点列转换为 GeoJSON Feature 列表
+export const columnsToFeatures = ({ header, columns }) => {
+  const { latitude, longitude, tier, host, hosts, price, processed_price, cluster_size } = columns
+  const features = new Array(latitude.length)
+  for (let i = 0; i < latitude.length; i++) {
+    features[i] = {
+      type: 'Feature',
+      geometry: {
+        type: 'Point',
+        coordinates: [longitude[i], latitude[i]]
+      },
+      properties: {
+        host_id: hosts[host[i]].toString(),
+        host_category: header.tier_names[tier[i]],
+        price: Number.isNaN(price[i]) ? null : `$${price[i]}`,
+        processed_price: Number.isNaN(processed_price[i]) ? null : processed_price[i],
+        // 聚合时代表点所在网格的房源数
+        cluster_size: cluster_size ? cluster_size[i] : 1
+      }
+    }
+  }
+  return features
+}